@@ -0,0 +1,376 @@
+import asyncio
+import logging
+import time
+import uuid
+from collections import defaultdict
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+from database import Database
+from ssh_manager import ServerGroup, SSHManager
+
+logger = logging.getLogger(__name__)
+
+# Завершённые задания хранятся в журнале неделю
+JOURNAL_RETENTION = 7 * 86400
+
+@dataclass
+class BackupJob:
+    db_name: str
+    host: str
+    dbms: str
+    user_id: int
+    notify: Optional[Callable[['BackupJob'], Awaitable[None]]] = None
+    # Сервер, на котором выполняется задание (сохраняется при перезагрузке настроек)
+    manager: Optional[SSHManager] = field(default=None, repr=False)
+    id: str = field(default_factory=lambda: uuid.uuid4().hex)
+    # Готовый .dt, оставшийся после перезапуска: нужно только загрузить его в облако
+    resume_path: Optional[str] = None
+    status: str = "queued"  # queued, running, done, failed
+    position: int = 0
+    result: Optional[str] = None
+    error: Optional[str] = None
+    created_at: float = field(default_factory=time.monotonic)
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    # Последние данные о ходе выгрузки/загрузки (см. ssh_manager._ProgressMeter)
+    progress: Optional[dict] = None
+    # Размеры до и после сжатия и время этапов (см. SSHManager.create_database_backup)
+    stats: dict = field(default_factory=dict)
+    notified_at: float = 0.0
+    # Занимает ли задание слот хоста/СУБД (освобождается после дампа)
+    holds_slot: bool = False
+    # Уведомления по одному заданию отправляются строго по очереди
+    notify_lock: asyncio.Lock = field(default_factory=asyncio.Lock, repr=False)
+
+    @property
+    def key(self) -> Tuple[str, str]:
+        return self.host, self.db_name
+
+@dataclass
+class BackupBatch:
+    """Группа выгрузок с одним общим сообщением о результате"""
+    notify: Callable[['BackupBatch'], Awaitable[None]]
+    jobs: List[BackupJob] = field(default_factory=list)
+    skipped: List[str] = field(default_factory=list)
+    created_at: float = field(default_factory=time.monotonic)
+    notified_at: float = 0.0
+    finished: bool = False
+    notify_lock: asyncio.Lock = field(default_factory=asyncio.Lock, repr=False)
+
+    @property
+    def done(self) -> bool:
+        return all(job.status in ("done", "failed") for job in self.jobs)
+
+    @property
+    def succeeded(self) -> List[BackupJob]:
+        return [job for job in self.jobs if job.status == "done"]
+
+class BackupQueue:
+    """Очередь выгрузок с ограничением параллельности на хост и на СУБД"""
+
+    def __init__(self, ssh: ServerGroup, max_per_host: int = 1, max_per_dbms: int = 2,
+                 progress_interval: float = 5, journal: Database = None):
+        self.ssh = ssh
+        # Журнал заданий в SQLite; записи идут по одной в порядке изменений
+        self.journal = journal
+        self._journal_ops: asyncio.Queue = asyncio.Queue()
+        self._journal_writer: Optional[asyncio.Task] = None
+        # Не чаще одного редактирования сообщения о ходе выгрузки за интервал
+        self.progress_interval = progress_interval
+        self.max_per_host = max_per_host
+        self.max_per_dbms = max_per_dbms
+        self._jobs: Dict[Tuple[str, str], BackupJob] = {}
+        self._waiting: List[BackupJob] = []
+        self._running_per_host = defaultdict(int)
+        self._running_per_dbms = defaultdict(int)
+        self._tasks: Set[asyncio.Task] = set()
+
+    def is_active(self, db_name: str, host: str = None) -> bool:
+        return (host or self.ssh.default_host, db_name) in self._jobs
+
+    @property
+    def jobs(self) -> List[BackupJob]:
+        return list(self._jobs.values())
+
+    @property
+    def active_count(self) -> int:
+        return len(self._jobs) - len(self._waiting)
+
+    @property
+    def queued_count(self) -> int:
+        return len(self._waiting)
+
+    def enqueue(self, db_name: str, user_id: int,
+                notify: Callable[[BackupJob], Awaitable[None]] = None,
+                host: str = None) -> Optional[BackupJob]:
+        """Ставит выгрузку в очередь. Возвращает None, если эта база уже выгружается"""
+        manager = self.ssh.manager(host)
+        job = BackupJob(
+            db_name=db_name,
+            host=manager.pool.host,
+            dbms=manager.dbms,
+            user_id=user_id,
+            notify=notify,
+            manager=manager
+        )
+        return self.submit(job)
+
+    def submit(self, job: BackupJob) -> Optional[BackupJob]:
+        if job.key in self._jobs:
+            return None
+
+        self._jobs[job.key] = job
+        self._waiting.append(job)
+        self._journal(job, "queued")
+        self._dispatch()
+        return job
+
+    def enqueue_batch(self, databases: List[Tuple[str, str]], user_id: int,
+                      notify: Callable[[BackupBatch], Awaitable[None]]) -> BackupBatch:
+        """Ставит в очередь несколько баз (хост, имя); о ходе сообщается одним сообщением"""
+        batch = BackupBatch(notify=notify)
+
+        async def on_job_update(job: BackupJob):
+            await self._on_batch_update(batch)
+
+        for host, db_name in databases:
+            job = self.enqueue(db_name, user_id, on_job_update, host)
+            if job is None:
+                batch.skipped.append(db_name)
+            else:
+                batch.jobs.append(job)
+
+        if not batch.jobs:
+            batch.finished = True
+            self._spawn(self._on_batch_update(batch, force=True))
+        return batch
+
+    async def _on_batch_update(self, batch: BackupBatch, force: bool = False):
+        now = time.monotonic()
+        if not force:
+            if batch.finished:
+                return
+            if batch.done:
+                batch.finished = True
+            elif now - batch.notified_at < self.progress_interval:
+                # Промежуточные состояния пакета показываем не чаще интервала
+                return
+        batch.notified_at = now
+        async with batch.notify_lock:
+            await batch.notify(batch)
+
+    def _spawn(self, coro) -> asyncio.Task:
+        task = asyncio.ensure_future(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    def _on_progress(self, job: BackupJob, info: dict):
+        job.progress = info
+        now = time.monotonic()
+        if now - job.notified_at >= self.progress_interval and not job.notify_lock.locked():
+            job.notified_at = now
+            self._notify(job)
+
+    def _notify(self, job: BackupJob):
+        if job.notify:
+            self._spawn(self._safe_notify(job))
+
+    @staticmethod
+    async def _safe_notify(job: BackupJob):
+        try:
+            async with job.notify_lock:
+                await job.notify(job)
+        except Exception:
+            logger.exception("Error notifying about backup %s", job.db_name)
+
+    def _dispatch(self):
+        """Запускает ожидающие задания, для которых есть свободные слоты"""
+        for job in list(self._waiting):
+            if (self._running_per_host[job.host] < self.max_per_host
+                    and self._running_per_dbms[job.dbms] < self.max_per_dbms):
+                self._waiting.remove(job)
+                self._running_per_host[job.host] += 1
+                self._running_per_dbms[job.dbms] += 1
+                job.holds_slot = True
+                job.status = "running"
+                job.position = 0
+                self._spawn(self._run(job))
+
+        # Сообщаем оставшимся в очереди их новую позицию
+        for position, job in enumerate(self._waiting, 1):
+            if job.position != position:
+                job.position = position
+                self._notify(job)
+
+    async def _run(self, job: BackupJob):
+        job.started_at = time.monotonic()
+        self._notify(job)
+        try:
+            if job.resume_path:
+                # Дамп уже сделан до перезапуска - сервер 1С не нагружаем
+                self._release(job)
+                await self._journal(job, "uploading", file_path=job.resume_path)
+                job.result = await job.manager.upload_to_cloud(
+                    job.resume_path, job.db_name,
+                    progress=lambda info: self._on_progress(job, info),
+                    stats=job.stats
+                )
+            else:
+                job.result = await job.manager.create_database_backup(
+                    job.db_name,
+                    progress=lambda info: self._on_progress(job, info),
+                    on_stage=lambda stage, path: self._on_stage(job, stage, path),
+                    stats=job.stats
+                )
+            job.status = "done" if job.result else "failed"
+            if not job.result:
+                # Причина из вывода ibcmd/rclone, если она известна
+                job.error = job.stats.get("error")
+        except Exception as e:
+            job.status = "failed"
+            job.error = str(e)
+        finally:
+            job.finished_at = time.monotonic()
+            self._jobs.pop(job.key, None)
+            self._notify(job)
+            self._release(job)
+        # При остановке бота задание прерывается раньше и остаётся в журнале незавершённым
+        self._journal(job, job.status, result=job.result, error=job.error)
+
+    async def _on_stage(self, job: BackupJob, stage: str, path: str):
+        # Путь к файлу должен попасть в журнал до того, как с ним что-то произойдёт
+        await self._journal(job, stage, file_path=path)
+        if stage == "uploading":
+            self._release(job)
+
+    def _release(self, job: BackupJob):
+        """Освобождает слот хоста/СУБД: загрузка в облако идёт параллельно со следующими дампами"""
+        if not job.holds_slot:
+            return
+        job.holds_slot = False
+        self._running_per_host[job.host] -= 1
+        self._running_per_dbms[job.dbms] -= 1
+        self._dispatch()
+
+    def _journal(self, job: BackupJob, status: str, **fields) -> asyncio.Future:
+        """Записывает состояние задания; future завершается после записи"""
+        future = asyncio.get_event_loop().create_future()
+        if self.journal is None:
+            future.set_result(None)
+            return future
+        self._journal_ops.put_nowait((job, status, fields, future))
+        if self._journal_writer is None:
+            self._journal_writer = asyncio.ensure_future(self._write_journal())
+        return future
+
+    async def _write_journal(self):
+        while True:
+            job, status, fields, future = await self._journal_ops.get()
+            try:
+                await self.journal.save_backup_job(
+                    job.id, job.host, job.db_name, job.user_id, status, **fields
+                )
+            except Exception as e:
+                logger.error("Failed to journal backup %s: %s", job.db_name, e)
+            finally:
+                if not future.done():
+                    future.set_result(None)
+                self._journal_ops.task_done()
+
+    async def recover(self) -> Tuple[List[BackupJob], List[dict], List[dict]]:
+        """Разбирает задания, прерванные перезапуском.
+
+        Вызывается до запуска очереди и приёма команд: удаляются только файлы,
+        каналы и временные каталоги самих прерванных заданий.
+        Недовыгруженные файлы удаляются вместе с недозагруженными копиями
+        в облаке; готовые, но не загруженные .dt (.dt.zst) и не начатые задания
+        возвращаются для повторной постановки в очередь (submit). Загрузка,
+        чей файл уже удалён, и потоковая выгрузка ищутся в облаке.
+        Возвращает (задания для запуска, записи журнала о проваленных,
+        записи о завершённых до перезапуска со ссылкой в result).
+        """
+        if self.journal is None:
+            return [], [], []
+        await self.journal.delete_finished_backup_jobs(time.time() - JOURNAL_RETENTION)
+
+        resumed, failed, completed = [], [], []
+        for record in await self.journal.get_unfinished_backup_jobs():
+            if record["host"] not in self.ssh.hosts:
+                record["error"] = "сервер удалён из настроек"
+            else:
+                manager = self.ssh.manager(record["host"])
+                job = BackupJob(
+                    db_name=record["db_name"],
+                    host=record["host"],
+                    dbms=manager.dbms,
+                    user_id=record["user_id"],
+                    manager=manager,
+                    id=record["id"]
+                )
+                path = record["file_path"]
+                try:
+                    if record["status"] == "queued":
+                        resumed.append(job)
+                        continue
+                    if (record["status"] in ("compressing", "uploading") and path
+                            and await manager.backup_file_exists(path)):
+                        if record["status"] == "compressing":
+                            # Сжатие не закончилось - загружаем несжатый дамп
+                            await manager.remove_partial_backup(f"{path}.zst")
+                        job.resume_path = path
+                        resumed.append(job)
+                        continue
+                    if record["status"] == "compressing" and path:
+                        # zstd удаляет дамп только после сжатия: .zst без .dt - готовая копия
+                        if await manager.backup_file_exists(f"{path}.zst"):
+                            job.resume_path = f"{path}.zst"
+                            resumed.append(job)
+                            continue
+                    if path and (record["status"] == "uploading" or path.endswith(".fifo")):
+                        # Локальный файл удаляется только после загрузки, а потоковая
+                        # выгрузка пишет манифест в самом конце - копия может быть уже
+                        # в облаке, если бот остановился перед записью итога
+                        link = await manager.find_uploaded_backup(path, record["db_name"])
+                        if link:
+                            # Каналы потоковой выгрузки и её временный каталог
+                            await manager.remove_partial_backup(path)
+                            record["result"] = link
+                            logger.info("Backup %s on %s finished before restart",
+                                        record["db_name"], record["host"])
+                            await self.journal.save_backup_job(
+                                record["id"], record["host"], record["db_name"],
+                                record["user_id"], "done", result=link
+                            )
+                            completed.append(record)
+                            continue
+                    if path:
+                        await manager.remove_partial_backup(path, record["db_name"])
+                        if record["status"] == "compressing":
+                            await manager.remove_partial_backup(f"{path}.zst")
+                    record["error"] = "выгрузка прервана перезапуском бота"
+                except Exception as e:
+                    record["error"] = f"не удалось проверить сервер: {e}"
+
+            logger.warning("Backup %s on %s interrupted: %s",
+                           record["db_name"], record["host"], record["error"])
+            await self.journal.save_backup_job(
+                record["id"], record["host"], record["db_name"], record["user_id"],
+                "failed", error=record["error"]
+            )
+            failed.append(record)
+        return resumed, failed, completed
+
+    async def close(self):
+        # Дописываем журнал до отмены заданий
+        if self._journal_writer is not None:
+            try:
+                await asyncio.wait_for(self._journal_ops.join(), 5)
+            except asyncio.TimeoutError:
+                pass
+            self._journal_writer.cancel()
+        for task in list(self._tasks):
+            task.cancel()
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
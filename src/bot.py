@@ -1,12 +1,23 @@
 import asyncio
 import logging
+import signal
+from dataclasses import replace
+from typing import Optional
 from aiogram import Bot, Dispatcher, types
-from aiogram.contrib.fsm_storage.memory import MemoryStorage
 
 from config import load_config
+from context import AppContext
 from database import Database
+import metrics
 from handlers import register_all_handlers
+from handlers.user import resume_backups, select_databases, start_backup_batch
 from middlewares import register_all_middlewares
+from ssh_manager import SSHPool, SSHManager, ServerGroup
+from backup_queue import BackupQueue
+from scheduler import run_daily
+from sender import Sender
+from storage import SQLiteStorage
+from webhook import run_webhook
 
 logger = logging.getLogger(__name__)
 
@@ -14,7 +25,8 @@ async def set_commands(bot: Bot, config):
     # Базовые команды для всех пользователей
     basic_commands = [
         types.BotCommand("start", "Запустить бота"),
-        types.BotCommand("backup", "Создать резервную копию базы")
+        types.BotCommand("backup", "Создать резервную копию базы"),
+        types.BotCommand("backup_all", "Выгрузить все базы")
     ]
     
     # Дополнительные команды для админа
@@ -22,7 +34,10 @@ async def set_commands(bot: Bot, config):
         types.BotCommand("start", "Запустить бота"),
         types.BotCommand("users", "Список всех пользователей"),
         types.BotCommand("pending", "Пользователи в ожидании"),
-        types.BotCommand("backup", "Создать резервную копию базы")
+        types.BotCommand("backup", "Создать резервную копию базы"),
+        types.BotCommand("backup_all", "Выгрузить все базы"),
+        types.BotCommand("refresh", "Обновить список баз 1С"),
+        types.BotCommand("platform", "Версия платформы 1С")
     ]
     
     # Установка обычных команд для всех пользователей
@@ -31,9 +46,130 @@ async def set_commands(bot: Bot, config):
     # Установка расширенных команд для админа
     await bot.set_my_commands(
         admin_commands,
-        scope=types.BotCommandScopeChat(chat_id=int(config.tg_bot.admin_id))
+        scope=types.BotCommandScopeChat(chat_id=config.tg_bot.admin_id)
     )
 
+def create_servers(config, db: Database) -> ServerGroup:
+    hosts = config.ssh.hosts
+    managers = []
+    for host in hosts:
+        ssh_pool = SSHPool(
+            host=host,
+            username=config.ssh.username,
+            password=config.ssh.password,
+            max_channels=config.ssh.max_channels,
+            keepalive_interval=config.ssh.keepalive_interval
+        )
+        managers.append(SSHManager(
+            pool=ssh_pool,
+            db_server=config.ssh.db_server,
+            db_user=config.ssh.db_user,
+            db_pwd=config.ssh.db_pwd,
+            user=config.ssh.user,
+            user_pwd=config.ssh.user_pwd,
+            rclone_remote=config.ssh.rclone_remote,
+            # При нескольких серверах одноимённые базы не должны смешиваться в облаке
+            rclone_path=(f"{config.ssh.rclone_path}/{host}" if len(hosts) > 1
+                         else config.ssh.rclone_path),
+            databases_cache_ttl=config.ssh.databases_cache_ttl,
+            progress_interval=config.backup.progress_interval,
+            streaming=config.backup.streaming,
+            compression=config.backup.compression,
+            zstd_level=config.backup.zstd_level,
+            zstd_threads=config.backup.zstd_threads,
+            keep_last=config.backup.keep_last,
+            skip_identical=config.backup.skip_identical,
+            nice=config.backup.nice,
+            ionice_class=config.backup.ionice_class,
+            ionice_level=config.backup.ionice_level,
+            bwlimit=config.backup.bwlimit,
+            throttle_interval=config.backup.throttle_interval,
+            max_load=config.backup.max_load,
+            max_iowait=config.backup.max_iowait,
+            max_sessions=config.backup.max_sessions,
+            max_pause=config.backup.max_pause,
+            upload_streams=config.backup.upload_streams,
+            upload_chunk_size=config.backup.upload_chunk_mb * 1024 * 1024,
+            upload_retries=config.backup.upload_retries,
+            store=db,
+            platform_version=config.ssh.platform_version,
+            platform_ttl=config.ssh.platform_ttl
+        ))
+    return ServerGroup(managers, timeout=config.ssh.host_timeout)
+
+def create_backup_queue(config, ssh: ServerGroup, db: Database) -> BackupQueue:
+    return BackupQueue(
+        ssh,
+        max_per_host=config.backup.max_per_host,
+        max_per_dbms=config.backup.max_per_dbms,
+        progress_interval=config.backup.progress_interval,
+        journal=db
+    )
+
+def start_schedule(context: AppContext) -> Optional[asyncio.Task]:
+    """Ночная пакетная выгрузка по расписанию, итог получает админ"""
+    config = context.config
+    if not config.backup.schedule:
+        return None
+    admin_id = config.tg_bot.admin_id
+
+    async def scheduled_backup():
+        databases, unavailable = await context.ssh.get_1c_databases()
+        if unavailable:
+            context.sender.notify(
+                admin_id, f"⚠️ Ночная выгрузка: не ответили серверы {', '.join(unavailable)}"
+            )
+        items = select_databases(databases, config.backup.schedule_databases)
+        if items:
+            await start_backup_batch(context.sender, context.backups, admin_id, admin_id, items)
+
+    return asyncio.create_task(run_daily(config.backup.schedule, scheduled_backup))
+
+async def retire_servers(old_ssh: ServerGroup, backups: BackupQueue):
+    """Закрывает старые SSH-пулы, когда на них не останется выгрузок"""
+    while any(job.manager in old_ssh.managers for job in backups.jobs):
+        await asyncio.sleep(5)
+    await old_ssh.close()
+
+async def reload_config(bot: Bot, db: Database, context: AppContext):
+    try:
+        config = load_config(override=True)
+    except Exception as e:
+        logger.error("Config reload failed, keeping current settings: %s", e)
+        return
+
+    old = context.config
+    if config.tg_bot.token != old.tg_bot.token:
+        logger.warning("BOT_TOKEN change requires a restart and is ignored")
+        config = replace(config, tg_bot=replace(config.tg_bot, token=old.tg_bot.token))
+
+    if config.webhook != old.webhook or config.metrics != old.metrics:
+        logger.warning("Webhook and metrics settings change requires a restart and is ignored")
+        config = replace(config, webhook=old.webhook, metrics=old.metrics)
+
+    if config.ssh != old.ssh or config.backup != old.backup:
+        # Новые задания идут через новые серверы, начатые доделываются на старых.
+        # У новых серверов свои кэши, а кнопки /backup, выданные для старых,
+        # перестают действовать (ServerGroup.host_by_key)
+        old_ssh = context.ssh
+        context.ssh = create_servers(config, db)
+        context.backups.ssh = context.ssh
+        asyncio.create_task(retire_servers(old_ssh, context.backups))
+
+    backups = context.backups
+    backups.max_per_host = config.backup.max_per_host
+    backups.max_per_dbms = config.backup.max_per_dbms
+    backups.progress_interval = config.backup.progress_interval
+
+    # Подмена одним присваиванием - обработчики видят целиком старую или новую версию
+    context.config = config
+
+    if context.schedule_task:
+        context.schedule_task.cancel()
+    context.schedule_task = start_schedule(context)
+    await set_commands(bot, config)
+    logger.info("Config reloaded")
+
 async def main():
     # Настройка логирования
     logging.basicConfig(
@@ -41,31 +177,92 @@ async def main():
         format="%(asctime)s - %(levelname)s - %(name)s - %(message)s",
     )
 
-    # Загрузка конфигурации
+    # Загрузка конфигурации (один раз; дальше - только перезагрузка по SIGHUP)
     config = load_config()
     
-    # Инициализация бота и диспетчера
-    storage = MemoryStorage()
-    bot = Bot(token=config.tg_bot.token)
-    dp = Dispatcher(bot, storage=storage)
-
     # Инициализация базы данных
     db = Database()
     await db.create_tables()
+
+    # Инициализация бота и диспетчера; состояния FSM хранятся в той же базе
+    storage = SQLiteStorage(db, ttl=config.tg_bot.fsm_ttl)
+    await storage.purge_expired()
+    bot = Bot(token=config.tg_bot.token)
+    dp = Dispatcher(bot, storage=storage)
+
+    # Серверы 1С: по одному пулу SSH-подключений на хост
+    ssh = create_servers(config, db)
+
+    # Очередь выгрузок, выполняемых в фоне
+    backups = create_backup_queue(config, ssh, db)
+    # Все исходящие сообщения идут через общий ограничитель скорости
+    sender = Sender(bot)
+    context = AppContext(config, ssh, backups, sender)
+
+    # Выгрузки, прерванные прошлым перезапуском, разбираются до приёма команд
+    # и расписания: новые выгрузки не должны начаться, пока убираются остатки
+    # прерванных. Уведомления и повторный запуск - уже в фоне
+    try:
+        recovered = await backups.recover()
+    except Exception:
+        logger.exception("Error recovering interrupted backups")
+        recovered = [], [], []
+    recovery = asyncio.create_task(resume_backups(sender, backups, *recovered))
     
+    # Метрики включаются до регистрации middleware: выключенные ничего не стоят
+    metrics_runner = None
+    if config.metrics.enabled:
+        metrics.setup(
+            active=lambda: context.backups.active_count,
+            queued=lambda: context.backups.queued_count
+        )
+        metrics_runner = await metrics.start_server(config.metrics.host, config.metrics.port)
+
     # Регистрация middleware и обработчиков
-    register_all_middlewares(dp, db)
+    register_all_middlewares(dp, db, context)
     register_all_handlers(dp)
 
     # Установка команд бота
     await set_commands(bot, config)
 
+    context.schedule_task = start_schedule(context)
+
+    # kill -HUP перечитывает настройки без остановки бота
+    if hasattr(signal, "SIGHUP"):
+        asyncio.get_running_loop().add_signal_handler(
+            signal.SIGHUP, lambda: asyncio.ensure_future(reload_config(bot, db, context))
+        )
+
+    # SIGTERM (docker stop) завершает работу так же аккуратно, как Ctrl+C
+    stop = asyncio.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        asyncio.get_running_loop().add_signal_handler(sig, stop.set)
+
     # Запуск бота
     try:
-        await dp.start_polling()
+        if config.webhook.enabled:
+            await run_webhook(dp, config.webhook, stop)
+        else:
+            # Оставшийся после webhook-режима адрес мешает getUpdates
+            await bot.delete_webhook()
+            polling = asyncio.create_task(dp.start_polling())
+            await stop.wait()
+            # Не ждём окончания текущего long poll запроса
+            dp.stop_polling()
+            polling.cancel()
+            await asyncio.gather(polling, return_exceptions=True)
     finally:
+        recovery.cancel()
+        if context.schedule_task:
+            context.schedule_task.cancel()
         await dp.storage.close()
         await dp.storage.wait_closed()
+        await context.backups.close()
+        await sender.close()
+        await context.ssh.close()
+        await db.close()
+        if metrics_runner:
+            await metrics_runner.cleanup()
         await bot.session.close()
 
 if __name__ == '__main__':
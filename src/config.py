@@ -1,13 +1,18 @@
 from dataclasses import dataclass
 from os import getenv
+from typing import List, Tuple
 from dotenv import load_dotenv
 
-@dataclass
+from scheduler import parse_times
+
+@dataclass(frozen=True)
 class TgBot:
     token: str
-    admin_id: str
+    admin_id: int
+    # Сколько хранится неизменявшееся состояние FSM (секунды)
+    fsm_ttl: int = 86400
 
-@dataclass
+@dataclass(frozen=True)
 class SSH:
     host: str
     username: str
@@ -19,19 +24,95 @@ class SSH:
     user_pwd: str
     rclone_remote: str
     rclone_path: str
+    max_channels: int = 10
+    keepalive_interval: int = 30
+    databases_cache_ttl: int = 300
+    # Явно заданная версия платформы и срок хранения найденных версий (секунды)
+    platform_version: str = None
+    platform_ttl: int = 86400
+    # Сколько ждать ответа каждого сервера при построении меню (секунды)
+    host_timeout: int = 10
+
+    @property
+    def hosts(self) -> List[str]:
+        """SSH_HOST может содержать несколько серверов через запятую"""
+        return [host.strip() for host in self.host.split(",") if host.strip()]
+
+@dataclass(frozen=True)
+class Backup:
+    max_per_host: int = 1
+    max_per_dbms: int = 2
+    progress_interval: int = 5
+    streaming: bool = False
+    # Сжатие копий: None или "zstd" (уровень и число потоков, 0 - все ядра)
+    compression: str = None
+    zstd_level: int = 3
+    zstd_threads: int = 0
+    keep_last: int = 1
+    skip_identical: bool = True
+    # Приоритет процессов выгрузки на сервере 1С (ionice: класс 0 - не менять)
+    # и ограничение скорости rclone (формат --bwlimit, пусто - без ограничения)
+    nice: int = 10
+    ionice_class: int = 2
+    ionice_level: int = 7
+    bwlimit: str = None
+    # Притормаживание по нагрузке: интервал замеров (0 - выключено), пороги
+    # loadavg на ядро, iowait (%) и числа сеансов 1С (0 - не учитывать),
+    # предельная длительность паузы загрузки (секунды)
+    throttle_interval: int = 30
+    max_load: float = 1.5
+    max_iowait: float = 30
+    max_sessions: int = 0
+    max_pause: int = 600
+    # Загрузка в облако: потоки, размер части в МиБ (0 - файл целиком)
+    # и повторы части или файла после ошибки
+    upload_streams: int = 4
+    upload_chunk_mb: int = 0
+    upload_retries: int = 3
+    # Ночная пакетная выгрузка: время запуска "ЧЧ:ММ" и список баз (пусто - все)
+    schedule: Tuple[str, ...] = ()
+    schedule_databases: Tuple[str, ...] = ()
+
+@dataclass(frozen=True)
+class Webhook:
+    # Без включения бот работает через long polling
+    enabled: bool = False
+    # Публичный адрес (https://bot.example.com), на который Telegram шлёт обновления
+    url: str = None
+    path: str = "/webhook"
+    host: str = "0.0.0.0"
+    port: int = 8080
+    # Пусто - случайный секрет при каждом запуске
+    secret: str = None
+
+@dataclass(frozen=True)
+class Metrics:
+    # Prometheus-метрики на http://host:port/metrics (нужен prometheus_client)
+    enabled: bool = False
+    host: str = "0.0.0.0"
+    port: int = 9100
 
-@dataclass
+@dataclass(frozen=True)
 class Config:
     tg_bot: TgBot
     ssh: SSH
+    backup: Backup
+    webhook: Webhook = Webhook()
+    metrics: Metrics = Metrics()
 
-def load_config() -> Config:
-    load_dotenv()
+def load_config(override: bool = False) -> Config:
+    """Читает настройки из окружения и .env.
+
+    override=True нужен при перезагрузке: значения из .env заменяют
+    прочитанные при старте.
+    """
+    load_dotenv(override=override)
     
     return Config(
         tg_bot=TgBot(
             token=getenv("BOT_TOKEN"),
-            admin_id=getenv("ADMIN_ID")
+            admin_id=int(getenv("ADMIN_ID")),
+            fsm_ttl=int(getenv("FSM_TTL", "86400"))
         ),
         ssh=SSH(
             host=getenv("SSH_HOST"),
@@ -43,6 +124,52 @@ def load_config() -> Config:
             user=getenv("USER_1C", "Admin"),
             user_pwd=getenv("USER_1C_PASSWORD", "123"),
             rclone_remote=getenv("RCLONE_REMOTE"),
-            rclone_path=getenv("RCLONE_PATH")
+            rclone_path=getenv("RCLONE_PATH"),
+            max_channels=int(getenv("SSH_MAX_CHANNELS", "10")),
+            keepalive_interval=int(getenv("SSH_KEEPALIVE_INTERVAL", "30")),
+            databases_cache_ttl=int(getenv("DATABASES_CACHE_TTL", "300")),
+            platform_version=getenv("PLATFORM_VERSION") or None,
+            platform_ttl=int(getenv("PLATFORM_TTL", "86400")),
+            host_timeout=int(getenv("SSH_HOST_TIMEOUT", "10"))
+        ),
+        backup=Backup(
+            max_per_host=int(getenv("BACKUP_MAX_PER_HOST", "1")),
+            max_per_dbms=int(getenv("BACKUP_MAX_PER_DBMS", "2")),
+            progress_interval=int(getenv("BACKUP_PROGRESS_INTERVAL", "5")),
+            streaming=getenv("BACKUP_STREAMING", "0").lower() in ("1", "true", "yes"),
+            # BACKUP_STREAM_COMPRESSION - прежнее имя, действовавшее только на потоковую выгрузку
+            compression=(getenv("BACKUP_COMPRESSION")
+                         or getenv("BACKUP_STREAM_COMPRESSION") or None),
+            zstd_level=int(getenv("BACKUP_ZSTD_LEVEL", "3")),
+            zstd_threads=int(getenv("BACKUP_ZSTD_THREADS", "0")),
+            keep_last=int(getenv("BACKUP_KEEP_LAST", "1")),
+            skip_identical=getenv("BACKUP_SKIP_IDENTICAL", "1").lower() in ("1", "true", "yes"),
+            nice=int(getenv("BACKUP_NICE", "10")),
+            ionice_class=int(getenv("BACKUP_IONICE_CLASS", "2")),
+            ionice_level=int(getenv("BACKUP_IONICE_LEVEL", "7")),
+            bwlimit=getenv("BACKUP_BWLIMIT") or None,
+            throttle_interval=int(getenv("THROTTLE_INTERVAL", "30")),
+            max_load=float(getenv("THROTTLE_MAX_LOAD", "1.5")),
+            max_iowait=float(getenv("THROTTLE_MAX_IOWAIT", "30")),
+            max_sessions=int(getenv("THROTTLE_MAX_SESSIONS", "0")),
+            max_pause=int(getenv("THROTTLE_MAX_PAUSE", "600")),
+            upload_streams=int(getenv("BACKUP_UPLOAD_STREAMS", "4")),
+            upload_chunk_mb=int(getenv("BACKUP_UPLOAD_CHUNK_MB", "0")),
+            upload_retries=int(getenv("BACKUP_UPLOAD_RETRIES", "3")),
+            schedule=tuple(parse_times(getenv("BACKUP_SCHEDULE", ""))),
+            schedule_databases=tuple(getenv("BACKUP_SCHEDULE_DATABASES", "").split())
+        ),
+        webhook=Webhook(
+            enabled=getenv("WEBHOOK_ENABLED", "0").lower() in ("1", "true", "yes"),
+            url=getenv("WEBHOOK_URL") or None,
+            path=getenv("WEBHOOK_PATH", "/webhook"),
+            host=getenv("WEBHOOK_HOST", "0.0.0.0"),
+            port=int(getenv("WEBHOOK_PORT", "8080")),
+            secret=getenv("WEBHOOK_SECRET") or None
+        ),
+        metrics=Metrics(
+            enabled=getenv("METRICS_ENABLED", "0").lower() in ("1", "true", "yes"),
+            host=getenv("METRICS_HOST", "0.0.0.0"),
+            port=int(getenv("METRICS_PORT", "9100"))
         )
     ) 
\ No newline at end of file
@@ -0,0 +1,22 @@
+import asyncio
+from typing import Optional
+
+from config import Config
+from backup_queue import BackupQueue
+from sender import Sender
+from ssh_manager import ServerGroup
+
+class AppContext:
+    """Текущая конфигурация и созданные по ней сервисы.
+
+    При перезагрузке (SIGHUP) атрибуты заменяются целиком, поэтому
+    обработчик получает либо старую, либо новую конфигурацию, но не их смесь.
+    """
+
+    def __init__(self, config: Config, ssh: ServerGroup, backups: BackupQueue,
+                 sender: Sender):
+        self.config = config
+        self.ssh = ssh
+        self.backups = backups
+        self.sender = sender
+        self.schedule_task: Optional[asyncio.Task] = None
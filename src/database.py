@@ -1,12 +1,86 @@
+import asyncio
+import time
 import aiosqlite
-from typing import List, Optional
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+
+import metrics
 
 class Database:
-    def __init__(self, db_path: str = "data/bot.db"):
+    def __init__(self, db_path: str = "data/bot.db",
+                 user_cache_size: int = 1024, user_cache_ttl: int = 300):
         self.db_path = db_path
+        self._conn: Optional[aiosqlite.Connection] = None
+        # Все записи идут через один "писатель", чтобы commit'ы не перемешивались
+        self._write_lock = asyncio.Lock()
+        # LRU-кэш пользователей: user_id -> (время истечения, запись или None)
+        self.user_cache_size = user_cache_size
+        self.user_cache_ttl = user_cache_ttl
+        self._user_cache = OrderedDict()
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    async def connect(self) -> aiosqlite.Connection:
+        """Открывает единственное долгоживущее подключение к SQLite"""
+        if self._conn is None:
+            self._conn = await aiosqlite.connect(self.db_path)
+            await self._conn.execute("PRAGMA journal_mode=WAL")
+            await self._conn.execute("PRAGMA synchronous=NORMAL")
+            await self._conn.execute("PRAGMA busy_timeout=5000")
+            await self._conn.execute("PRAGMA temp_store=MEMORY")
+            await self._conn.execute("PRAGMA foreign_keys=ON")
+        return self._conn
+
+    async def close(self) -> None:
+        if self._conn is not None:
+            conn = self._conn
+            self._conn = None
+            await conn.close()
+
+    async def _write(self, query: str, params: tuple = ()) -> None:
+        async with self._write_lock:
+            await self._conn.execute(query, params)
+            await self._conn.commit()
+
+    def _cache_user(self, user_id: int, user: Optional[dict]) -> None:
+        self._user_cache[user_id] = (time.monotonic() + self.user_cache_ttl, user)
+        self._user_cache.move_to_end(user_id)
+        while len(self._user_cache) > self.user_cache_size:
+            self._user_cache.popitem(last=False)
+
+    def _cached_user(self, user_id: int):
+        """Возвращает (найдено, запись) из кэша пользователей"""
+        entry = self._user_cache.get(user_id)
+        if entry is None or entry[0] < time.monotonic():
+            self._user_cache.pop(user_id, None)
+            self.cache_misses += 1
+            return False, None
+        self._user_cache.move_to_end(user_id)
+        self.cache_hits += 1
+        return True, entry[1]
+
+    @property
+    def cache_stats(self) -> dict:
+        return {
+            "hits": self.cache_hits,
+            "misses": self.cache_misses,
+            "size": len(self._user_cache)
+        }
+
+    @staticmethod
+    def _user_from_row(row) -> dict:
+        return {
+            "user_id": row[0],
+            "username": row[1],
+            "full_name": row[2],
+            "status": row[3],
+            "blocked_reason": row[4],
+            "created_at": row[5]
+        }
 
     async def create_tables(self):
-        async with aiosqlite.connect(self.db_path) as db:
+        db = await self.connect()
+        async with self._write_lock:
             await db.execute("""
                 CREATE TABLE IF NOT EXISTS users (
                     user_id INTEGER PRIMARY KEY,
@@ -17,68 +91,337 @@ class Database:
                     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
                 )
             """)
+            # Индексы для постраничного вывода списков пользователей
+            await db.execute("""
+                CREATE INDEX IF NOT EXISTS idx_users_status_created
+                ON users (status, created_at)
+            """)
+            await db.execute("""
+                CREATE INDEX IF NOT EXISTS idx_users_created
+                ON users (created_at)
+            """)
+            # Найденные на серверах версии платформы 1С
+            await db.execute("""
+                CREATE TABLE IF NOT EXISTS platforms (
+                    host TEXT NOT NULL,
+                    version TEXT NOT NULL,
+                    path TEXT NOT NULL,
+                    running INTEGER DEFAULT 0,
+                    selected INTEGER DEFAULT 0,
+                    detected_at REAL NOT NULL, -- unix time
+                    PRIMARY KEY (host, version)
+                )
+            """)
+            # Журнал выгрузок: по нему после перезапуска доделываются прерванные задания
+            await db.execute("""
+                CREATE TABLE IF NOT EXISTS backup_jobs (
+                    id TEXT PRIMARY KEY,
+                    host TEXT NOT NULL,
+                    db_name TEXT NOT NULL,
+                    user_id INTEGER NOT NULL,
+                    status TEXT NOT NULL, -- queued, dumping, compressing, uploading, done, failed
+                    file_path TEXT, -- .dt на сервере 1С
+                    result TEXT,
+                    error TEXT,
+                    created_at REAL NOT NULL, -- unix time
+                    updated_at REAL NOT NULL
+                )
+            """)
+            await db.execute("""
+                CREATE INDEX IF NOT EXISTS idx_backup_jobs_status
+                ON backup_jobs (status, updated_at)
+            """)
+            # Проверенные копии в облаке: размер и SHA-256 для сверки при восстановлении
+            await db.execute("""
+                CREATE TABLE IF NOT EXISTS backup_files (
+                    host TEXT NOT NULL,
+                    db_name TEXT NOT NULL,
+                    file_name TEXT NOT NULL,
+                    size INTEGER,
+                    sha256 TEXT, -- у копии частями - SHA-256 частей по порядку через запятую
+                    verified TEXT, -- sha256 или size: чем подтверждена копия в облаке
+                    created_at REAL NOT NULL, -- unix time
+                    PRIMARY KEY (host, db_name, file_name)
+                )
+            """)
+            # Состояния FSM aiogram: переживают перезапуск бота
+            await db.execute("""
+                CREATE TABLE IF NOT EXISTS fsm (
+                    chat INTEGER NOT NULL,
+                    user INTEGER NOT NULL,
+                    state TEXT,
+                    data TEXT, -- компактный JSON
+                    bucket TEXT,
+                    expires_at REAL NOT NULL, -- unix time
+                    PRIMARY KEY (chat, user)
+                ) WITHOUT ROWID
+            """)
             await db.commit()
 
+    @metrics.query
     async def add_user(self, user_id: int, username: str, full_name: str) -> None:
-        async with aiosqlite.connect(self.db_path) as db:
-            await db.execute(
-                """INSERT OR IGNORE INTO users 
-                   (user_id, username, full_name) VALUES (?, ?, ?)""",
-                (user_id, username, full_name)
-            )
-            await db.commit()
+        await self._write(
+            """INSERT OR IGNORE INTO users
+               (user_id, username, full_name) VALUES (?, ?, ?)""",
+            (user_id, username, full_name)
+        )
+        # INSERT OR IGNORE мог ничего не вставить - перечитаем запись при следующем обращении
+        self._user_cache.pop(user_id, None)
 
+    @metrics.query
     async def get_user(self, user_id: int) -> Optional[dict]:
-        async with aiosqlite.connect(self.db_path) as db:
-            async with db.execute(
-                "SELECT * FROM users WHERE user_id = ?", (user_id,)
-            ) as cursor:
-                result = await cursor.fetchone()
-                if result:
-                    return {
-                        "user_id": result[0],
-                        "username": result[1],
-                        "full_name": result[2],
-                        "status": result[3],
-                        "blocked_reason": result[4],
-                        "created_at": result[5]
-                    }
-                return None
+        found, user = self._cached_user(user_id)
+        if found:
+            return dict(user) if user else None
+
+        # Запросы с одинаковым текстом берутся из кэша подготовленных выражений sqlite3
+        async with self._conn.execute(
+            "SELECT * FROM users WHERE user_id = ?", (user_id,)
+        ) as cursor:
+            result = await cursor.fetchone()
+        user = self._user_from_row(result) if result else None
+        self._cache_user(user_id, user)
+        return dict(user) if user else None
 
+    @metrics.query
     async def update_user_status(self, user_id: int, status: str, blocked_reason: str = None) -> None:
-        async with aiosqlite.connect(self.db_path) as db:
+        if blocked_reason:
+            await self._write(
+                """UPDATE users SET status = ?, blocked_reason = ?
+                   WHERE user_id = ?""",
+                (status, blocked_reason, user_id)
+            )
+        else:
+            await self._write(
+                "UPDATE users SET status = ? WHERE user_id = ?",
+                (status, user_id)
+            )
+
+        # Сквозная запись: обновляем закэшированную запись вместе с таблицей
+        entry = self._user_cache.get(user_id)
+        if entry is not None and entry[1] is not None:
+            user = dict(entry[1], status=status)
             if blocked_reason:
-                await db.execute(
-                    """UPDATE users SET status = ?, blocked_reason = ? 
-                       WHERE user_id = ?""",
-                    (status, blocked_reason, user_id)
-                )
-            else:
-                await db.execute(
-                    "UPDATE users SET status = ? WHERE user_id = ?",
-                    (status, user_id)
-                )
-            await db.commit()
+                user["blocked_reason"] = blocked_reason
+            self._cache_user(user_id, user)
+        else:
+            self._user_cache.pop(user_id, None)
 
+    @metrics.query
     async def get_users_by_status(self, status: str = None) -> List[dict]:
-        async with aiosqlite.connect(self.db_path) as db:
-            if status:
-                query = "SELECT * FROM users WHERE status = ? ORDER BY created_at DESC"
-                params = (status,)
-            else:
-                query = "SELECT * FROM users ORDER BY created_at DESC"
-                params = ()
-
-            async with db.execute(query, params) as cursor:
-                results = await cursor.fetchall()
-                return [
-                    {
-                        "user_id": row[0],
-                        "username": row[1],
-                        "full_name": row[2],
-                        "status": row[3],
-                        "blocked_reason": row[4],
-                        "created_at": row[5]
-                    }
-                    for row in results
-                ]
\ No newline at end of file
+        if status:
+            query = "SELECT * FROM users WHERE status = ? ORDER BY created_at DESC"
+            params = (status,)
+        else:
+            query = "SELECT * FROM users ORDER BY created_at DESC"
+            params = ()
+
+        async with self._conn.execute(query, params) as cursor:
+            results = await cursor.fetchall()
+            return [self._user_from_row(row) for row in results]
+
+    @staticmethod
+    def _page_filter(status: Optional[str], exclude_user_id: Optional[int]) -> Tuple[List[str], list]:
+        conditions, params = [], []
+        if status:
+            conditions.append("status = ?")
+            params.append(status)
+        if exclude_user_id is not None:
+            conditions.append("user_id != ?")
+            params.append(exclude_user_id)
+        return conditions, params
+
+    async def _users_exist(self, status: Optional[str], exclude_user_id: Optional[int],
+                           anchor: Tuple[str, int], op: str) -> bool:
+        conditions, params = self._page_filter(status, exclude_user_id)
+        conditions.append(f"(created_at, user_id) {op} (?, ?)")
+        params.extend(anchor)
+        query = f"SELECT 1 FROM users WHERE {' AND '.join(conditions)} LIMIT 1"
+        async with self._conn.execute(query, params) as cursor:
+            return await cursor.fetchone() is not None
+
+    @metrics.query
+    async def get_users_page(self, status: str = None, limit: int = 10,
+                             anchor: Optional[Tuple[str, int]] = None,
+                             direction: str = "next",
+                             exclude_user_id: int = None) -> Tuple[List[dict], bool, bool]:
+        """Возвращает страницу пользователей (новые сверху) по ключу (created_at, user_id).
+
+        direction: "next" - записи старше ключа, "prev" - новее ключа,
+        "from" - начиная с ключа включительно.
+        Возвращает (пользователи, есть более новые, есть более старые).
+        """
+        conditions, params = self._page_filter(status, exclude_user_id)
+        order = "DESC"
+        if anchor:
+            op = {"next": "<", "prev": ">", "from": "<="}[direction]
+            conditions.append(f"(created_at, user_id) {op} (?, ?)")
+            params.extend(anchor)
+            if direction == "prev":
+                order = "ASC"
+
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        query = (f"SELECT * FROM users {where} "
+                 f"ORDER BY created_at {order}, user_id {order} LIMIT ?")
+        params.append(limit)
+
+        async with self._conn.execute(query, params) as cursor:
+            rows = await cursor.fetchall()
+        users = [self._user_from_row(row) for row in rows]
+        if order == "ASC":
+            users.reverse()
+
+        if not users:
+            return users, False, False
+
+        first = (users[0]["created_at"], users[0]["user_id"])
+        last = (users[-1]["created_at"], users[-1]["user_id"])
+        has_newer = await self._users_exist(status, exclude_user_id, first, ">")
+        has_older = await self._users_exist(status, exclude_user_id, last, "<")
+        return users, has_newer, has_older
+
+    @metrics.query
+    async def get_platforms(self, host: str) -> List[dict]:
+        async with self._conn.execute(
+            """SELECT version, path, running, selected, detected_at
+               FROM platforms WHERE host = ?""", (host,)
+        ) as cursor:
+            rows = await cursor.fetchall()
+        return [
+            {
+                "version": row[0],
+                "path": row[1],
+                "running": bool(row[2]),
+                "selected": bool(row[3]),
+                "detected_at": row[4]
+            }
+            for row in rows
+        ]
+
+    @metrics.query
+    async def save_platforms(self, host: str, platforms: List[dict]) -> None:
+        """Заменяет список версий платформы для хоста"""
+        async with self._write_lock:
+            await self._conn.execute("DELETE FROM platforms WHERE host = ?", (host,))
+            await self._conn.executemany(
+                """INSERT INTO platforms
+                   (host, version, path, running, selected, detected_at)
+                   VALUES (?, ?, ?, ?, ?, ?)""",
+                [
+                    (host, p["version"], p["path"], int(p["running"]),
+                     int(p["selected"]), p["detected_at"])
+                    for p in platforms
+                ]
+            )
+            await self._conn.commit()
+
+    @metrics.query
+    async def select_platform(self, host: str, version: str) -> None:
+        await self._write(
+            "UPDATE platforms SET selected = (version = ?) WHERE host = ?",
+            (version, host)
+        )
+
+    @metrics.query
+    async def get_fsm(self, chat: int, user: int) -> Optional[Tuple[Optional[str], Optional[str], Optional[str]]]:
+        """Возвращает (state, data, bucket) или None, если записи нет или она истекла"""
+        async with self._conn.execute(
+            """SELECT state, data, bucket FROM fsm
+               WHERE chat = ? AND user = ? AND expires_at > ?""",
+            (chat, user, time.time())
+        ) as cursor:
+            return await cursor.fetchone()
+
+    @metrics.query
+    async def save_fsm(self, chat: int, user: int, state: Optional[str],
+                       data: Optional[str], bucket: Optional[str], expires_at: float) -> None:
+        if state is None and data is None and bucket is None:
+            # Пустые записи не храним
+            await self._write("DELETE FROM fsm WHERE chat = ? AND user = ?", (chat, user))
+            return
+        await self._write(
+            """INSERT OR REPLACE INTO fsm
+               (chat, user, state, data, bucket, expires_at)
+               VALUES (?, ?, ?, ?, ?, ?)""",
+            (chat, user, state, data, bucket, expires_at)
+        )
+
+    @metrics.query
+    async def delete_expired_fsm(self) -> int:
+        async with self._write_lock:
+            cursor = await self._conn.execute(
+                "DELETE FROM fsm WHERE expires_at <= ?", (time.time(),)
+            )
+            await self._conn.commit()
+            return cursor.rowcount
+
+    @metrics.query
+    async def save_backup_job(self, job_id: str, host: str, db_name: str, user_id: int,
+                              status: str, file_path: str = None, result: str = None,
+                              error: str = None) -> None:
+        """Добавляет задание в журнал или обновляет его состояние"""
+        now = time.time()
+        await self._write(
+            """INSERT INTO backup_jobs
+               (id, host, db_name, user_id, status, file_path, result, error, created_at, updated_at)
+               VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+               ON CONFLICT (id) DO UPDATE SET
+                   status = excluded.status,
+                   file_path = COALESCE(excluded.file_path, file_path),
+                   result = excluded.result,
+                   error = excluded.error,
+                   updated_at = excluded.updated_at""",
+            (job_id, host, db_name, user_id, status, file_path, result, error, now, now)
+        )
+
+    @metrics.query
+    async def get_unfinished_backup_jobs(self) -> List[dict]:
+        async with self._conn.execute(
+            """SELECT id, host, db_name, user_id, status, file_path
+               FROM backup_jobs WHERE status NOT IN ('done', 'failed')
+               ORDER BY created_at"""
+        ) as cursor:
+            rows = await cursor.fetchall()
+        return [
+            {
+                "id": row[0],
+                "host": row[1],
+                "db_name": row[2],
+                "user_id": row[3],
+                "status": row[4],
+                "file_path": row[5]
+            }
+            for row in rows
+        ]
+
+    @metrics.query
+    async def delete_finished_backup_jobs(self, older_than: float) -> None:
+        """Удаляет завершённые задания, обновлённые раньше older_than (unix time)"""
+        await self._write(
+            """DELETE FROM backup_jobs
+               WHERE status IN ('done', 'failed') AND updated_at < ?""",
+            (older_than,)
+        )
+
+    @metrics.query
+    async def save_backup_file(self, host: str, db_name: str, file_name: str,
+                               size: Optional[int], sha256: Optional[str],
+                               verified: str) -> None:
+        await self._write(
+            """INSERT OR REPLACE INTO backup_files
+               (host, db_name, file_name, size, sha256, verified, created_at)
+               VALUES (?, ?, ?, ?, ?, ?, ?)""",
+            (host, db_name, file_name, size, sha256, verified, time.time())
+        )
+
+    @metrics.query
+    async def delete_backup_files(self, host: str, db_name: str, file_names: List[str]) -> None:
+        """Удаляет записи о копиях, удалённых из облака"""
+        if not file_names:
+            return
+        async with self._write_lock:
+            await self._conn.executemany(
+                "DELETE FROM backup_files WHERE host = ? AND db_name = ? AND file_name = ?",
+                [(host, db_name, name) for name in file_names]
+            )
+            await self._conn.commit()
@@ -1,18 +1,25 @@
+import logging
+import time
+from typing import List
 from aiogram import types, Dispatcher
 from aiogram.dispatcher.filters import Command
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
-from config import load_config
-from ssh_manager import SSHManager
+from config import Config
+from ssh_manager import ServerGroup
+from backup_queue import BackupBatch, BackupJob, BackupQueue
+from sender import Sender
+from throttle import PAUSED, THROTTLED
 
-config = load_config()
-ADMIN_ID = int(config.tg_bot.admin_id)
+logger = logging.getLogger(__name__)
 
-async def cmd_start(message: types.Message, db=None):
+async def cmd_start(message: types.Message, db=None, config: Config = None,
+                    sender: Sender = None):
     user_id = message.from_user.id
+    admin_id = config.tg_bot.admin_id
     
     # Проверяем, является ли пользователь админом
-    if user_id == ADMIN_ID:
-        await message.answer("Добро пожаловать, администратор!")
+    if user_id == admin_id:
+        await sender.answer(message, "Добро пожаловать, администратор!")
         await db.add_user(
             user_id=user_id,
             username=message.from_user.username,
@@ -31,7 +38,7 @@ async def cmd_start(message: types.Message, db=None):
             username=message.from_user.username,
             full_name=message.from_user.full_name
         )
-        await message.answer("Ваша заявка отправлена администратору. Ожидайте подтверждения.")
+        await sender.answer(message, "Ваша заявка отправлена администратору. Ожидайте подтверждения.")
         
         # Отправляем уведомление админу
         markup = InlineKeyboardMarkup(row_width=2)
@@ -40,8 +47,8 @@ async def cmd_start(message: types.Message, db=None):
             InlineKeyboardButton("Заблокировать", callback_data=f"block_{user_id}")
         )
         
-        await message.bot.send_message(
-            ADMIN_ID,
+        await sender.send_message(
+            admin_id,
             f"Новый пользователь запрашивает доступ:\n"
             f"ID: {user_id}\n"
             f"Имя: {message.from_user.full_name}\n"
@@ -51,161 +58,201 @@ async def cmd_start(message: types.Message, db=None):
     else:
         # Существующий пользователь
         if user['status'] == 'approved':
-            await message.answer("Добро пожаловать! У вас есть доступ к боту.")
+            await sender.answer(message, "Добро пожаловать! У вас есть доступ к боту.")
         elif user['status'] == 'blocked':
             reason = user['blocked_reason'] or 'Причина не указана'
-            await message.answer(f"Вы заблокированы.\nПричина: {reason}")
+            await sender.answer(message, f"Вы заблокированы.\nПричина: {reason}")
         else:
-            await message.answer("Ваша заявка находится на рассмотрении.")
+            await sender.answer(message, "Ваша заявка находится на рассмотрении.")
 
-async def process_callback(callback: types.CallbackQuery, db=None):
+async def process_callback(callback: types.CallbackQuery, db=None, config: Config = None,
+                           sender: Sender = None):
     action, user_id = callback.data.split('_')
     user_id = int(user_id)
+    admin_id = config.tg_bot.admin_id
     
-    if callback.from_user.id != ADMIN_ID:
+    if callback.from_user.id != admin_id:
         await callback.answer("У вас нет прав администратора!", show_alert=True)
         return
 
     # Проверка на попытку заблокировать админа
-    if user_id == ADMIN_ID and action == "block":
+    if user_id == admin_id and action == "block":
         await callback.answer("Невозможно заблокировать администратора!", show_alert=True)
         return
 
     if action == "approve":
         await db.update_user_status(user_id, "approved")
-        await callback.bot.send_message(user_id, "Администратор одобрил вашу заявку. Теперь у вас есть доступ к боту!")
-        await callback.message.edit_text(
-            f"{callback.message.text}\n\n✅ Одобрено"
-        )
+        await sender.send_message(user_id, "Администратор одобрил вашу заявку. Теперь у вас есть доступ к боту!")
+        result_text = "✅ Одобрено"
     elif action == "block":
         await db.update_user_status(user_id, "blocked", "Заблокировано администратором")
-        await callback.bot.send_message(user_id, "Администратор отклонил вашу заявку.")
-        await callback.message.edit_text(
-            f"{callback.message.text}\n\n❌ Заблокировано"
-        )
+        await sender.send_message(user_id, "Администратор отклонил вашу заявку.")
+        result_text = "❌ Заблокировано"
+    else:
+        await callback.answer()
+        return
 
+    page_data = _page_refresh_data(callback.message.reply_markup)
+    if page_data:
+        # Действие со страницы списка - перерисовываем ту же страницу
+        status, mode, anchor = _parse_page_callback(page_data)
+        text, markup = await _render_users_page(db, admin_id, status, mode, anchor)
+        await sender.edit_text(callback.message, text, reply_markup=markup)
+        await callback.answer(result_text)
+        return
+
+    await sender.edit_text(callback.message, 
+        f"{callback.message.text}\n\n{result_text}"
+    )
     await callback.answer()
 
-async def cmd_users(message: types.Message, db=None):
-    if message.from_user.id != ADMIN_ID:
-        await message.answer("У вас нет прав администратора!")
-        return
+USERS_PAGE_SIZE = 10
+
+STATUS_EMOJI = {
+    'pending': '⏳',
+    'approved': '✅',
+    'blocked': '❌'
+}
+
+def _page_callback(status: str, mode: str, user: dict) -> str:
+    # users|<статус или all>|<n - дальше, p - назад, r - обновить>|<created_at>|<user_id>
+    return f"users|{status}|{mode}|{user['created_at']}|{user['user_id']}"
+
+async def _render_users_page(db, admin_id: int, status: str, mode: str = "r", anchor=None):
+    """Собирает текст и клавиатуру одной страницы списка пользователей"""
+    direction = {"n": "next", "p": "prev", "r": "from"}[mode]
+    users, has_newer, has_older = await db.get_users_page(
+        status=None if status == "all" else status,
+        limit=USERS_PAGE_SIZE,
+        anchor=anchor,
+        direction=direction,
+        exclude_user_id=admin_id
+    )
 
-    # Получаем всех пользователей
-    users = await db.get_users_by_status()
-    
     if not users:
-        await message.answer("Пользователей пока нет.")
-        return
+        if status == "pending":
+            return "Нет пользователей в ожидании одобрения.", None
+        return "Пользователей пока нет.", None
+
+    title = "⏳ Пользователи в ожидании" if status == "pending" else "👥 Пользователи"
+    lines = [f"{title}:\n"]
+    markup = InlineKeyboardMarkup(row_width=2)
 
-    # Создаем сообщение со списком пользователей
     for user in users:
-        # Пропускаем админа в списке
-        if user['user_id'] == ADMIN_ID:
-            continue
-            
-        status_emoji = {
-            'pending': '⏳',
-            'approved': '✅',
-            'blocked': '❌'
-        }.get(user['status'], '❓')
-        
-        markup = InlineKeyboardMarkup(row_width=2)
-        
+        status_emoji = STATUS_EMOJI.get(user['status'], '❓')
+        user_text = (
+            f"{status_emoji} {user['full_name']} (@{user['username']})\n"
+            f"    🆔 {user['user_id']} · 📅 {user['created_at']}"
+        )
+        if user['status'] == 'blocked' and user['blocked_reason']:
+            user_text += f"\n    ❌ Причина: {user['blocked_reason']}"
+        lines.append(user_text)
+
         # Для пользователей показываем кнопки в зависимости от статуса
+        name = (user['full_name'] or str(user['user_id']))[:20]
         if user['status'] == 'approved':
-            markup.add(InlineKeyboardButton("Заблокировать", callback_data=f"block_{user['user_id']}"))
+            markup.row(InlineKeyboardButton(f"❌ {name}", callback_data=f"block_{user['user_id']}"))
         elif user['status'] == 'blocked':
-            markup.add(InlineKeyboardButton("Разрешить", callback_data=f"approve_{user['user_id']}"))
+            markup.row(InlineKeyboardButton(f"✅ {name}", callback_data=f"approve_{user['user_id']}"))
         else:  # pending
-            markup.add(
-                InlineKeyboardButton("Разрешить", callback_data=f"approve_{user['user_id']}"),
-                InlineKeyboardButton("Заблокировать", callback_data=f"block_{user['user_id']}")
+            markup.row(
+                InlineKeyboardButton(f"✅ {name}", callback_data=f"approve_{user['user_id']}"),
+                InlineKeyboardButton(f"❌ {name}", callback_data=f"block_{user['user_id']}")
             )
 
-        user_text = (
-            f"👤 Пользователь: {user['full_name']}\n"
-            f"🆔 ID: {user['user_id']}\n"
-            f"👤 Username: @{user['username']}\n"
-            f"📅 Дата регистрации: {user['created_at']}\n"
-            f"📊 Статус: {status_emoji} {user['status']}\n"
-        )
-        
-        if user['status'] == 'blocked' and user['blocked_reason']:
-            user_text += f"❌ Причина блокировки: {user['blocked_reason']}\n"
+    navigation = []
+    if has_newer:
+        navigation.append(InlineKeyboardButton("⬅️", callback_data=_page_callback(status, "p", users[0])))
+    navigation.append(InlineKeyboardButton("🔄", callback_data=_page_callback(status, "r", users[0])))
+    if has_older:
+        navigation.append(InlineKeyboardButton("➡️", callback_data=_page_callback(status, "n", users[-1])))
+    markup.row(*navigation)
+
+    return "\n".join(lines), markup
+
+def _page_refresh_data(markup: InlineKeyboardMarkup):
+    """Возвращает данные кнопки обновления, если сообщение - страница списка"""
+    if not markup:
+        return None
+    for row in markup.inline_keyboard:
+        for button in row:
+            data = button.callback_data or ""
+            if data.startswith("users|") and data.split("|")[2] == "r":
+                return data
+    return None
+
+def _parse_page_callback(data: str):
+    _, status, mode, created_at, user_id = data.split("|")
+    return status, mode, (created_at, int(user_id))
+
+async def cmd_users(message: types.Message, db=None, config: Config = None,
+                    sender: Sender = None):
+    admin_id = config.tg_bot.admin_id
+    if message.from_user.id != admin_id:
+        await sender.answer(message, "У вас нет прав администратора!")
+        return
 
-        await message.answer(user_text, reply_markup=markup)
+    text, markup = await _render_users_page(db, admin_id, "all")
+    await sender.answer(message, text, reply_markup=markup)
 
-async def cmd_pending(message: types.Message, db=None):
-    if message.from_user.id != ADMIN_ID:
-        await message.answer("У вас нет прав администратора!")
+async def cmd_pending(message: types.Message, db=None, config: Config = None,
+                      sender: Sender = None):
+    admin_id = config.tg_bot.admin_id
+    if message.from_user.id != admin_id:
+        await sender.answer(message, "У вас нет прав администратора!")
         return
 
-    # Получаем только пользовател в оидании
-    users = await db.get_users_by_status('pending')
-    
-    if not users:
-        await message.answer("Нет пользователей в ожидании одобрения.")
-        return
+    text, markup = await _render_users_page(db, admin_id, "pending")
+    await sender.answer(message, text, reply_markup=markup)
 
-    for user in users:
-        markup = InlineKeyboardMarkup(row_width=2)
-        markup.add(
-            InlineKeyboardButton("Разрешить", callback_data=f"approve_{user['user_id']}"),
-            InlineKeyboardButton("Заблокировать", callback_data=f"block_{user['user_id']}")
-        )
+async def process_users_page_callback(callback: types.CallbackQuery, db=None, config: Config = None,
+                                      sender: Sender = None):
+    admin_id = config.tg_bot.admin_id
+    if callback.from_user.id != admin_id:
+        await callback.answer("У вас нет прав администратора!", show_alert=True)
+        return
 
-        await message.answer(
-            f"👤 Пользователь: {user['full_name']}\n"
-            f"🆔 ID: {user['user_id']}\n"
-            f"👤 Username: @{user['username']}\n"
-            f"📅 Дата регистрации: {user['created_at']}\n"
-            f"📊 Статус: ⏳ в ожидании",
-            reply_markup=markup
-        )
+    status, mode, anchor = _parse_page_callback(callback.data)
+    text, markup = await _render_users_page(db, admin_id, status, mode, anchor)
+    await sender.edit_text(callback.message, text, reply_markup=markup)
+    await callback.answer()
 
-async def cmd_databases(message: types.Message, db=None):
+async def cmd_databases(message: types.Message, db=None, ssh: ServerGroup = None,
+                        backups: BackupQueue = None, sender: Sender = None):
     user_id = message.from_user.id
     user = await db.get_user(user_id)
     
     if not user or user['status'] != 'approved':
-        await message.answer("У вас нет доступа к этой команде.")
+        await sender.answer(message, "У вас нет доступа к этой команде.")
         return
 
-    config = load_config()
-    ssh = SSHManager(
-        host=config.ssh.host,
-        username=config.ssh.username,
-        password=config.ssh.password,
-        db_server=config.ssh.db_server,
-        db_user=config.ssh.db_user,
-        db_pwd=config.ssh.db_pwd,
-        user=config.ssh.user,
-        user_pwd=config.ssh.user_pwd,
-        rclone_remote=config.ssh.rclone_remote,
-        rclone_path=config.ssh.rclone_path
-    )
 
     try:
-        databases = await ssh.get_1c_databases()
+        databases, unavailable = await ssh.get_1c_databases()
         if not databases:
-            await message.answer("Не удалось получить список баз данных")
+            if unavailable:
+                text = ("Не удалось получить список баз данных"
+                        f"\n⚠️ Не ответили серверы: {', '.join(unavailable)}")
+            else:
+                text = "На серверах 1С нет информационных баз"
+            await sender.answer(message, text)
             return
 
         markup = InlineKeyboardMarkup(row_width=1)
         active_backups_msg = []
+        several_hosts = len(ssh.hosts) > 1
 
         # Добавляем кнопки для баз данных
         for db_info in databases:
             db_name = db_info['name']
-            db_descr = db_info.get('descr', 'Без описания')
+            db_descr = db_info.get('descr') or 'Без описания'
             
             # Формируем текст кнопки
-            button_text = f"💾 {db_name}  - "
-            if db_descr:
-                button_text += f"📝 ({db_descr})"
+            button_text = f"💾 {db_name}  - 📝 ({db_descr})"
+            if several_hosts:
+                button_text += f" 🖥 {db_info['host']}"
 
-            if SSHManager.is_backup_active(db_name):
+            if backups.is_active(db_name, db_info['host']):
                 markup.add(InlineKeyboardButton(
                     text=f"🔄 {button_text} (выгрузка...)",
                     callback_data="backup_in_progress"
@@ -214,9 +261,15 @@ async def cmd_databases(message: types.Message, db=None):
             else:
                 markup.add(InlineKeyboardButton(
                     text=button_text,
-                    callback_data=f"backup_{db_name}"
+                    callback_data=f"backup_{ssh.host_key(db_info['host'])}|{db_name}"
                 ))
 
+        # Пакетная выгрузка всех баз
+        markup.add(InlineKeyboardButton(
+            text="📦 Выгрузить все базы",
+            callback_data="backup_*"
+        ))
+
         # Добавляем кнопку отмены
         markup.add(InlineKeyboardButton(
             text="❌ Отмена",
@@ -226,15 +279,74 @@ async def cmd_databases(message: types.Message, db=None):
         msg_text = "📋 Выберите базу для создания резервной копии:"
         if active_backups_msg:
             msg_text += f"\n\n⚠️ Выгрузка уже идет для баз: {', '.join(active_backups_msg)}"
+        if unavailable:
+            msg_text += f"\n\n⚠️ Не ответили серверы: {', '.join(unavailable)}"
 
-        await message.answer(msg_text, reply_markup=markup)
+        await sender.answer(message, msg_text, reply_markup=markup)
 
     except Exception as e:
-        await message.answer(f"Произошла ошибка при получении списка баз: {str(e)}")
-    finally:
-        await ssh.close()
+        await sender.answer(message, f"Произошла ошибка при получении списка баз: {str(e)}")
+
+async def cmd_refresh(message: types.Message, db=None, config: Config = None,
+                      ssh: ServerGroup = None, sender: Sender = None):
+    admin_id = config.tg_bot.admin_id
+    if message.from_user.id != admin_id:
+        await sender.answer(message, "У вас нет прав администратора!")
+        return
+
+    ssh.invalidate_databases_cache()
+    await sender.answer(message, "🔄 Кэш списка баз сброшен. Он будет обновлён при следующем /backup.")
+
+async def cmd_platform(message: types.Message, db=None, config: Config = None,
+                       ssh: ServerGroup = None, sender: Sender = None):
+    admin_id = config.tg_bot.admin_id
+    if message.from_user.id != admin_id:
+        await sender.answer(message, "У вас нет прав администратора!")
+        return
+
+    args = message.get_args().strip()
+    lines = []
+    selected = False
+
+    for manager in ssh.managers:
+        host = manager.pool.host
+        if not await manager.connect():
+            lines.append(f"🖥 {host}: не удалось подключиться\n")
+            continue
+
+        if args == "refresh":
+            await manager.redetect_platform()
+        elif args:
+            selected = await manager.select_platform(args) or selected
 
-async def process_backup_callback(callback: types.CallbackQuery, db=None):
+        platforms = manager.platforms
+        if not platforms:
+            lines.append(f"🖥 {host}: не удалось определить версию платформы 1С\n")
+            continue
+
+        current_version = await manager.get_1c_server_version()
+        lines.append(f"🖥 {host}, версии платформы 1С:")
+        for platform in platforms:
+            mark = "👉" if platform["version"] == current_version else "▫️"
+            line = f"{mark} {platform['version']}"
+            if platform["running"]:
+                line += " (ragent запущен)"
+            lines.append(line)
+        lines.append("")
+
+    if args and args != "refresh" and not selected:
+        await sender.answer(message, f"Версия {args} не найдена на серверах.")
+        return
+
+    lines.append(
+        "Выбрать версию: /platform <версия>\n"
+        "Определить заново: /platform refresh"
+    )
+    await sender.answer(message, "\n".join(lines))
+
+async def process_backup_callback(callback: types.CallbackQuery, db=None,
+                                  ssh: ServerGroup = None, backups: BackupQueue = None,
+                                  sender: Sender = None):
     # Обработка кнопки отмены
     if callback.data == "backup_cancel":
         await callback.message.delete()
@@ -251,64 +363,318 @@ async def process_backup_callback(callback: types.CallbackQuery, db=None):
         await callback.answer("У вас нет доступа к этой команде.", show_alert=True)
         return
 
-    db_name = callback.data.split('_')[1]
+    if callback.data == "backup_*":
+        await callback.answer("Запускаю выгрузку всех баз...")
+        await callback.message.delete()
+        await _backup_all(callback.message, callback.from_user.id, ssh, backups, sender)
+        return
+
+    host, db_name = _parse_backup_callback(ssh, callback.data)
+    if host is None:
+        await callback.answer("Список баз устарел: серверы изменились. Отправьте /backup ещё раз.",
+                              show_alert=True)
+        return
 
-    if SSHManager.is_backup_active(db_name):
+    if backups.is_active(db_name, host):
         await callback.answer("Выгрузка этой базы уже идет!", show_alert=True)
         return
 
     await callback.answer(f"Создаю резервную копию базы {db_name}...", show_alert=False)
 
-    config = load_config()
-    ssh = SSHManager(
-        host=config.ssh.host,
-        username=config.ssh.username,
-        password=config.ssh.password,
-        db_server=config.ssh.db_server,
-        db_user=config.ssh.db_user,
-        db_pwd=config.ssh.db_pwd,
-        user=config.ssh.user,
-        user_pwd=config.ssh.user_pwd,
-        rclone_remote=config.ssh.rclone_remote,
-        rclone_path=config.ssh.rclone_path
-    )
-
     try:
         await callback.message.delete()
-        status_message = await callback.message.answer(
-            f"🔄 Начата выгрузка базы {db_name}...\n"
-            f"⏳ Пожалуйста, подождите..."
+        status_message = await sender.answer(callback.message, 
+            f"🔄 Выгрузка базы {db_name} поставлена в очередь..."
         )
-        
-        cloud_link = await ssh.create_database_backup(db_name)
-        if cloud_link:
-            await status_message.edit_text(
-                f"✅ Резервная копия базы {db_name} успешно создана!\n\n"
-                f"📥 Ссылка на Яндекс.Диск:\n{cloud_link}\n\n"
-                f"ℹ️ Для скачивания:\n"
-                f"1. Перейдите по ссылке\n"
-                f"2. Нажмите кнопку 'Скачать' на странице Яндекс.Диска"
+
+        async def notify(job: BackupJob):
+            await sender.edit_text(status_message, _backup_status_text(job))
+
+        # Выгрузка идёт в фоне, обработчик сразу освобождается
+        if backups.enqueue(db_name, callback.from_user.id, notify, host) is None:
+            await sender.edit_text(status_message, f"⚠️ Выгрузка базы {db_name} уже идет!")
+
+    except Exception as e:
+        await sender.answer(callback.message, f"Произошла ошибка: {str(e)}")
+
+def _parse_backup_callback(ssh: ServerGroup, data: str):
+    """Разбирает backup_<ключ хоста>|<база>.
+
+    Хост None - кнопка создана для другого списка серверов (до перезагрузки
+    настроек) или в старом формате backup_<база>.
+    """
+    payload = data.split('_', 1)[1]
+    host_key, separator, db_name = payload.partition('|')
+    if not separator:
+        return None, payload
+    return ssh.host_by_key(host_key), db_name
+
+async def cmd_backup_all(message: types.Message, db=None, ssh: ServerGroup = None,
+                         backups: BackupQueue = None, sender: Sender = None):
+    user = await db.get_user(message.from_user.id)
+
+    if not user or user['status'] != 'approved':
+        await sender.answer(message, "У вас нет доступа к этой команде.")
+        return
+
+    # /backup_all base1 base2 - выгрузка только перечисленных баз
+    selected = message.get_args().split()
+    await _backup_all(message, message.from_user.id, ssh, backups, sender, selected or None)
+
+async def _backup_all(message: types.Message, user_id: int, ssh: ServerGroup,
+                      backups: BackupQueue, sender: Sender, selected: list = None):
+    databases, unavailable = await ssh.get_1c_databases()
+    if unavailable:
+        await sender.answer(message, f"⚠️ Не ответили серверы: {', '.join(unavailable)}")
+    if not databases:
+        await sender.answer(message, "Не удалось получить список баз данных" if unavailable
+                            else "На серверах 1С нет информационных баз")
+        return
+
+    items = select_databases(databases, selected)
+    if selected:
+        found = {db_name for _, db_name in items}
+        unknown = [name for name in selected if name not in found]
+        if unknown:
+            await sender.answer(message, f"Базы не найдены: {', '.join(unknown)}")
+            return
+
+    await start_backup_batch(sender, backups, message.chat.id, user_id, items)
+
+def select_databases(databases: list, selected: list = None) -> list:
+    """Возвращает пары (хост, база): все или только перечисленные по имени"""
+    return [
+        (db_info['host'], db_info['name'])
+        for db_info in databases
+        if not selected or db_info['name'] in selected
+    ]
+
+async def start_backup_batch(sender: Sender, backups: BackupQueue, chat_id: int, user_id: int,
+                             databases: list) -> BackupBatch:
+    """Запускает пакетную выгрузку баз (хост, имя) с одним общим сообщением о ходе и итогах"""
+    status_message = await sender.send_message(
+        chat_id, f"📦 Пакетная выгрузка {len(databases)} баз поставлена в очередь..."
+    )
+
+    async def notify(batch: BackupBatch):
+        await sender.edit_text(status_message, _batch_status_text(batch))
+
+    return backups.enqueue_batch(databases, user_id, notify)
+
+async def resume_backups(sender: Sender, backups: BackupQueue, resumed: List[BackupJob],
+                         failed: List[dict], completed: List[dict]):
+    """Доделывает выгрузки, прерванные перезапуском, и сообщает о них запросившим.
+
+    resumed, failed, completed - результат BackupQueue.recover().
+    """
+
+    for record in completed:
+        sender.notify(
+            record['user_id'],
+            f"✅ Выгрузка базы {record['db_name']} завершилась до перезапуска бота.\n"
+            f"📥 Ссылка на Яндекс.Диск:\n{record['result']}"
+        )
+
+    # Несколько прерванных выгрузок одного пользователя придут одним сообщением
+    for record in failed:
+        sender.notify(
+            record['user_id'],
+            f"❌ Выгрузка базы {record['db_name']} не завершена: {record['error']}.\n"
+            f"Запустите её заново."
+        )
+
+    for job in resumed:
+        action = "загрузка в облако" if job.resume_path else "выгрузка"
+        try:
+            status_message = await sender.send_message(
+                job.user_id,
+                f"🔄 Бот перезапущен, {action} базы {job.db_name} продолжается..."
             )
+        except Exception:
+            logger.exception("Error notifying about resumed backup %s", job.db_name)
+            status_message = None
+
+        async def notify(job: BackupJob, status_message=status_message):
+            if status_message:
+                await sender.edit_text(status_message, _backup_status_text(job))
+
+        job.notify = notify
+        backups.submit(job)
+
+def _batch_status_text(batch: BackupBatch) -> str:
+    total = len(batch.jobs)
+    if batch.finished:
+        lines = [f"📦 Пакетная выгрузка завершена: успешно {len(batch.succeeded)} из {total}"]
+    else:
+        finished = sum(job.status in ("done", "failed") for job in batch.jobs)
+        lines = [f"📦 Пакетная выгрузка: готово {finished} из {total}"]
+    lines.append("")
+
+    for job in batch.jobs:
+        if job.status == "done":
+            lines.append(f"✅ {job.db_name}: {job.result}")
+            compression = _compression_text(job.stats)
+            if compression:
+                lines.append(f"    {compression}")
+        elif job.status == "failed":
+            lines.append(f"❌ {job.db_name}: ошибка")
+        elif job.status == "running":
+            line = f"🔄 {job.db_name}"
+            if job.progress and job.progress.get("percent") is not None:
+                line += f" ({job.progress['percent']:.0f}%)"
+            lines.append(line)
         else:
-            await status_message.edit_text(
-                f"❌ Не удалось создать резервную копию базы {db_name} "
-                f"или загрузить её в облако"
+            lines.append(f"⏳ {job.db_name}: позиция {job.position}")
+
+    if batch.skipped:
+        lines.append(f"\n⚠️ Уже выгружаются: {', '.join(batch.skipped)}")
+    if batch.finished:
+        lines.append(f"\n⏱ Общее время: {_format_eta(time.monotonic() - batch.created_at)}")
+
+    # Ограничение Telegram на длину сообщения
+    return "\n".join(lines)[:4096]
+
+def _format_size(size: float) -> str:
+    for unit in ("Б", "КБ", "МБ", "ГБ"):
+        if size < 1024:
+            return f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} ТБ"
+
+def _format_eta(seconds: float) -> str:
+    seconds = int(seconds)
+    if seconds >= 3600:
+        return f"{seconds // 3600} ч {seconds % 3600 // 60} мин"
+    if seconds >= 60:
+        return f"{seconds // 60} мин {seconds % 60} с"
+    return f"{seconds} с"
+
+def _progress_text(progress: dict) -> str:
+    stage = {
+        "dump": "📦 Создание дампа",
+        "compress": "🗜 Сжатие дампа",
+        "upload": "☁️ Загрузка в облако",
+        "stream": "🚀 Потоковая выгрузка в облако"
+    }.get(progress["stage"], progress["stage"])
+    lines = [stage]
+
+    if progress.get("done") is not None:
+        size_text = _format_size(progress["done"])
+        if progress.get("total"):
+            size_text += f" из {_format_size(progress['total'])}"
+        if progress.get("percent") is not None:
+            size_text += f" ({progress['percent']:.0f}%)"
+        lines.append(f"📊 {size_text}")
+    elif progress.get("percent") is not None:
+        lines.append(f"📊 {progress['percent']:.0f}%")
+
+    if progress.get("speed"):
+        lines.append(f"⚡ {_format_size(progress['speed'])}/с")
+    if progress.get("eta") is not None:
+        lines.append(f"⏱ Осталось ~{_format_eta(progress['eta'])}")
+    return "\n".join(lines)
+
+def _compression_text(stats: dict) -> str:
+    """Степень сжатия и сэкономленное на загрузке время"""
+    original, size = stats.get("original_size"), stats.get("size")
+    if stats.get("codec") != "zstd" or not original or not size:
+        return ""
+    text = f"🗜 zstd: {_format_size(original)} → {_format_size(size)} ({size * 100 / original:.0f}%)"
+    upload_time = stats.get("upload_time")
+    if upload_time:
+        # Несжатый дамп грузился бы с той же скоростью; время сжатия вычитаем
+        saved = (original - size) * upload_time / size - stats.get("compress_time", 0)
+        if saved > 0:
+            text += f", загрузка быстрее на ~{_format_eta(saved)}"
+    return text
+
+def _throttle_text(job: BackupJob) -> str:
+    level = job.manager.throttle.level if job.manager else None
+    if level == PAUSED:
+        return "\n⏸ Сервер 1С перегружен: загрузка приостановлена"
+    if level == THROTTLED:
+        return "\n🐢 Сервер 1С нагружен: выгрузка идёт с низким приоритетом"
+    return ""
+
+def _integrity_text(stats: dict) -> str:
+    """Чем подтверждена копия в облаке"""
+    if stats.get("parts") and stats.get("verified") == "sha256":
+        return f"🔐 SHA-256 всех частей ({len(stats['parts'])}) совпадает с облаком"
+    if stats.get("verified") == "sha256":
+        return f"🔐 SHA-256 совпадает с облаком: {stats['sha256'][:16]}…"
+    if stats.get("verified") == "size":
+        return "🔐 Размер совпадает с облаком (SHA-256 облако не хранит)"
+    if stats.get("verified") == "md5":
+        return "🔐 MD5 совпадает с облаком (SHA-256 облако не хранит)"
+    return ""
+
+def _upload_text(stats: dict) -> str:
+    """Фактическая скорость загрузки - по ней сравниваются настройки потоков и частей"""
+    if stats.get("reused"):
+        return "♻️ Такая же копия уже была в облаке - повторно не загружалась"
+    speed = stats.get("upload_speed")
+    if not speed:
+        return ""
+    text = f"📤 Загрузка: {_format_size(speed)}/с, потоков: {stats.get('streams', 1)}"
+    if stats.get("parts"):
+        text += f", частей: {len(stats['parts'])}"
+        if stats.get("resumed_parts"):
+            text += f" (уже были в облаке: {stats['resumed_parts']})"
+    return text
+
+def _backup_status_text(job: BackupJob) -> str:
+    if job.status == "queued":
+        return (
+            f"⏳ Выгрузка базы {job.db_name} в очереди\n"
+            f"📍 Позиция в очереди: {job.position}"
+        )
+    if job.status == "running":
+        if job.progress:
+            return (
+                f"🔄 Выгрузка базы {job.db_name}...\n"
+                f"{_progress_text(job.progress)}"
+                + _throttle_text(job)
             )
-
-    except Exception as e:
-        await callback.message.answer(f"Произошла ошибка: {str(e)}")
-    finally:
-        await ssh.close()
+        return (
+            f"🔄 Начата выгрузка базы {job.db_name}...\n"
+            f"⏳ Пожалуйста, подождите..."
+        )
+    if job.status == "done":
+        compression = _compression_text(job.stats)
+        integrity = _integrity_text(job.stats)
+        upload = _upload_text(job.stats)
+        return (
+            f"✅ Резервная копия базы {job.db_name} успешно создана!\n"
+            + (f"{compression}\n" if compression else "")
+            + (f"{upload}\n" if upload else "")
+            + (f"{integrity}\n" if integrity else "") +
+            f"\n📥 Ссылка на Яндекс.Диск:\n{job.result}\n\n"
+            f"ℹ️ Для скачивания:\n"
+            f"1. Перейдите по ссылке\n"
+            f"2. Нажмите кнопку 'Скачать' на странице Яндекс.Диска"
+        )
+    return (
+        f"❌ Не удалось создать резервную копию базы {job.db_name} "
+        f"или загрузить её в облако"
+        + (f"\n\n⚠️ {job.error}" if job.error else "")
+    )
 
 def register_user_handlers(dp: Dispatcher):
     dp.register_message_handler(cmd_start, Command("start"))
     dp.register_message_handler(cmd_users, Command("users"))
     dp.register_message_handler(cmd_pending, Command("pending"))
     dp.register_message_handler(cmd_databases, Command("backup"))
+    dp.register_message_handler(cmd_refresh, Command("refresh"))
+    dp.register_message_handler(cmd_backup_all, Command("backup_all"))
+    dp.register_message_handler(cmd_platform, Command("platform"))
     dp.register_callback_query_handler(
         process_callback,
         lambda c: c.data.startswith(('approve_', 'block_'))
     )
+    dp.register_callback_query_handler(
+        process_users_page_callback,
+        lambda c: c.data.startswith('users|')
+    )
     dp.register_callback_query_handler(
         process_backup_callback,
         lambda c: c.data.startswith('backup_')
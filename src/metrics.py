@@ -0,0 +1,118 @@
+import functools
+import logging
+import time
+from typing import Callable, Dict
+
+logger = logging.getLogger(__name__)
+
+# Имена метрик
+SSH_CONNECT = "ssh_connect_seconds"
+RAC = "rac_seconds"
+DUMP = "dump_seconds"
+UPLOAD = "upload_seconds"
+UPLOAD_SPEED = "upload_bytes_per_second"
+SQLITE_QUERY = "sqlite_query_seconds"
+HANDLER = "handler_seconds"
+SERVER_LOAD = "server_load_per_cpu"
+SERVER_IOWAIT = "server_iowait_percent"
+RAC_SESSIONS = "rac_sessions"
+THROTTLE_LEVEL = "throttle_level"
+THROTTLE_CHANGES = "throttle_changes"
+
+# Выгрузка и загрузка идут минуты и часы, а не миллисекунды
+_LONG_BUCKETS = (10, 30, 60, 120, 300, 600, 1200, 1800, 3600, 7200, 14400, 28800)
+_SPEED_BUCKETS = tuple(2 ** power for power in range(16, 31, 2))  # 64 КБ/с .. 1 ГБ/с
+
+# Пока метрики не включены, словарь пуст и замеры сводятся к одному dict.get
+_metrics: Dict[str, object] = {}
+
+def enabled() -> bool:
+    return bool(_metrics)
+
+def setup(active: Callable[[], int], queued: Callable[[], int]):
+    """Создаёт метрики; active/queued читаются в момент запроса /metrics"""
+    # prometheus_client нужен только при включённых метриках
+    from prometheus_client import Counter, Gauge, Histogram
+
+    _metrics.update({
+        SSH_CONNECT: Histogram("backup_bot_ssh_connect_seconds",
+                               "SSH connection setup time", ["host"]),
+        RAC: Histogram("backup_bot_rac_seconds", "rac command latency", ["host"]),
+        DUMP: Histogram("backup_bot_dump_seconds", "Infobase dump duration",
+                        ["host", "infobase"], buckets=_LONG_BUCKETS),
+        UPLOAD: Histogram("backup_bot_upload_seconds", "Cloud upload duration",
+                          ["host", "infobase"], buckets=_LONG_BUCKETS),
+        UPLOAD_SPEED: Histogram("backup_bot_upload_bytes_per_second", "Cloud upload throughput",
+                                ["host", "infobase"], buckets=_SPEED_BUCKETS),
+        SQLITE_QUERY: Histogram("backup_bot_sqlite_query_seconds",
+                                "SQLite query latency", ["query"]),
+        HANDLER: Histogram("backup_bot_handler_seconds",
+                           "Telegram update handling latency", ["handler"]),
+        SERVER_LOAD: Gauge("backup_bot_server_load_per_cpu",
+                           "1-minute load average per CPU during backups", ["host"]),
+        SERVER_IOWAIT: Gauge("backup_bot_server_iowait_percent",
+                             "CPU iowait during backups", ["host"]),
+        RAC_SESSIONS: Gauge("backup_bot_rac_sessions", "1C sessions during backups", ["host"]),
+        THROTTLE_LEVEL: Gauge("backup_bot_throttle_level",
+                              "Backup throttling: 0 - normal, 1 - lowest priority, 2 - upload paused",
+                              ["host"]),
+        THROTTLE_CHANGES: Counter("backup_bot_throttle_changes",
+                                  "Backup throttling level changes", ["host", "level"]),
+    })
+    Gauge("backup_bot_backups_active", "Backups being dumped or uploaded").set_function(active)
+    Gauge("backup_bot_backups_queued", "Backups waiting in the queue").set_function(queued)
+
+def observe(name: str, value: float, *labels: str):
+    metric = _metrics.get(name)
+    if metric is not None:
+        (metric.labels(*labels) if labels else metric).observe(value)
+
+def set_value(name: str, value: float, *labels: str):
+    metric = _metrics.get(name)
+    if metric is not None:
+        (metric.labels(*labels) if labels else metric).set(value)
+
+def inc(name: str, *labels: str):
+    metric = _metrics.get(name)
+    if metric is not None:
+        (metric.labels(*labels) if labels else metric).inc()
+
+def timed(name: str, labels: Callable[..., tuple] = None):
+    """Декоратор корутины: время выполнения в гистограмму name.
+
+    labels получает аргументы вызова и возвращает значения меток.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            if name not in _metrics:
+                return await func(*args, **kwargs)
+            started = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                observe(name, time.perf_counter() - started,
+                        *(labels(*args, **kwargs) if labels else ()))
+        return wrapper
+    return decorator
+
+def query(func):
+    """Декоратор метода Database: метка запроса - имя метода"""
+    return timed(SQLITE_QUERY, lambda *args, **kwargs: (func.__name__,))(func)
+
+async def start_server(host: str, port: int):
+    """Поднимает HTTP-сервер с /metrics, возвращает aiohttp AppRunner"""
+    from aiohttp import web
+    from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
+
+    async def handle_metrics(request):
+        return web.Response(body=generate_latest(),
+                            headers={"Content-Type": CONTENT_TYPE_LATEST})
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle_metrics)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info("Metrics available at http://%s:%s/metrics", host, port)
+    return runner
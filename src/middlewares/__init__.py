@@ -1,6 +1,14 @@
 from aiogram import Dispatcher
 from .database import DatabaseMiddleware
+from .context import ContextMiddleware
+from .metrics import MetricsMiddleware
 from database import Database
+from context import AppContext
+import metrics
 
-def register_all_middlewares(dp: Dispatcher, db: Database):
-    dp.middleware.setup(DatabaseMiddleware(db)) 
\ No newline at end of file
+def register_all_middlewares(dp: Dispatcher, db: Database, context: AppContext):
+    dp.middleware.setup(DatabaseMiddleware(db))
+    dp.middleware.setup(ContextMiddleware(context))
+    # Без включённых метрик middleware не регистрируется и ничего не стоит
+    if metrics.enabled():
+        dp.middleware.setup(MetricsMiddleware())
@@ -0,0 +1,34 @@
+from aiogram.dispatcher.middlewares import BaseMiddleware
+from aiogram.types import Message, CallbackQuery
+from context import AppContext
+
+CONTEXT_KEYS = ("config", "ssh", "backups", "sender")
+
+class ContextMiddleware(BaseMiddleware):
+    def __init__(self, context: AppContext):
+        super().__init__()
+        self.context = context
+
+    def _inject(self, data: dict):
+        # Снимок на момент начала обработки: перезагрузка не поменяет его посреди апдейта
+        data["config"] = self.context.config
+        data["ssh"] = self.context.ssh
+        data["backups"] = self.context.backups
+        data["sender"] = self.context.sender
+
+    @staticmethod
+    def _cleanup(data: dict):
+        for key in CONTEXT_KEYS:
+            data.pop(key, None)
+
+    async def on_pre_process_message(self, message: Message, data: dict):
+        self._inject(data)
+
+    async def on_pre_process_callback_query(self, callback_query: CallbackQuery, data: dict):
+        self._inject(data)
+
+    async def on_post_process_message(self, message: Message, results, data: dict):
+        self._cleanup(data)
+
+    async def on_post_process_callback_query(self, callback_query: CallbackQuery, results, data: dict):
+        self._cleanup(data)
@@ -0,0 +1,33 @@
+import re
+import time
+
+from aiogram.dispatcher.middlewares import BaseMiddleware
+from aiogram.types import Message, CallbackQuery
+
+import metrics
+
+# approve_123, users|p|..., backup_0|buh -> approve, users, backup
+_CALLBACK_PREFIX = re.compile(r"[^_|]*")
+
+class MetricsMiddleware(BaseMiddleware):
+    """Время обработки апдейта по командам и видам кнопок"""
+
+    async def on_pre_process_message(self, message: Message, data: dict):
+        data["_started"] = time.perf_counter()
+
+    async def on_pre_process_callback_query(self, callback_query: CallbackQuery, data: dict):
+        data["_started"] = time.perf_counter()
+
+    async def on_post_process_message(self, message: Message, results, data: dict):
+        command = message.get_command(pure=True)
+        self._observe(data, f"/{command}" if command else "message")
+
+    async def on_post_process_callback_query(self, callback_query: CallbackQuery, results, data: dict):
+        prefix = _CALLBACK_PREFIX.match(callback_query.data or "").group()
+        self._observe(data, f"callback:{prefix}")
+
+    @staticmethod
+    def _observe(data: dict, handler: str):
+        started = data.pop("_started", None)
+        if started is not None:
+            metrics.observe(metrics.HANDLER, time.perf_counter() - started, handler)
@@ -0,0 +1,63 @@
+from itertools import repeat
+from typing import Dict, Iterable, Iterator, Union
+
+# Вывод rac - блоки строк "ключ : значение", разделённые пустой строкой:
+#
+#   infobase : 1f2e3d4c-...
+#   name     : buh
+#   descr    : "Бухгалтерия предприятия"
+#
+# Блок разбирается в словарь "ключ rac -> строка" за один проход, без
+# промежуточных объектов. Ключи rac выводит в нижнем регистре и сравниваются
+# они целиком, а не по вхождению подстроки. Значение в кавычках может занимать
+# несколько строк (перевод строки в описании базы). Ключа, которого rac не
+# вывел, в словаре нет.
+
+def _is_closed(value: str) -> bool:
+    """Закрыта ли строка, начатая кавычкой: удвоенные кавычки - символ, а не конец,
+    поэтому у закрытой строки кавычек чётное число и последняя стоит в конце"""
+    return len(value) >= 2 and value[-1] == '"' and not value.count('"') % 2
+
+def _quoted(value: str, lines: Iterator[str]) -> str:
+    """Дочитывает из lines значение в кавычках, не закрытое на своей строке"""
+    parts = [value]
+    for line in lines:
+        parts.append(line.rstrip('\r\n'))
+        value = "\n".join(parts).rstrip()
+        if _is_closed(value):
+            return value
+    # Вывод оборвался внутри кавычек - берём что есть
+    return "\n".join(parts) + '"'
+
+def _parse(output: Union[str, Iterable[str]], required: str = "") -> Iterator[Dict[str, str]]:
+    lines = iter(output.splitlines() if isinstance(output, str) else output)
+    block: Dict[str, str] = {}
+    # partition через map: на тысячах баз вызов метода на каждой строке заметен.
+    # map берёт строки из того же итератора, так что _quoted дочитывает следующие
+    for key, separator, value in map(str.partition, lines, repeat(':')):
+        if separator:
+            value = value.strip()
+            if '"' in value and value[0] == '"':
+                if not _is_closed(value):
+                    value = _quoted(value, lines)
+                # Строки с пробелами rac берёт в кавычки, кавычки внутри удваивает
+                value = value[1:-1].replace('""', '"')
+            block[key.strip()] = value
+        elif block and not key.strip():
+            if not required or block.get(required):
+                yield block
+            block = {}
+    if block and (not required or block.get(required)):
+        yield block
+
+def parse_blocks(output: Union[str, Iterable[str]]) -> Iterator[Dict[str, str]]:
+    """Лениво разбирает вывод rac на словари по одному на блок"""
+    return _parse(output)
+
+def parse_clusters(output: Union[str, Iterable[str]]) -> Iterator[Dict[str, str]]:
+    """Кластеры: cluster (ID), host, port, name и прочие ключи rac"""
+    return _parse(output, "cluster")
+
+def parse_infobases(output: Union[str, Iterable[str]]) -> Iterator[Dict[str, str]]:
+    """Базы: infobase (ID), name, descr и прочие ключи rac; блоки без имени пропускаются"""
+    return _parse(output, "name")
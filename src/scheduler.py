@@ -0,0 +1,38 @@
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, List
+
+logger = logging.getLogger(__name__)
+
+def parse_times(value: str) -> List[str]:
+    """Разбирает список времени запуска вида "03:00,23:30" """
+    times = []
+    for item in value.split(","):
+        item = item.strip()
+        if item:
+            datetime.strptime(item, "%H:%M")
+            times.append(item)
+    return times
+
+def seconds_until_next(times: List[str], now: datetime = None) -> float:
+    now = now or datetime.now()
+    candidates = []
+    for item in times:
+        hour, minute = map(int, item.split(":"))
+        run_at = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+        if run_at <= now:
+            run_at += timedelta(days=1)
+        candidates.append(run_at)
+    return (min(candidates) - now).total_seconds()
+
+async def run_daily(times: List[str], job: Callable[[], Awaitable[None]]):
+    """Ежедневно запускает job в указанное (локальное) время"""
+    while True:
+        delay = seconds_until_next(times)
+        logger.info("Next scheduled backup in %.0f seconds", delay)
+        await asyncio.sleep(delay)
+        try:
+            await job()
+        except Exception as e:
+            logger.error("Scheduled backup failed: %s", e)
@@ -0,0 +1,163 @@
+import asyncio
+import logging
+import time
+from collections import defaultdict
+from typing import Awaitable, Callable, Dict, List
+
+from aiogram import Bot, types
+from aiogram.utils.exceptions import MessageNotModified, RetryAfter
+
+logger = logging.getLogger(__name__)
+
+# Лимиты Telegram: ~30 сообщений в секунду всего, ~1 в секунду в личный чат
+# (короткие всплески допускаются) и 20 в минуту в группу
+GLOBAL_RATE = 30
+CHAT_RATE = 1
+CHAT_BURST = 3
+GROUP_RATE = 20 / 60
+
+MAX_MESSAGE_LENGTH = 4096
+
+class TokenBucket:
+    """Ведро токенов в форме GCRA: хранится только время следующей отправки"""
+
+    def __init__(self, rate: float, burst: int = 1):
+        self.interval = 1 / rate
+        self.tolerance = (burst - 1) * self.interval
+        self._tat = 0.0  # теоретическое время прихода следующего запроса
+
+    def reserve(self) -> float:
+        """Занимает токен и возвращает, сколько секунд ждать до отправки"""
+        now = time.monotonic()
+        tat = max(self._tat, now)
+        self._tat = tat + self.interval
+        return max(tat - self.tolerance - now, 0.0)
+
+    def pause(self, seconds: float):
+        # После 429 ни одна отправка не пройдёт раньше Retry-After
+        self._tat = max(self._tat, time.monotonic() + seconds + self.tolerance)
+
+    @property
+    def idle(self) -> bool:
+        return self._tat <= time.monotonic()
+
+class Sender:
+    """Единая точка исходящих сообщений с ограничением скорости.
+
+    Обработчики вызывают её вместо message.answer/bot.send_message/edit_text.
+    Правки одного сообщения, ещё ожидающие отправки, схлопываются в последнюю;
+    низкоприоритетные уведомления (notify) собираются в одно сообщение на чат.
+    """
+
+    def __init__(self, bot: Bot, global_rate: float = GLOBAL_RATE,
+                 chat_rate: float = CHAT_RATE, chat_burst: int = CHAT_BURST,
+                 group_rate: float = GROUP_RATE, batch_delay: float = 3,
+                 max_retries: int = 3):
+        self.bot = bot
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.group_rate = group_rate
+        self.batch_delay = batch_delay
+        self.max_retries = max_retries
+        self._global = TokenBucket(global_rate, burst=global_rate)
+        self._chats: Dict[int, TokenBucket] = {}
+        # (чат, сообщение) -> [последние аргументы правки, задача отправки]
+        self._edits: Dict[tuple, list] = {}
+        self._batches: Dict[int, List[str]] = defaultdict(list)
+        self._flushes: Dict[int, asyncio.Task] = {}
+
+    def _bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) > 1000:
+                # Вёдра простаивающих чатов ничего не помнят - их можно выбросить
+                self._chats = {key: value for key, value in self._chats.items() if not value.idle}
+            if chat_id < 0:
+                bucket = TokenBucket(self.group_rate)
+            else:
+                bucket = TokenBucket(self.chat_rate, self.chat_burst)
+            self._chats[chat_id] = bucket
+        return bucket
+
+    async def _call(self, chat_id: int, send: Callable[[], Awaitable]):
+        """Дожидается токенов чата и общего, выполняет send, повторяет после 429"""
+        bucket = self._bucket(chat_id)
+        for attempt in range(self.max_retries + 1):
+            # Общий токен берём только после ожидания своего чата, чтобы не простаивал
+            await asyncio.sleep(bucket.reserve())
+            await asyncio.sleep(self._global.reserve())
+            try:
+                return await send()
+            except RetryAfter as e:
+                if attempt == self.max_retries:
+                    raise
+                logger.warning("Flood control in chat %s, retry in %s s", chat_id, e.timeout)
+                bucket.pause(e.timeout)
+
+    async def send_message(self, chat_id: int, text: str, **kwargs) -> types.Message:
+        return await self._call(chat_id, lambda: self.bot.send_message(chat_id, text, **kwargs))
+
+    async def answer(self, message: types.Message, text: str, **kwargs) -> types.Message:
+        return await self.send_message(message.chat.id, text, **kwargs)
+
+    async def edit_text(self, message: types.Message, text: str, **kwargs):
+        """Редактирует сообщение; если прошлая правка ещё ждёт - заменяет её текст"""
+        key = (message.chat.id, message.message_id)
+        entry = self._edits.get(key)
+        if entry is not None:
+            entry[0] = (text, kwargs)
+            return await asyncio.shield(entry[1])
+
+        entry = [(text, kwargs), None]
+
+        async def send():
+            # С этого момента новые правки пойдут отдельной отправкой
+            if self._edits.get(key) is entry:
+                del self._edits[key]
+            last_text, last_kwargs = entry[0]
+            try:
+                return await message.edit_text(last_text, **last_kwargs)
+            except MessageNotModified:
+                return None
+
+        self._edits[key] = entry
+        entry[1] = asyncio.ensure_future(self._call(message.chat.id, send))
+        return await asyncio.shield(entry[1])
+
+    def notify(self, chat_id: int, text: str):
+        """Низкоприоритетное уведомление: отправится вместе с соседними одним сообщением"""
+        self._batches[chat_id].append(text)
+        if chat_id not in self._flushes:
+            self._flushes[chat_id] = asyncio.ensure_future(self._flush_later(chat_id))
+
+    async def _flush_later(self, chat_id: int):
+        try:
+            await asyncio.sleep(self.batch_delay)
+        finally:
+            self._flushes.pop(chat_id, None)
+        await self._flush(chat_id)
+
+    async def _flush(self, chat_id: int):
+        texts = self._batches.pop(chat_id, [])
+        for chunk in _join_chunks(texts):
+            try:
+                await self.send_message(chat_id, chunk)
+            except Exception as e:
+                logger.error("Failed to send notification to %s: %s", chat_id, e)
+
+    async def close(self):
+        """Отправляет накопленные уведомления без ожидания"""
+        for task in list(self._flushes.values()):
+            task.cancel()
+        self._flushes.clear()
+        await asyncio.gather(*(self._flush(chat_id) for chat_id in list(self._batches)))
+
+def _join_chunks(texts: List[str], limit: int = MAX_MESSAGE_LENGTH) -> List[str]:
+    chunks: List[str] = []
+    for text in texts:
+        text = text[:limit]
+        if chunks and len(chunks[-1]) + 2 + len(text) <= limit:
+            chunks[-1] += "\n\n" + text
+        else:
+            chunks.append(text)
+    return chunks
@@ -1,87 +1,573 @@
 import asyncio
 import asyncssh
+import json
+import logging
 import re
-from typing import Optional, List
+import secrets
+import shlex
+import time
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Dict, Optional, List, Tuple
 from datetime import datetime
 
-class SSHManager:
-    # Словарь для отслеживания активных выгрузок (статический атрибут класса)
-    active_backups = {}
+import metrics
+from rac_parser import parse_blocks, parse_clusters, parse_infobases
+from throttle import NORMAL, LoadThrottle
 
-    def __init__(self, host: str, username: str, password: str, db_server: str, 
-                 db_user: str, db_pwd: str, user: str, user_pwd: str,
-                 rclone_remote: str, rclone_path: str):
+logger = logging.getLogger(__name__)
+
+# Этап выгрузки ("dumping", "compressing", "uploading") и путь к файлу на сервере
+StageCallback = Callable[[str, str], Awaitable[None]]
+ProgressCallback = Callable[[dict], None]
+
+_SIZE_UNITS = {
+    "b": 1, "kib": 1024, "mib": 1024 ** 2, "gib": 1024 ** 3, "tib": 1024 ** 4,
+    "kb": 1000, "mb": 1000 ** 2, "gb": 1000 ** 3, "tb": 1000 ** 4
+}
+_SIZE = r'([\d.]+)\s*([KMGT]i?B|B|Bytes)'
+# Строка статистики rclone: "1.000 GiB / 4.000 GiB, 25%, 100.000 MiB/s, ETA 30s"
+_RCLONE_STATS_RE = re.compile(
+    _SIZE + r'\s*/\s*' + _SIZE + r',\s*(\d+)%,\s*' + _SIZE + r'/s,\s*ETA\s*(\S+)'
+)
+# Для rcat общий объём неизвестен: берём переданное и скорость
+_RCLONE_STREAM_RE = re.compile(_SIZE + r'\s*/.*?' + _SIZE + r'/s')
+# Итог zstd -v: "(  1.00 GiB =>    256 MiB, ...)" или "(1073741824 => 268702153 bytes, ...)"
+_ZSTD_SUMMARY_RE = re.compile(
+    r'\(\s*([\d.]+)\s*([KMGT]i?B|B)?\s*=>\s*([\d.]+)\s*([KMGT]i?B|B|bytes)'
+)
+# Ошибки записи ibcmd в именованный канал: выгрузка в файл здесь не поможет только им
+_FIFO_ERROR_RE = re.compile(r'illegal seek|not a regular file|ESPIPE', re.IGNORECASE)
+_PERCENT_RE = re.compile(r'(\d{1,3}(?:[.,]\d+)?)\s*%')
+_DURATION_RE = re.compile(r'(\d+(?:\.\d+)?)(ms|d|h|m|s)')
+
+def _parse_size(value: str, unit: str) -> int:
+    return int(float(value) * _SIZE_UNITS.get(unit.lower().replace("bytes", "b"), 1))
+
+def _parse_duration(value: str) -> Optional[float]:
+    """Разбирает длительность rclone вида 1h2m3s"""
+    parts = _DURATION_RE.findall(value)
+    if not parts:
+        return None
+    factors = {"ms": 0.001, "s": 1, "m": 60, "h": 3600, "d": 86400}
+    return sum(float(number) * factors[unit] for number, unit in parts)
+
+class _ProgressMeter:
+    """Считает скорость и оставшееся время по замерам объёма"""
+
+    def __init__(self, stage: str, callback: ProgressCallback):
+        self.stage = stage
+        self.callback = callback
+        self.started = time.monotonic()
+        self._last = (self.started, 0)
+        self.speed = None
+
+    def update(self, done: int = None, total: int = None, percent: float = None,
+               speed: float = None, eta: float = None):
+        now = time.monotonic()
+        if done is not None and speed is None:
+            last_time, last_done = self._last
+            if now > last_time and done >= last_done:
+                current = (done - last_done) / (now - last_time)
+                # Сглаживаем скорость, чтобы ETA не прыгало
+                self.speed = current if self.speed is None else 0.7 * self.speed + 0.3 * current
+            self._last = (now, done)
+            speed = self.speed
+        if percent is None and done is not None and total:
+            percent = done * 100 / total
+        if eta is None:
+            if total and done is not None and speed:
+                eta = max(total - done, 0) / speed
+            elif percent:
+                elapsed = now - self.started
+                eta = elapsed * (100 - percent) / percent
+        self.callback({
+            "stage": self.stage,
+            "done": done,
+            "total": total,
+            "percent": percent,
+            "speed": speed,
+            "eta": eta
+        })
+
+PLATFORM_ROOT = "/opt/1cv8/x86_64"
+
+# Описание копии хранится рядом с ней в облаке: <файл>.manifest.json
+MANIFEST_SUFFIX = ".manifest.json"
+# Большой файл загружается частями в каталог <файл>.parts (части 00000, 00001, ...)
+PARTS_SUFFIX = ".parts"
+
+def _version_key(version: str) -> tuple:
+    return tuple(int(part) for part in version.split('.'))
+
+def _error_tail(output: str, lines: int = 5, limit: int = 500) -> str:
+    """Последние строки вывода упавшей команды - для сообщения пользователю"""
+    tail = "\n".join(line for line in output.strip().splitlines()[-lines:] if line.strip())
+    return tail[-limit:]
+
+def _is_not_found(result, utility: Optional[str]) -> bool:
+    """Не найдена сама утилита платформы (rac/ibcmd) по пути utility.
+
+    Прочие "not found" (нет базы, каталога, пути в облаке) повторная
+    выгрузка с новым путём не исправит.
+    """
+    if result.exit_status == 127:
+        return True
+    return bool(utility) and any(
+        utility in line and ("No such file" in line or "not found" in line)
+        for line in (result.stderr or "").splitlines()
+    )
+
+@dataclass
+class Step:
+    """Один шаг удалённого скрипта: готовая команда shell (аргументы - через shlex.quote)"""
+    name: str
+    command: str
+    # Прервать скрипт, если шаг завершился с ошибкой
+    check: bool = True
+    # Данные для stdin команды
+    input: Optional[str] = None
+
+@dataclass
+class StepResult:
+    name: str
+    exit_status: int
+    stdout: str = ""
+    stderr: str = ""
+    duration: Optional[float] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.exit_status == 0
+
+def _steps_script(steps: List[Step], token: str) -> str:
+    lines = []
+    for index, step in enumerate(steps):
+        command = step.command
+        if step.input is not None:
+            command += f" <<'{token}_input'\n{step.input}\n{token}_input"
+        # $EPOCHREALTIME - встроенная переменная bash 5, замер без запуска date
+        lines.append("__started=$EPOCHREALTIME")
+        lines.append(f"{{ {command}\n}}")
+        lines.append(
+            f'__rc=$?; echo; echo "{token} {index} $__rc $__started $EPOCHREALTIME"; '
+            f'echo "{token}" >&2'
+        )
+        if step.check:
+            lines.append("[ $__rc -eq 0 ] || exit $__rc")
+    return "\n".join(lines)
+
+def _parse_cloud_listing(output: str) -> List[dict]:
+    """Копии из вывода rclone lsjson без манифестов, от старых к новым.
+
+    Копия, загруженная частями, - каталог <файл>.parts; пока у него нет
+    манифеста, загрузка не закончена и он помечается Partial.
+    """
+    items = json.loads(output or "[]")
+    names = {item["Name"] for item in items}
+    files = []
+    for item in items:
+        if item.get("IsDir"):
+            if not item["Name"].endswith(PARTS_SUFFIX):
+                continue
+            item["Partial"] = item["Name"] + MANIFEST_SUFFIX not in names
+        elif item["Name"].endswith(MANIFEST_SUFFIX):
+            continue
+        files.append(item)
+    # Имя файла содержит метку времени выгрузки
+    return sorted(files, key=lambda item: item["Name"])
+
+def _cloud_names(path: str) -> List[str]:
+    """Имена, под которыми выгрузка в path загружается в облако"""
+    file_name = path.split('/')[-1]
+    if file_name.endswith(".fifo"):
+        # Потоковая выгрузка загружает канал под именем дампа
+        file_name = file_name[:-len(".fifo")] + ".dt"
+        return [file_name, file_name + ".zst"]
+    return [file_name]
+
+def _share_link(output: str) -> str:
+    """Ссылка из вывода rclone link"""
+    share_link = output.strip()
+    # Преобразуем ссылку для Yandex.Disk
+    if 'disk.yandex.ru/d/' in share_link:
+        # Извлекаем хеш из ссылки и формируем прямую ссылку на скачивание
+        hash_part = share_link.split('/')[-1]
+        return f"https://disk.yandex.ru/d/{hash_part}"
+    return share_link
+
+def _step_duration(started: str, finished: str) -> Optional[float]:
+    try:
+        return float(finished.replace(',', '.')) - float(started.replace(',', '.'))
+    except ValueError:
+        return None
+
+class _PoolClient(asyncssh.SSHClient):
+    """Клиент asyncssh, сообщающий пулу о разрыве соединения"""
+
+    def __init__(self, pool: 'SSHPool'):
+        self._pool = pool
+        self._conn = None
+
+    def connection_made(self, conn: asyncssh.SSHClientConnection) -> None:
+        self._conn = conn
+
+    def connection_lost(self, exc: Optional[Exception]) -> None:
+        self._pool._forget(self._conn, exc)
+
+class SSHPool:
+    """Общее долгоживущее SSH-подключение с ограничением числа каналов"""
+
+    def __init__(self, host: str, username: str, password: str,
+                 max_channels: int = 10, port: int = 22, keepalive_interval: int = 30,
+                 health_check_interval: int = 60, connect_timeout: int = 15):
         self.host = host
+        self.port = port
         self.username = username
         self.password = password
+        self.keepalive_interval = keepalive_interval
+        self.health_check_interval = health_check_interval
+        self.connect_timeout = connect_timeout
+        self._conn = None
+        self._last_used = 0.0
+        self._connect_lock = asyncio.Lock()
+        self._channels = asyncio.Semaphore(max_channels)
+
+    def _forget(self, conn, exc: Optional[Exception] = None):
+        if conn is not None and conn is self._conn:
+            if exc:
+                logger.warning("SSH connection to %s lost: %s", self.host, exc)
+            self._conn = None
+
+    async def _is_healthy(self, conn: asyncssh.SSHClientConnection) -> bool:
+        try:
+            result = await asyncio.wait_for(conn.run('true'), self.connect_timeout)
+            return result.exit_status == 0
+        except Exception:
+            return False
+
+    async def get_connection(self) -> asyncssh.SSHClientConnection:
+        """Возвращает живое подключение, при необходимости переподключаясь"""
+        async with self._connect_lock:
+            conn = self._conn
+            idle = time.monotonic() - self._last_used
+            if conn is not None and idle > self.health_check_interval:
+                # Давно не пользовались - проверяем, что сервер ещё отвечает
+                if not await self._is_healthy(conn):
+                    self._forget(conn)
+                    conn.close()
+
+            if self._conn is None:
+                started = time.perf_counter()
+                self._conn = await asyncssh.connect(
+                    host=self.host,
+                    port=self.port,
+                    username=self.username,
+                    password=self.password,
+                    known_hosts=None,
+                    client_factory=lambda: _PoolClient(self),
+                    connect_timeout=self.connect_timeout,
+                    keepalive_interval=self.keepalive_interval
+                )
+                metrics.observe(metrics.SSH_CONNECT, time.perf_counter() - started, self.host)
+                self._last_used = time.monotonic()
+            return self._conn
+
+    @asynccontextmanager
+    async def channel(self):
+        """Занимает один из каналов общего подключения"""
+        async with self._channels:
+            conn = await self.get_connection()
+            try:
+                yield conn
+            finally:
+                self._last_used = time.monotonic()
+
+    async def run(self, command: str, **kwargs) -> asyncssh.SSHCompletedProcess:
+        try:
+            async with self.channel() as conn:
+                return await conn.run(command, **kwargs)
+        except asyncssh.ChannelOpenError:
+            # Канал не открылся - соединение мертво, переподключаемся один раз
+            self._forget(conn)
+            conn.close()
+            async with self.channel() as conn:
+                return await conn.run(command, **kwargs)
+
+    async def run_streaming(self, command: str,
+                            on_line: Callable[[str], None]) -> asyncssh.SSHCompletedProcess:
+        """Выполняет команду, передавая строки stdout и stderr по мере появления"""
+        async with self.channel() as conn:
+            async with conn.create_process(command) as process:
+                async def pump(stream):
+                    async for line in stream:
+                        on_line(line.rstrip('\r\n'))
+
+                await asyncio.gather(pump(process.stdout), pump(process.stderr))
+                return await process.wait()
+
+    async def run_steps(self, steps: List['Step'],
+                        on_line: Callable[[str], None] = None) -> Dict[str, 'StepResult']:
+        """Выполняет последовательность шагов одним скриптом за один запрос.
+
+        Шаг с check=True при ошибке прерывает скрипт; выполненные шаги
+        возвращаются по имени с кодом выхода, временем и выводом. С on_line
+        строки вывода передаются по мере появления, а stdout/stderr шагов
+        не собираются.
+        """
+        token = f"__step_{secrets.token_hex(8)}"
+        command = f"bash -c {shlex.quote(_steps_script(steps, token))}"
+        marker = re.compile(rf'^{token} (\d+) (-?\d+) (\S*) (\S*)$', re.MULTILINE)
+        results: Dict[str, StepResult] = {}
+
+        def add_result(match, stdout: str = "", stderr: str = ""):
+            step = steps[int(match.group(1))]
+            results[step.name] = StepResult(
+                name=step.name,
+                exit_status=int(match.group(2)),
+                stdout=stdout,
+                stderr=stderr,
+                duration=_step_duration(match.group(3), match.group(4))
+            )
+
+        if on_line:
+            def filter_line(line: str):
+                match = marker.match(line)
+                if match:
+                    add_result(match)
+                elif line and line != token:
+                    on_line(line)
+
+            await self.run_streaming(command, filter_line)
+            return results
+
+        result = await self.run(command)
+        stdout, stderr = result.stdout or "", result.stderr or ""
+        stderr_parts = stderr.split(f"{token}\n")
+        position = 0
+        for index, match in enumerate(marker.finditer(stdout)):
+            # Перед меткой скрипт выводит перевод строки - убираем его
+            output = stdout[position:match.start()][:-1]
+            position = match.end() + 1
+            add_result(match, output, stderr_parts[index] if index < len(stderr_parts) else "")
+        return results
+
+    async def close(self):
+        conn = self._conn
+        self._conn = None
+        if conn:
+            conn.close()
+            await conn.wait_closed()
+
+class SSHManager:
+    def __init__(self, pool: SSHPool, db_server: str,
+                 db_user: str, db_pwd: str, user: str, user_pwd: str,
+                 rclone_remote: str, rclone_path: str,
+                 databases_cache_ttl: int = 300, progress_interval: int = 5,
+                 streaming: bool = False, compression: str = None,
+                 zstd_level: int = 3, zstd_threads: int = 0, keep_last: int = 1,
+                 skip_identical: bool = True, nice: int = 10, ionice_class: int = 2,
+                 ionice_level: int = 7, bwlimit: str = None, throttle_interval: int = 30,
+                 max_load: float = 1.5, max_iowait: float = 30, max_sessions: int = 0,
+                 max_pause: int = 600, upload_streams: int = 4, upload_chunk_size: int = 0,
+                 upload_retries: int = 3, store=None,
+                 platform_version: str = None, platform_ttl: int = 86400):
+        self.pool = pool
         self.db_server = db_server
+        self.dbms = "PostgreSQL"
         self.db_user = db_user
         self.db_pwd = db_pwd
         self.user = user
         self.user_pwd = user_pwd
-        self._conn = None
+        self._prepared = False
+        self._prepare_lock = asyncio.Lock()
+        # Версии платформы сохраняются в SQLite (store - экземпляр Database)
+        self.store = store
+        self.platform_version = platform_version
+        self.platform_ttl = platform_ttl
+        self._platforms = []
+        self._platform_detected_at = 0.0
+        # Кэш списка информационных баз
+        self.databases_cache_ttl = databases_cache_ttl
+        self._databases = None
+        self._databases_fetched_at = 0.0
+        self._databases_refresh = None
         self._platform_version = None
         self._platform_path = None
         self.backup_dir = "~/dump_1s_dt"
         self.rclone_remote = rclone_remote
         self.rclone_path = rclone_path
-
-    @classmethod
-    def is_backup_active(cls, db_name: str) -> bool:
-        return db_name in cls.active_backups
+        self.progress_interval = progress_interval
+        # Потоковая выгрузка: ibcmd -> именованный канал -> [zstd] -> rclone rcat
+        self.streaming = streaming
+        # Сжатие перед загрузкой (или на лету при потоковой выгрузке): None или "zstd"
+        self.compression = compression
+        self.zstd_level = zstd_level
+        self.zstd_threads = zstd_threads  # 0 - все ядра сервера
+        self._streaming_supported = None
+        # Хранение копий в облаке: сколько последних оставлять на каждую базу
+        self.keep_last = max(keep_last, 1)
+        self.skip_identical = skip_identical
+        # Выгрузка не должна мешать пользователям 1С: приоритет, скорость загрузки
+        # и притормаживание по нагрузке сервера
+        self.bwlimit = bwlimit
+        self.throttle = LoadThrottle(
+            pool, sessions=self.count_sessions, nice=nice, ionice_class=ionice_class,
+            ionice_level=ionice_level, interval=throttle_interval, max_load=max_load,
+            max_iowait=max_iowait, max_sessions=max_sessions, max_pause=max_pause
+        )
+        self._cluster_ids: List[str] = []
+        # Загрузка в облако: число потоков, размер части в байтах (0 - файл
+        # целиком одной командой rclone) и повторы после ошибки
+        self.upload_streams = max(upload_streams, 1)
+        self.upload_chunk_size = upload_chunk_size
+        self.upload_retries = upload_retries
 
     async def connect(self):
-        try:
-            self._conn = await asyncssh.connect(
-                host=self.host,
-                username=self.username,
-                password=self.password,
-                known_hosts=None
-            )
-            # При подключении сразу определяем версию и путь
-            await self._detect_platform_version()
-            # Создаем директорию для бэкапов, если её нет
-            await self._ensure_backup_dir()
-            return True
-        except Exception as e:
-            print(f"SSH connection error: {e}")
-            return False
+        """Готовит сервер: версия платформы (из кэша или заново) и каталог бэкапов"""
+        async with self._prepare_lock:
+            fresh = time.time() - self._platform_detected_at < self.platform_ttl
+            if self._prepared and self._platform_path and fresh:
+                return True
+            try:
+                await self.pool.get_connection()
+                # Версию и пути берём из SQLite, а если их нет или они устарели - определяем
+                if not await self._load_platform():
+                    await self._detect_platform_version()
+                if not self._prepared:
+                    # Создаем директорию для бэкапов, если её нет
+                    await self._ensure_backup_dir()
+                self._prepared = True
+                return True
+            except Exception as e:
+                logger.error("SSH connection error: %s", e)
+                return False
 
     async def _ensure_backup_dir(self):
         """Создает директорию для бэкапов, если она не существует"""
         try:
-            # Раскрываем ~ в полный путь
-            result = await self._conn.run('echo $HOME')
-            home_dir = result.stdout.strip()
-            self.backup_dir = f"{home_dir}/dump_1s_dt"
-            
-            # Создаем директорию, если её нет
-            await self._conn.run(f'mkdir -p {self.backup_dir}')
+            # Создаем директорию и раскрываем ~ в полный путь одним запросом
+            results = await self.pool.run_steps([
+                Step("mkdir", 'mkdir -p "$HOME/dump_1s_dt/.throttle" && echo "$HOME"'),
+                # Процессы, приостановленные до перезапуска бота, продолжают работу
+                Step("resume", self.throttle.action_script(NORMAL, '"$HOME/dump_1s_dt/.throttle"'),
+                     check=False),
+            ])
+            mkdir = results.get("mkdir")
+            if mkdir is None or not mkdir.ok:
+                raise RuntimeError(mkdir.stderr.strip() if mkdir else "mkdir failed")
+            self.backup_dir = f"{mkdir.stdout.strip()}/dump_1s_dt"
+            self.throttle.pid_dir = f"{self.backup_dir}/.throttle"
         except Exception as e:
-            print(f"Error creating backup directory: {e}")
+            logger.error("Error creating backup directory: %s", e)
             raise
 
+    async def _load_platform(self) -> bool:
+        """Берёт сохранённые версии платформы, если они не старше platform_ttl"""
+        if not self.store:
+            return False
+        platforms = await self.store.get_platforms(self.pool.host)
+        if not platforms:
+            return False
+        detected_at = min(platform["detected_at"] for platform in platforms)
+        if time.time() - detected_at >= self.platform_ttl:
+            return False
+        self._platforms = platforms
+        self._platform_detected_at = detected_at
+        return self._choose_platform()
+
+    def _choose_platform(self) -> bool:
+        """Выбирает версию: явно заданная > выбранная админом > запущенный ragent > новейшая"""
+        if not self._platforms:
+            return False
+        by_version = {platform["version"]: platform for platform in self._platforms}
+        chosen = by_version.get(self.platform_version)
+        if not chosen:
+            chosen = next((p for p in self._platforms if p["selected"]), None)
+        if not chosen:
+            running = [p for p in self._platforms if p["running"]] or self._platforms
+            chosen = max(running, key=lambda p: _version_key(p["version"]))
+        self._platform_version = chosen["version"]
+        self._platform_path = chosen["path"]
+        return True
+
     async def _detect_platform_version(self):
         try:
-            # Получаем список процессов ragent
-            result = await self._conn.run('ps aux | grep ragent | grep -v grep')
-            output = result.stdout
+            # Версии запущенных ragent и все установленные платформы за один запрос
+            result = await self.pool.run(
+                'ps aux | grep [r]agent; echo "---"; '
+                f'ls -1d {PLATFORM_ROOT}/*/ 2>/dev/null'
+            )
+            running_output, _, installed_output = result.stdout.partition('---')
 
-            # Ищем версию в выводе
+            # Ищем версии в выводе
             version_pattern = r'(\d+\.\d+\.\d+\.\d+)'
-            matches = re.findall(version_pattern, output)
-            
-            if matches:
-                self._platform_version = matches[0]
-                # Формируем путь на основе найденной версии
-                self._platform_path = f"/opt/1cv8/x86_64/{self._platform_version}"
+            running = set(re.findall(version_pattern, running_output))
+            installed = set(re.findall(version_pattern, installed_output)) | running
+
+            now = time.time()
+            selected = {p["version"] for p in self._platforms if p["selected"]}
+            self._platforms = [
+                {
+                    "version": version,
+                    # Формируем путь на основе найденной версии
+                    "path": f"{PLATFORM_ROOT}/{version}",
+                    "running": version in running,
+                    "selected": version in selected,
+                    "detected_at": now
+                }
+                for version in sorted(installed, key=_version_key)
+            ]
+            self._platform_detected_at = now
+            if self.store and self._platforms:
+                await self.store.save_platforms(self.pool.host, self._platforms)
+
+            if self._choose_platform():
                 return self._platform_version
             return None
 
         except Exception as e:
-            print(f"Error detecting platform version: {e}")
+            logger.error("Error detecting platform version: %s", e)
             return None
 
+    async def redetect_platform(self):
+        """Сбрасывает сохранённую версию и определяет её заново"""
+        async with self._prepare_lock:
+            self._platform_version = None
+            self._platform_path = None
+            await self._detect_platform_version()
+
+    async def select_platform(self, version: str) -> bool:
+        """Явно выбирает версию платформы, если установлено несколько"""
+        if not any(p["version"] == version for p in self._platforms):
+            return False
+        for platform in self._platforms:
+            platform["selected"] = platform["version"] == version
+        if self.store:
+            await self.store.select_platform(self.pool.host, version)
+        # Выбор админа важнее версии из настроек
+        self.platform_version = None
+        return self._choose_platform()
+
+    @property
+    def platforms(self) -> List[dict]:
+        return list(self._platforms)
+
+    async def _run_platform_command(self, build: Callable[[], str]) -> asyncssh.SSHCompletedProcess:
+        """Выполняет команду rac; если сама rac не найдена - определяет платформу заново"""
+        utility = self.rac_path
+        result = await self.pool.run(build())
+        if _is_not_found(result, utility):
+            logger.warning("1C utility not found, detecting platform again")
+            await self.redetect_platform()
+            if self._platform_path:
+                result = await self.pool.run(build())
+        return result
+
+    @metrics.timed(metrics.RAC, lambda self, build: (self.pool.host,))
+    async def _run_rac(self, build: Callable[[], str]) -> asyncssh.SSHCompletedProcess:
+        return await self._run_platform_command(build)
+
     @property
     def rac_path(self) -> Optional[str]:
         if self._platform_path:
@@ -100,182 +586,1157 @@ class SSHManager:
             return f"{self._platform_path}/ibcmd"
         return None
 
-    async def get_1c_databases(self) -> List[dict]:
-        if not self._conn or not self.rac_path:
-            if not await self.connect():
-                return []
+    async def get_1c_databases(self) -> Optional[List[dict]]:
+        """Возвращает список баз из кэша, обновляя его по истечении TTL.
 
-        try:
-            # Сначала получаем список кластеров
-            result = await self._conn.run(f'{self.rac_path} cluster list')
-            if result.exit_status != 0:
-                print(f"Error getting clusters: {result.stderr}")
-                return []
+        None - сервер не ответил или rac завершился с ошибкой; [] - баз на
+        сервере нет.
+        """
+        if self._databases is not None:
+            age = time.monotonic() - self._databases_fetched_at
+            if age >= self.databases_cache_ttl:
+                # Отдаём устаревший список сразу, а обновляем его в фоне
+                self._start_databases_refresh()
+            return self._databases
 
-            # Ищем ID кластера в выводе
-            clusters = result.stdout.strip().split('\n')
-            if not clusters:
-                print("No clusters found")
-                return []
+        return await asyncio.shield(self._start_databases_refresh())
 
-            # Берем первый кластер и извлекаем его ID
-            cluster_info = clusters[0].split(':')
-            if len(cluster_info) < 2:
-                print(f"Invalid cluster info: {clusters[0]}")
-                return []
+    def _start_databases_refresh(self) -> asyncio.Task:
+        # Все одновременные запросы ждут один и тот же вызов rac
+        if self._databases_refresh is None:
+            self._databases_refresh = asyncio.ensure_future(self._refresh_databases())
+        return self._databases_refresh
+
+    async def _refresh_databases(self) -> Optional[List[dict]]:
+        try:
+            databases = await self._fetch_1c_databases()
+            # Ошибку не кэшируем, пустой список - кэшируем
+            if databases is not None:
+                self._databases = databases
+                self._databases_fetched_at = time.monotonic()
+            return databases
+        finally:
+            self._databases_refresh = None
 
-            cluster_id = cluster_info[1].strip()
+    def invalidate_databases_cache(self):
+        """Сбрасывает кэш списка баз"""
+        self._databases = None
+        self._databases_fetched_at = 0.0
+
+    async def _fetch_1c_databases(self) -> Optional[List[dict]]:
+        if not await self.connect() or not self.rac_path:
+            return None
 
-            # Получаем список информационных баз для найденного кластера
-            result = await self._conn.run(f'{self.rac_path} infobase --cluster={cluster_id} summary list')
+        try:
+            # Сначала получаем список кластеров
+            result = await self._run_rac(lambda: shlex.join([self.rac_path, "cluster", "list"]))
             if result.exit_status != 0:
-                print(f"Error getting databases: {result.stderr}")
+                logger.error("Error getting clusters: %s", result.stderr)
+                return None
+
+            # Собираем ID всех кластеров сервера
+            cluster_ids = [cluster["cluster"] for cluster in parse_clusters(result.stdout)]
+            self._cluster_ids = cluster_ids
+
+            if not cluster_ids:
+                logger.warning("No clusters found on %s", self.pool.host)
                 return []
 
-            # Парсим вывод, ищем имена баз и их описания
-            databases = []
-            current_db = {}
-            
-            for line in result.stdout.splitlines():
-                line = line.strip()
-                if not line:
-                    if current_db:
-                        databases.append(current_db)
-                        current_db = {}
-                    continue
-                
-                if ':' in line:
-                    key, value = line.split(':', 1)
-                    key = key.strip().lower()
-                    value = value.strip()
-                    
-                    if 'name' in key:
-                        current_db['name'] = value
-                    elif 'descr' in key:
-                        current_db['descr'] = value
-            
-            # Добавляем последнюю базу, если она есть
-            if current_db:
-                databases.append(current_db)
+            # Опрашиваем все кластеры параллельно
+            per_cluster = await asyncio.gather(
+                *(self._fetch_cluster_databases(cluster_id) for cluster_id in cluster_ids)
+            )
+            if any(cluster_dbs is None for cluster_dbs in per_cluster):
+                return None
+            databases = [db_info for cluster_dbs in per_cluster for db_info in cluster_dbs]
             
             # Добавляем отладочную информацию
-            print(f"Found databases: {databases}")
+            logger.debug("Found databases on %s: %s", self.pool.host, databases)
             
             return databases
 
         except Exception as e:
-            print(f"Error getting 1C databases: {e}")
-            return []
+            logger.error("Error getting 1C databases: %s", e)
+            return None
 
-    async def create_database_backup(self, db_name: str) -> Optional[str]:
-        if self.is_backup_active(db_name):
+    async def count_sessions(self) -> Optional[int]:
+        """Число сеансов пользователей во всех кластерах сервера"""
+        if not self._cluster_ids:
+            result = await self._run_rac(lambda: shlex.join([self.rac_path, "cluster", "list"]))
+            self._cluster_ids = [cluster["cluster"] for cluster in parse_clusters(result.stdout)]
+        results = await asyncio.gather(*(
+            self._run_rac(lambda cluster_id=cluster_id: shlex.join(
+                [self.rac_path, "session", "list", f"--cluster={cluster_id}"]
+            ))
+            for cluster_id in self._cluster_ids
+        ))
+        if not results or any(result.exit_status != 0 for result in results):
             return None
+        return sum(1 for result in results
+                   for block in parse_blocks(result.stdout) if "session" in block)
 
-        if not self._conn or not self.ibcmd_path:
-            if not await self.connect():
-                return None
+    async def _fetch_cluster_databases(self, cluster_id: str) -> Optional[List[dict]]:
+        # Получаем список информационных баз для кластера
+        result = await self._run_rac(
+            lambda: shlex.join([self.rac_path, "infobase", f"--cluster={cluster_id}", "summary", "list"])
+        )
+        if result.exit_status != 0:
+            logger.error("Error getting databases: %s", result.stderr)
+            return None
+
+        databases = list(parse_infobases(result.stdout))
+        for db_info in databases:
+            db_info['host'] = self.pool.host
+            db_info['cluster'] = cluster_id
+        return databases
+
+    async def _dump_with_progress(self, steps: List[Step], backup_path: str,
+                                  progress: ProgressCallback) -> Dict[str, StepResult]:
+        """Выполняет шаги выгрузки, периодически сообщая объём записанных данных.
+
+        Вывод шагов идёт потоком, поэтому последние строки, кроме процентов,
+        сохраняются как stderr шага dump - по ним видна причина ошибки.
+        """
+        meter = _ProgressMeter("dump", progress)
+        percent = None
+        data_dir = shlex.quote(self._data_dir(backup_path))
+        output: List[str] = []
+
+        def on_line(line: str):
+            nonlocal percent
+            match = _PERCENT_RE.search(line)
+            if match:
+                percent = float(match.group(1).replace(',', '.'))
+                return
+            output.append(line)
+            del output[:-50]
+
+        async def poll():
+            while True:
+                await asyncio.sleep(self.progress_interval)
+                result = await self.pool.run(
+                    f'du -cb {data_dir} {shlex.quote(backup_path)} 2>/dev/null | tail -n 1'
+                )
+                fields = result.stdout.split()
+                if fields and fields[0].isdigit():
+                    meter.update(done=int(fields[0]), percent=percent)
+
+        poller = asyncio.ensure_future(poll())
+        try:
+            results = await self.pool.run_steps(steps, on_line)
+        finally:
+            poller.cancel()
+        if "dump" in results:
+            results["dump"].stderr = "\n".join(output)
+        return results
+
+    def _data_dir(self, path: str) -> str:
+        """Временный каталог ibcmd для выгрузки в path (файл, .zst или канал).
+
+        У каждой выгрузки свой каталог: одновременные выгрузки на одном сервере
+        не должны затирать и удалять временные данные друг друга.
+        """
+        name = path.rsplit('/', 1)[-1]
+        for suffix in (".zst", ".dt", ".fifo"):
+            if name.endswith(suffix):
+                name = name[:-len(suffix)]
+        return f"{self.backup_dir}/data_{name}"
+
+    def _dump_command(self, db_name: str, target: str) -> str:
+        command = [
+            self.ibcmd_path,
+            "infobase",
+            "dump",
+            f"--dbms={self.dbms}",
+            f"--db-server={self.db_server}",
+            f"--db-user={self.db_user}",
+            f"--db-pwd={self.db_pwd}",
+            f"--user={self.user}",
+            f"--password={self.user_pwd}",
+            f"--db-name={db_name}",
+            f"--data={self._data_dir(target)}",
+            target
+        ]
+        # Пароли и имена баз могут содержать кавычки, $ и пробелы
+        return shlex.join(command)
+
+    async def create_database_backup(self, db_name: str,
+                                     progress: ProgressCallback = None,
+                                     on_stage: StageCallback = None,
+                                     stats: dict = None) -> Optional[str]:
+        # Потоковую выгрузку нельзя приостанавливать - только снижать приоритет
+        streaming = self.streaming and self._streaming_supported is not False
+        async with self.throttle.track(streaming=streaming):
+            return await self._create_database_backup(db_name, progress, on_stage, stats)
+
+    async def _create_database_backup(self, db_name: str,
+                                      progress: ProgressCallback = None,
+                                      on_stage: StageCallback = None,
+                                      stats: dict = None) -> Optional[str]:
+        """Выгружает базу и загружает её в облако.
+
+        on_stage(stage, path) вызывается и ожидается перед выгрузкой ("dumping"),
+        сжатием ("compressing") и загрузкой в облако ("uploading"), когда
+        нагрузка на сервер 1С/СУБД уже закончилась.
+        В stats записываются размеры до и после сжатия и время этапов.
+        """
+        if not await self.connect() or not self.ibcmd_path:
+            return None
+        if stats is None:
+            stats = {}
+
+        if self.streaming and self._streaming_supported is not False:
+            cloud_link = await self._stream_backup(db_name, progress, on_stage, stats)
+            if self._streaming_supported is not False:
+                # Прочие ошибки выгрузки повторный дамп через файл не исправит
+                return cloud_link
+            # ibcmd не смог писать в канал - переходим к выгрузке через файл
+            logger.info("Streaming dump is not supported, falling back to two-phase backup")
 
         try:
-            self.__class__.active_backups[db_name] = True
-            
             timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
             backup_path = f"{self.backup_dir}/{db_name}_{timestamp}.dt"
             
-            command = [
-                self.ibcmd_path,
-                "infobase",
-                "dump",
-                "--dbms=PostgreSQL",
-                f"--db-server={self.db_server}",
-                f"--db-user={self.db_user}",
-                f"--db-pwd={self.db_pwd}",
-                f"--user={self.user}",
-                f"--password={self.user_pwd}",
-                f"--db-name={db_name}",
-                f"--data={self.backup_dir}/data",
-                backup_path
-            ]
-            
-            dump_command = ' '.join(f'"{arg}"' if ' ' in arg else arg for arg in command)
-            result = await self._conn.run(dump_command)
-            
-            if result.exit_status == 0:
-                check_result = await self._conn.run(f'test -f "{backup_path}" && echo "exists"')
-                if check_result.stdout.strip() == "exists":
-                    await self._conn.run(f'rm -rf "{self.backup_dir}/data"')
+            if on_stage:
+                await on_stage("dumping", backup_path)
+            started = time.perf_counter()
+            ibcmd_path = self.ibcmd_path
+            steps = self._dump_steps(db_name, backup_path)
+            if progress:
+                results = await self._dump_with_progress(steps, backup_path, progress)
+            else:
+                results = await self.pool.run_steps(steps)
+
+            dump = results.get("dump")
+            if dump is None or _is_not_found(dump, ibcmd_path):
+                # ibcmd не найден - платформу обновили, пробуем ещё раз с новым путём
+                await self.redetect_platform()
+                if not self.ibcmd_path:
+                    return None
+                results = await self.pool.run_steps(self._dump_steps(db_name, backup_path))
+                dump = results.get("dump")
+
+            self._log_steps(db_name, results)
+            if dump is not None and not dump.ok:
+                stats["error"] = _error_tail(dump.stderr or dump.stdout)
+                logger.error("Dump of %s failed: %s", db_name, stats["error"])
+            if dump is not None and dump.ok:
+                metrics.observe(metrics.DUMP, time.perf_counter() - started,
+                                self.pool.host, db_name)
+                exists = results.get("exists")
+                if exists is not None and exists.ok:
+                    if self.compression == "zstd":
+                        if on_stage:
+                            await on_stage("compressing", backup_path)
+                        backup_path = await self._compress(backup_path, stats, progress)
+                    if on_stage:
+                        await on_stage("uploading", backup_path)
                     
                     # Передаем имя базы в метод upload_to_cloud
-                    cloud_link = await self.upload_to_cloud(backup_path, db_name)
+                    cloud_link = await self._upload_to_cloud(backup_path, db_name, progress, stats)
                     return cloud_link
 
             return None
 
         except Exception as e:
-            print(f"Error creating backup: {e}")
+            logger.error("Error creating backup: %s", e)
             try:
-                await self._conn.run(f'rm -rf "{self.backup_dir}/data"')
+                await self.pool.run(f'rm -rf {shlex.quote(self._data_dir(backup_path))}')
             except:
                 pass
             return None
-        finally:
-            self.__class__.active_backups.pop(db_name, None)
+
+    def _dump_steps(self, db_name: str, backup_path: str) -> List[Step]:
+        """Выгрузка, проверка файла и уборка временного каталога - один запрос к серверу"""
+        return [
+            Step("dump", self.throttle.wrap(self._dump_command(db_name, backup_path), "dump"),
+                 check=False),
+            Step("exists", f'test -f {shlex.quote(backup_path)}', check=False),
+            # Временный каталог ibcmd не нужен ни после успеха, ни после ошибки
+            Step("cleanup", f'rm -rf {shlex.quote(self._data_dir(backup_path))}', check=False),
+        ]
+
+    def _log_steps(self, db_name: str, results: Dict[str, StepResult]):
+        logger.info("Backup %s on %s: %s", db_name, self.pool.host, ", ".join(
+            f"{name}={result.exit_status}"
+            + (f" ({result.duration:.1f}s)" if result.duration is not None else "")
+            for name, result in results.items()
+        ))
+
+    def _zstd_args(self) -> str:
+        args = f"-T{self.zstd_threads} -{self.zstd_level}"
+        # Уровни выше 19 zstd принимает только с --ultra
+        return args + " --ultra" if self.zstd_level > 19 else args
+
+    async def _compress(self, path: str, stats: dict,
+                        progress: ProgressCallback = None) -> str:
+        """Сжимает дамп на сервере; при ошибке возвращает исходный файл"""
+        target = f"{path}.zst"
+        if progress:
+            _ProgressMeter("compress", progress).update()
+
+        # Размер до сжатия, сжатие и уборка за неудачным сжатием - один запрос
+        started = time.perf_counter()
+        results = await self.pool.run_steps([
+            Step("size", f'stat -c %s {shlex.quote(path)}', check=False),
+            Step("compress",
+                 self.throttle.wrap(f'zstd -q {self._zstd_args()} --rm -f {shlex.quote(path)}'
+                                    f' -o {shlex.quote(target)}')
+                 + f' || {{ rm -f {shlex.quote(target)}; false; }}'),
+        ])
+        size = results.get("size")
+        if size is not None and size.ok and size.stdout.strip().isdigit():
+            stats["original_size"] = int(size.stdout.strip())
+        compress = results.get("compress")
+        if compress is None or not compress.ok:
+            logger.warning("Compression failed, uploading uncompressed dump: %s",
+                           compress.stderr if compress else "")
+            return path
+        stats["codec"] = "zstd"
+        stats["compress_time"] = time.perf_counter() - started
+        return target
+
+    async def _stream_backup(self, db_name: str, progress: ProgressCallback = None,
+                             on_stage: StageCallback = None, stats: dict = None,
+                             retry: bool = True) -> Optional[str]:
+        """Выгружает базу через именованный канал прямо в rclone rcat, без .dt на диске.
+
+        Потоковый режим отключается (_streaming_supported = False), только если
+        ibcmd не смог писать именно в канал: заменил или удалил его, ничего
+        в него не записав при успешном завершении, или сообщил об ошибке записи
+        в не обычный файл. Прочие ошибки выгрузки просто возвращают None.
+        """
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        fifo_path = f"{self.backup_dir}/{db_name}_{timestamp}.fifo"
+        file_name = f"{db_name}_{timestamp}.dt"
+        compressor = ""
+        if self.compression == "zstd":
+            file_name += ".zst"
+            # -v печатает итог со степенью сжатия в stderr
+            compressor = self.throttle.wrap(f"zstd -v {self._zstd_args()} -c") + " | "
+        cloud_db_path = f"{self.rclone_remote}:{self.rclone_path}/{db_name}"
+        cloud_file_path = f"{cloud_db_path}/{file_name}"
+
+        fifo = shlex.quote(fifo_path)
+        hash_fifo = shlex.quote(f"{fifo_path}.sha256")
+        size_fifo = shlex.quote(f"{fifo_path}.size")
+        data_dir = shlex.quote(self._data_dir(fifo_path))
+        rcat = f"rclone rcat {shlex.quote(cloud_file_path)}{self._rclone_limit_args()}"
+        if progress:
+            rcat += self._rclone_stats_args()
+        rcat = self.throttle.wrap(rcat)
+        tee = self.throttle.wrap(f"tee {hash_fifo} {size_fifo}")
+        sha256sum = self.throttle.wrap("sha256sum")
+        # Скрипт сам держит канал открытым на запись (fd 3): читатель открывает его
+        # сразу и получает EOF только после закрытия fd 3 по окончании ibcmd - даже
+        # если ibcmd упал, не открыв канал, или подменил его обычным файлом.
+        # Фоновым процессам fd 3 не достаётся, иначе EOF не наступит.
+        # tee отдаёт загружаемый поток ещё sha256sum и wc: хеш и размер
+        # считаются в том же проходе, что и загрузка
+        script = (
+            "set -o pipefail; "
+            f"rclone mkdir {shlex.quote(cloud_db_path)} || exit 96; "
+            f"mkfifo {fifo} {hash_fifo} {size_fifo} || exit 97; "
+            f"exec 3<> {fifo}; "
+            f"( {sha256sum} < {hash_fifo} | sed 's/^/SHA256 /' ) 3>&- & "
+            f"( wc -c < {size_fifo} | sed 's/^/SIZE /' ) 3>&- & "
+            f"( ( {compressor}{tee} | {rcat} ) < {fifo}; "
+            "echo \"UPLOAD_RC=$?\" ) 3>&- & "
+            f"{self.throttle.wrap(self._dump_command(db_name, fifo_path), 'dump')} 3>&-; dump_rc=$?; "
+            f"[ -p {fifo} ] || echo FIFO_LOST; "
+            "exec 3>&-; "
+            "wait; "
+            f"rm -rf {fifo} {hash_fifo} {size_fifo} {data_dir}; "
+            "echo \"DUMP_RC=$dump_rc\""
+        )
+
+        codes = {}
+        digest = {}
+        # Прочие строки вывода - по ним распознаются ошибки записи в канал
+        output: List[str] = []
+
+        if stats is None:
+            stats = {}
+
+        def on_line(line: str):
+            for key in ("UPLOAD_RC", "DUMP_RC"):
+                if line.startswith(f"{key}="):
+                    codes[key] = int(line.split("=", 1)[1])
+                    return
+            if line.startswith(("SHA256 ", "SIZE ")):
+                key, value = line.split()[:2]
+                digest[key] = value
+                return
+            if line == "FIFO_LOST":
+                codes["FIFO_LOST"] = 1
+                return
+            if compressor:
+                match = _ZSTD_SUMMARY_RE.search(line)
+                if match:
+                    stats["codec"] = "zstd"
+                    stats["original_size"] = _parse_size(match.group(1), match.group(2) or "B")
+                    stats["size"] = _parse_size(match.group(3), match.group(4))
+                    return
+            if meter:
+                match = _RCLONE_STREAM_RE.search(line)
+                if match:
+                    done = _parse_size(match.group(1), match.group(2))
+                    if not compressor:
+                        stats["size"] = done
+                    meter.update(done=done, speed=_parse_size(match.group(3), match.group(4)))
+                    return
+            output.append(line)
+            del output[:-50]
+
+        meter = _ProgressMeter("stream", progress) if progress else None
+        try:
+            if on_stage:
+                await on_stage("dumping", fifo_path)
+            started = time.perf_counter()
+            # Список старых копий нужен только после загрузки - берём его, пока идёт выгрузка
+            _, existing = await asyncio.gather(
+                self.pool.run_streaming(f"bash -c {shlex.quote(script)}", on_line),
+                self._list_cloud_backups(cloud_db_path)
+            )
+
+            # Сколько байт ibcmd записал в канал (до сжатия)
+            if compressor:
+                read = stats.get("original_size")
+            else:
+                read = int(digest["SIZE"]) if digest.get("SIZE", "").isdigit() else None
+            dump_rc = codes.get("DUMP_RC")
+            fifo_failed = bool(
+                codes.get("FIFO_LOST")
+                or (dump_rc == 0 and read == 0)
+                or (dump_rc and _FIFO_ERROR_RE.search("\n".join(output)))
+            )
+
+            if dump_rc == 0 and codes.get("UPLOAD_RC") == 0 and not fifo_failed:
+                # Выгрузка и загрузка идут одновременно - время считаем временем выгрузки
+                elapsed = time.perf_counter() - started
+                metrics.observe(metrics.DUMP, elapsed, self.pool.host, db_name)
+                self._streaming_supported = True
+                stats["upload_time"] = elapsed
+                # Точный размер загруженного потока вместо оценки по статистике rclone
+                if digest.get("SIZE", "").isdigit():
+                    stats["size"] = int(digest["SIZE"])
+                stats["sha256"] = digest.get("SHA256")
+                if not await self._verify_upload(cloud_file_path, stats):
+                    await self.pool.run(f'rclone deletefile {shlex.quote(cloud_file_path)}')
+                    return None
+                return await self._finish_upload(cloud_db_path, cloud_file_path,
+                                                 db_name, stats, existing)
+
+            logger.error("Streaming backup failed: %s", codes)
+            # Убираем из облака неполный файл
+            await self.pool.run(f'rclone deletefile {shlex.quote(cloud_file_path)}')
+            if dump_rc == 127:
+                # Не найден сам ibcmd - дело в пути, а не в потоковом режиме
+                await self.redetect_platform()
+                if retry and self.ibcmd_path:
+                    return await self._stream_backup(db_name, progress, on_stage, stats,
+                                                     retry=False)
+            elif fifo_failed:
+                logger.warning("ibcmd cannot write into a named pipe: %s", output[-5:])
+                self._streaming_supported = False
+            else:
+                stats["error"] = _error_tail("\n".join(output))
+            return None
+
+        except Exception as e:
+            logger.error("Error streaming backup: %s", e)
+            try:
+                await self.pool.run(f'rm -rf {data_dir} {fifo} {hash_fifo} {size_fifo}')
+            except:
+                pass
+            return None
+
+    async def backup_file_exists(self, path: str) -> bool:
+        if not await self.connect():
+            return False
+        result = await self.pool.run(f'test -f {shlex.quote(path)} && echo "exists"')
+        return result.stdout.strip() == "exists"
+
+    async def remove_partial_backup(self, path: str, db_name: str = None) -> None:
+        """Удаляет недовыгруженный файл (или канал), его каналы хеша и размера
+        и временный каталог ibcmd этой выгрузки - каталоги других не трогает.
+
+        С db_name удаляется и недозагруженная копия этого файла в облаке
+        (прерванный rclone rcat) - если у неё нет манифеста, то есть загрузка
+        не была подтверждена.
+        """
+        if not await self.connect():
+            return
+        paths = [path, f"{path}.sha256", f"{path}.size", self._data_dir(path)]
+        # Каналы хеша частей: <файл>.<номер части>.sha256
+        steps = [Step("remove", f'rm -rf {" ".join(shlex.quote(p) for p in paths)} '
+                                f'{shlex.quote(path)}.[0-9]*.sha256', check=False)]
+        if db_name:
+            cloud_db_path = f"{self.rclone_remote}:{self.rclone_path}/{db_name}"
+            for name in _cloud_names(path):
+                cloud_file = f"{cloud_db_path}/{name}"
+                steps.append(Step(
+                    f"delete {name}",
+                    f'rclone lsjson {shlex.quote(cloud_file + MANIFEST_SUFFIX)} >/dev/null 2>&1'
+                    f' || rclone deletefile {shlex.quote(cloud_file)} 2>/dev/null',
+                    check=False
+                ))
+        await self.pool.run_steps(steps)
+
+    async def find_uploaded_backup(self, file_path: str, db_name: str) -> Optional[str]:
+        """Ссылка на копию файла в облаке, если её загрузка успела завершиться.
+
+        file_path - файл выгрузки или канал потоковой выгрузки. Копия считается
+        завершённой, если рядом с ней есть манифест: он пишется после сверки
+        копии и до удаления локального файла. Размер и SHA-256 из манифеста
+        записываются в базу бота, как после обычной загрузки.
+        """
+        if not await self.connect():
+            return None
+        cloud_db_path = f"{self.rclone_remote}:{self.rclone_path}/{db_name}"
+        names = _cloud_names(file_path)
+        names += [name + PARTS_SUFFIX for name in names]
+        for item in await self._list_cloud_backups(cloud_db_path):
+            if item["Name"] not in names or item.get("Partial"):
+                continue
+            cloud_file_path = f"{cloud_db_path}/{item['Name']}"
+            results = await self.pool.run_steps([
+                Step("manifest", f'rclone cat {shlex.quote(cloud_file_path + MANIFEST_SUFFIX)}'),
+                Step("link", f'rclone link {shlex.quote(cloud_file_path)}'),
+            ])
+            link = results.get("link")
+            if link is None or not link.ok:
+                return None
+            try:
+                stats = json.loads(results["manifest"].stdout)
+            except ValueError:
+                return None
+            # Каталог частей сверен по частям ещё при загрузке
+            if not item.get("IsDir") and item.get("Size") != stats.get("size"):
+                logger.warning("Cloud copy %s does not match its manifest", cloud_file_path)
+                return None
+            await self._remember_backup(db_name, item["Name"], stats)
+            return _share_link(link.stdout)
+        return None
 
     async def get_1c_server_version(self) -> Optional[str]:
         if not self._platform_version:
             await self._detect_platform_version()
         return self._platform_version
 
-    async def close(self):
-        if self._conn:
-            self._conn.close()
-            await self._conn.wait_closed()
+    def _rclone_stats_args(self) -> str:
+        # Статистика rclone одной строкой раз в progress_interval секунд
+        return (f' --stats {self.progress_interval}s --stats-one-line'
+                f' --stats-log-level NOTICE')
+
+    def _rclone_limit_args(self) -> str:
+        return f" --bwlimit {shlex.quote(self.bwlimit)}" if self.bwlimit else ""
+
+    async def _list_cloud_backups(self, cloud_db_path: str) -> List[dict]:
+        """Возвращает копии базы в облаке от старых к новым"""
+        result = await self.pool.run(f'rclone lsjson {shlex.quote(cloud_db_path)}')
+        if result.exit_status != 0:
+            return []
+        return _parse_cloud_listing(result.stdout)
 
-    async def upload_to_cloud(self, file_path: str, db_name: str) -> Optional[str]:
+    async def _delete_cloud_files(self, cloud_db_path: str, db_name: str, files: List[dict]):
+        if files:
+            await self.pool.run_steps(self._delete_steps(cloud_db_path, files))
+            await self._forget_backups(db_name, files)
+
+    async def _forget_backups(self, db_name: str, files: List[dict]):
+        if not self.store or not files:
+            return
+        try:
+            await self.store.delete_backup_files(
+                self.pool.host, db_name, [item["Name"] for item in files]
+            )
+        except Exception as e:
+            logger.error("Error forgetting deleted backups of %s: %s", db_name, e)
+
+    @staticmethod
+    def _delete_steps(cloud_db_path: str, files: List[dict]) -> List[Step]:
+        # Вместе с копией удаляется и её манифест; копия частями - каталог целиком
+        return [
+            Step(f"delete {name}",
+                 f'{command} {shlex.quote(cloud_db_path + "/" + name)}', check=False)
+            for item in files
+            for name, command in (
+                (item["Name"], "rclone purge" if item.get("IsDir") else "rclone deletefile"),
+                (item["Name"] + MANIFEST_SUFFIX, "rclone deletefile"),
+            )
+        ]
+
+    async def _same_as_cloud(self, file_path: str, size: Optional[int],
+                             cloud_file: dict, cloud_db_path: str, stats: dict) -> bool:
+        """Сравнивает локальный дамп с копией в облаке: размер, затем SHA-256.
+
+        Если облако не хранит SHA-256, сравнивается MD5. SHA-256 файла и
+        способ сравнения записываются в stats, как при обычной загрузке.
+        """
+        if size != cloud_file["Size"]:
+            return False
+
+        cloud_path = shlex.quote(cloud_db_path + "/" + cloud_file["Name"])
+        for algorithm in ("sha256", "md5"):
+            # Хеши считаются параллельно: локальный читает диск, облачный ждёт API
+            local_hash, cloud_hash = await asyncio.gather(
+                self.pool.run(self.throttle.wrap(
+                    f'rclone hashsum {algorithm} {shlex.quote(file_path)}')),
+                self.pool.run(f'rclone hashsum {algorithm} {cloud_path}')
+            )
+            local = local_hash.stdout.split()[:1] if local_hash.exit_status == 0 else []
+            cloud = cloud_hash.stdout.split()[:1] if cloud_hash.exit_status == 0 else []
+            if algorithm == "sha256" and local:
+                stats["sha256"] = local[0].lower()
+            if local and cloud:
+                if local[0].lower() != cloud[0].lower():
+                    return False
+                stats["verified"] = algorithm
+                return True
+        return False
+
+    async def upload_to_cloud(self, file_path: str, db_name: str,
+                              progress: ProgressCallback = None,
+                              stats: dict = None) -> Optional[str]:
         """Загружает файл в облако и возвращает ссылку для скачивания"""
+        async with self.throttle.track():
+            return await self._upload_to_cloud(file_path, db_name, progress, stats)
+
+    async def _upload_to_cloud(self, file_path: str, db_name: str,
+                               progress: ProgressCallback = None,
+                               stats: dict = None) -> Optional[str]:
+        if stats is None:
+            stats = {}
+        if file_path.endswith(".zst"):
+            stats.setdefault("codec", "zstd")
         try:
             # Формируем путь в облаке: remote:path/database_name/
             cloud_db_path = f"{self.rclone_remote}:{self.rclone_path}/{db_name}"
-            
-            # Очищаем папку базы в облаке
-            clear_command = f'rclone purge "{cloud_db_path}"'
-            await self._conn.run(clear_command)
-            
-            # Создаем папку заново
-            mkdir_command = f'rclone mkdir "{cloud_db_path}"'
-            await self._conn.run(mkdir_command)
+            # Каталог, список копий и размер файла - одним запросом
+            results = await self.pool.run_steps([
+                Step("mkdir", f'rclone mkdir {shlex.quote(cloud_db_path)}'),
+                Step("list", f'rclone lsjson {shlex.quote(cloud_db_path)}', check=False),
+                Step("size", f'stat -c %s {shlex.quote(file_path)}', check=False),
+            ])
+            if "list" not in results:
+                logger.error("Error creating cloud folder %s: %s", cloud_db_path, results["mkdir"].stderr)
+                return None
+            existing = (_parse_cloud_listing(results["list"].stdout)
+                        if results["list"].ok else [])
+            size = results["size"].stdout.strip()
+            size = int(size) if results["size"].ok and size.isdigit() else None
+
+            # Такой же дамп уже есть в облаке - повторно не загружаем, но учитываем
+            # его так же, как загруженный: манифест, запись в базе бота, хранение копий
+            if existing and self.skip_identical:
+                latest = existing[-1]
+                if await self._same_as_cloud(file_path, size, latest, cloud_db_path, stats):
+                    stats["size"] = size
+                    stats["reused"] = True
+                    return await self._finish_upload(
+                        cloud_db_path, f"{cloud_db_path}/{latest['Name']}", db_name,
+                        stats, existing, file_path
+                    )
             
             # Получаем имя файла из полного пути
             file_name = file_path.split('/')[-1]
-            cloud_file_path = f"{cloud_db_path}/{file_name}"
-            
-            # Загружаем файл в облако
-            copy_command = f'rclone copy "{file_path}" "{cloud_db_path}"'
-            result = await self._conn.run(copy_command)
+            parted = self._upload_in_parts(size)
+            cloud_name = file_name + PARTS_SUFFIX if parted else file_name
+            cloud_file_path = f"{cloud_db_path}/{cloud_name}"
+            # Каталог частей этого же файла - не старая копия, а прерванная загрузка
+            existing = [item for item in existing if item["Name"] != cloud_name]
             
-            if result.exit_status == 0:
-                # Публикуем файл и получаем ссылку
-                publish_command = f'rclone link "{cloud_file_path}"'
-                publish_result = await self._conn.run(publish_command)
-                
-                if publish_result.exit_status == 0:
-                    # Удаляем локальный файл
-                    await self._conn.run(f'rm -f "{file_path}"')
-                    
-                    # Получаем ссылку и преобразуем её в формат для скачивания
-                    share_link = publish_result.stdout.strip()
-                    
-                    # Преобразуем ссылку для Yandex.Disk
-                    if 'disk.yandex.ru/d/' in share_link:
-                        # Извлекаем хеш из ссылки
-                        hash_part = share_link.split('/')[-1]
-                        # Формируем прямую ссылку на скачивание
-                        download_link = f"https://disk.yandex.ru/d/{hash_part}"
-                        return download_link
-                    
-                    return share_link
+            # Копии сверх лимита не нужны даже при неудачной загрузке -
+            # удаляем их параллельно с загрузкой
+            complete = [item for item in existing if not item.get("Partial")]
+            stale = complete[:max(len(complete) - self.keep_last, 0)]
+            remaining = [item for item in existing if item not in stale]
+            stats["size"] = size
+            started = time.perf_counter()
+            if parted:
+                uploaded, _ = await asyncio.gather(
+                    self._upload_parts(file_path, cloud_file_path, size, progress, stats),
+                    self._delete_cloud_files(cloud_db_path, db_name, stale)
+                )
+            else:
+                (result, sha256), _ = await asyncio.gather(
+                    self._copy_to_cloud(file_path, cloud_file_path, size, progress),
+                    self._delete_cloud_files(cloud_db_path, db_name, stale)
+                )
+                uploaded = result.exit_status == 0
+                stats["sha256"] = sha256
+                stats["uploaded"] = size
             
+            if not uploaded:
+                # Подтверждённые части остаются в облаке: следующая загрузка продолжит с них
+                return None
+            stats["upload_time"] = time.perf_counter() - started
+            # Файл целиком идёт одним потоком rclone rcat
+            stats["streams"] = self.upload_streams if parted else 1
+            self._observe_upload(db_name, stats)
+            logger.info("Uploaded %s: %s bytes in %.1f s (%.0f B/s, %s streams%s)",
+                        cloud_name, stats.get("uploaded"), stats["upload_time"],
+                        stats.get("upload_speed") or 0, stats["streams"],
+                        f", {len(stats['parts'])} parts" if parted else "")
+            # Локальный файл остаётся, пока копия в облаке не совпала с ним
+            # (части сверяются по одной сразу после загрузки)
+            if not parted and not await self._verify_upload(cloud_file_path, stats):
+                await self.pool.run(f'rclone deletefile {shlex.quote(cloud_file_path)}')
+                logger.warning("Local file kept for inspection: %s", file_path)
+                return None
+            return await self._finish_upload(cloud_db_path, cloud_file_path, db_name,
+                                             stats, remaining, file_path)
+
+        except Exception as e:
+            logger.error("Error uploading to cloud: %s", e)
             return None
 
+    async def _finish_upload(self, cloud_db_path: str, cloud_file_path: str, db_name: str,
+                             stats: dict, existing: List[dict],
+                             local_path: str = None) -> Optional[str]:
+        """Публикует загруженную копию и прибирает за ней одним запросом.
+
+        Манифест, удаление локального файла и лишних старых копий выполняются,
+        только если ссылка получена - то есть копия в облаке подтверждена.
+        Локальный файл и старые копии удаляются, только если записан манифест:
+        без него копию не найти после перезапуска (find_uploaded_backup).
+        existing - копии в облаке до загрузки, от старых к новым.
+        """
+        steps = [
+            Step("link", f'rclone link {shlex.quote(cloud_file_path)}'),
+            Step("manifest", f'rclone rcat {shlex.quote(cloud_file_path + MANIFEST_SUFFIX)}',
+                 input=self._manifest(cloud_file_path, db_name, stats)),
+        ]
+        if local_path:
+            steps.append(Step("remove", f'rm -f {shlex.quote(local_path)}', check=False))
+        # Вместе с новой копией в облаке остаётся keep_last последних;
+        # сама новая копия могла попасть в список, если он снят во время загрузки.
+        # Брошенные недозагруженные каталоги частей удаляются всегда
+        file_name = cloud_file_path.rsplit('/', 1)[-1]
+        existing = [item for item in existing if item["Name"] != file_name]
+        complete = [item for item in existing if not item.get("Partial")]
+        old = ([item for item in existing if item.get("Partial")]
+               + complete[:max(len(complete) + 1 - self.keep_last, 0)])
+        steps.extend(self._delete_steps(cloud_db_path, old))
+
+        results = await self.pool.run_steps(steps)
+        self._log_steps(db_name, results)
+        link = results.get("link")
+        if link is None or not link.ok:
+            return None
+        manifest = results.get("manifest")
+        if manifest is None or not manifest.ok:
+            logger.error("Error writing manifest for %s: %s", cloud_file_path,
+                         manifest.stderr if manifest else "not run")
+            if local_path:
+                logger.warning("Local file kept for inspection: %s", local_path)
+            return None
+        await self._remember_backup(db_name, file_name, stats)
+        await self._forget_backups(db_name, old)
+        return _share_link(link.stdout)
+
+    async def _verify_upload(self, cloud_file_path: str, stats: dict) -> bool:
+        """Сверяет копию в облаке с загруженными данными: SHA-256 и размер.
+
+        Если облако не хранит SHA-256, сверяется только размер.
+        Способ проверки записывается в stats["verified"].
+        """
+        results = await self.pool.run_steps([
+            Step("hash", f'rclone hashsum sha256 {shlex.quote(cloud_file_path)}', check=False),
+            Step("stat", f'rclone lsjson {shlex.quote(cloud_file_path)}', check=False),
+        ])
+        size, sha256 = stats.get("size"), stats.get("sha256")
+        listing = json.loads(results["stat"].stdout or "[]") if results["stat"].ok else []
+        cloud_size = listing[0].get("Size") if listing else None
+        cloud_hash = results["hash"].stdout.split()[:1] if results["hash"].ok else []
+
+        if cloud_size is None or (size is not None and cloud_size != size):
+            logger.error("Upload verification failed for %s: size %s in cloud, %s uploaded",
+                         cloud_file_path, cloud_size, size)
+            return False
+        if cloud_hash and sha256:
+            if cloud_hash[0].lower() != sha256.lower():
+                logger.error("Upload verification failed for %s: SHA-256 %s in cloud, %s uploaded",
+                             cloud_file_path, cloud_hash[0], sha256)
+                return False
+            stats["verified"] = "sha256"
+        elif size is not None:
+            stats["verified"] = "size"
+        else:
+            return False
+        if stats.get("size") is None:
+            stats["size"] = cloud_size
+        return True
+
+    async def _remember_backup(self, db_name: str, file_name: str, stats: dict):
+        if not self.store:
+            return
+        sha256 = stats.get("sha256")
+        if stats.get("parts"):
+            # У копии частями - SHA-256 частей по порядку через запятую
+            sha256 = ",".join(part["sha256"] or "" for part in stats["parts"])
+        try:
+            await self.store.save_backup_file(
+                self.pool.host, db_name, file_name,
+                stats.get("size"), sha256, stats.get("verified")
+            )
         except Exception as e:
-            print(f"Error uploading to cloud: {e}")
-            return None
\ No newline at end of file
+            logger.error("Error saving backup %s: %s", file_name, e)
+
+    def _observe_upload(self, db_name: str, stats: dict):
+        elapsed = stats["upload_time"]
+        metrics.observe(metrics.UPLOAD, elapsed, self.pool.host, db_name)
+        # Скорость - по переданным сейчас байтам: части, загруженные до сбоя, не в счёт
+        uploaded = stats.get("uploaded", stats.get("size"))
+        if uploaded and elapsed > 0:
+            stats["upload_speed"] = uploaded / elapsed
+            metrics.observe(metrics.UPLOAD_SPEED, stats["upload_speed"],
+                            self.pool.host, db_name)
+
+    def _manifest(self, cloud_file_path: str, db_name: str, stats: dict) -> str:
+        """Описание копии, нужное для восстановления; кладётся рядом с ней"""
+        file_name = cloud_file_path.rsplit('/', 1)[-1]
+        codec = stats.get("codec")
+        parts = stats.get("parts")
+        restore = []
+        sha256sums = None
+        if parts:
+            # SHA-256 всего файла не считается: части читаются параллельно и не по
+            # порядку. Вместо него - SHA-256 частей по порядку в формате sha256sum -c,
+            # восстановление проверяет их перед склейкой (в порядке имён)
+            file_name = file_name[:-len(PARTS_SUFFIX)]
+            sha256sums = "".join(f"{part['sha256']}  {file_name}{PARTS_SUFFIX}/{part['name']}\n"
+                                 for part in parts)
+            restore.append(f"jq -r .sha256sums {file_name}{PARTS_SUFFIX}{MANIFEST_SUFFIX}"
+                           " | sha256sum -c --quiet -")
+            restore.append(f"cat {file_name}{PARTS_SUFFIX}/* > {file_name}")
+        if codec == "zstd":
+            restore.append(f"zstd -d {file_name} -o {file_name[:-len('.zst')]}")
+        manifest = {
+            "database": db_name,
+            "host": self.pool.host,
+            "file": file_name,
+            "created_at": datetime.now().isoformat(timespec="seconds"),
+            "codec": codec,
+            "zstd_level": self.zstd_level if codec == "zstd" else None,
+            "original_size": stats.get("original_size") or stats.get("size"),
+            "size": stats.get("size"),
+            "sha256": stats.get("sha256"),
+            "verified": stats.get("verified"),
+            # Дамп совпал с этой копией, и она учтена как результат новой выгрузки
+            "reused": bool(stats.get("reused")),
+            "parts": parts,
+            "sha256sums": sha256sums,
+            "restore": " && ".join(restore) or None
+        }
+        return json.dumps(manifest, ensure_ascii=False, indent=2)
+
+    async def _copy_to_cloud(self, file_path: str, cloud_file_path: str, size: Optional[int],
+                             progress: ProgressCallback = None
+                             ) -> Tuple[asyncssh.SSHCompletedProcess, Optional[str]]:
+        """Загружает файл в облако; возвращает результат rclone и SHA-256 файла.
+
+        Файл читается один раз: tee отдаёт поток rclone rcat и через канал
+        <файл>.sha256 - sha256sum, как при потоковой выгрузке. Поток не
+        перечитать, поэтому повторы после ошибки - заново всей командой.
+        """
+        fifo = shlex.quote(f"{file_path}.sha256")
+        # С известным размером rclone загружает поток сразу, без временного файла
+        rcat = f"rclone rcat {shlex.quote(cloud_file_path)}{self._rclone_limit_args()}"
+        if size is not None:
+            rcat += f" --size {size}"
+        if progress:
+            rcat += self._rclone_stats_args()
+        # Канал держится открытым на запись (fd 3), чтобы sha256sum не ждал его
+        # вечно, если tee не смог открыть файл
+        command = (
+            "set -o pipefail; "
+            f"[ -r {shlex.quote(file_path)} ] || exit 1; "
+            f"rm -f {fifo}; mkfifo {fifo} || exit 1; exec 3<> {fifo}; "
+            f"( {self.throttle.wrap('sha256sum')} | sed 's/^/SHA256 /' ) < {fifo} 3>&- & "
+            f"{self.throttle.wrap(f'tee {fifo}')} < {shlex.quote(file_path)} 3>&- "
+            f"| {self.throttle.wrap(rcat)} 3>&-; rc=$?; "
+            f"exec 3>&-; wait; rm -f {fifo}; exit $rc"
+        )
+        command = f"bash -c {shlex.quote(command)}"
+
+        for attempt in range(self.upload_retries + 1):
+            if attempt:
+                await asyncio.sleep(min(2 ** attempt, 60))
+            sha256 = None
+
+            def take_hash(line: str) -> bool:
+                nonlocal sha256
+                if line.startswith("SHA256 "):
+                    sha256 = line.split()[1]
+                    return True
+                return False
+
+            if progress:
+                meter = _ProgressMeter("upload", progress)
+
+                def on_line(line: str):
+                    if take_hash(line):
+                        return
+                    match = _RCLONE_STATS_RE.search(line)
+                    if match:
+                        meter.update(
+                            done=_parse_size(match.group(1), match.group(2)),
+                            total=_parse_size(match.group(3), match.group(4)),
+                            percent=float(match.group(5)),
+                            speed=_parse_size(match.group(6), match.group(7)),
+                            eta=_parse_duration(match.group(8))
+                        )
+
+                result = await self.pool.run_streaming(command, on_line)
+            else:
+                result = await self.pool.run(command)
+                for line in (result.stdout or "").splitlines():
+                    take_hash(line)
+            if result.exit_status == 0:
+                break
+            logger.warning("Upload of %s failed (attempt %d of %d): exit status %s",
+                           cloud_file_path, attempt + 1, self.upload_retries + 1,
+                           result.exit_status)
+        else:
+            # Оборванный rcat мог оставить в облаке недозагруженный файл
+            await self.pool.run(f'rclone deletefile {shlex.quote(cloud_file_path)} 2>/dev/null')
+        return result, sha256
+
+    def _upload_in_parts(self, size: Optional[int]) -> bool:
+        return bool(self.upload_chunk_size) and size is not None and size > self.upload_chunk_size
+
+    def _part_reader(self, file_path: str, part: dict) -> str:
+        """Команда, выводящая часть файла (без временных копий на диске)"""
+        return self.throttle.wrap(
+            f"dd if={shlex.quote(file_path)} bs=4M skip={part['offset']} count={part['size']}"
+            " iflag=skip_bytes,count_bytes status=none"
+        )
+
+    async def _upload_parts(self, file_path: str, cloud_parts_path: str, size: int,
+                            progress: ProgressCallback, stats: dict) -> bool:
+        """Загружает файл частями по upload_chunk_size в upload_streams потоков.
+
+        Каждая часть сверяется с облаком сразу после загрузки и при ошибке
+        загружается заново, до upload_retries раз. Части, уже подтверждённые
+        облаком (загрузка прервалась сбоем или перезапуском бота), повторно
+        не загружаются. Сведения о частях записываются в stats["parts"].
+        """
+        chunk = self.upload_chunk_size
+        parts = [
+            {"name": f"{index:05d}", "offset": offset, "size": min(chunk, size - offset)}
+            for index, offset in enumerate(range(0, size, chunk))
+        ]
+        confirmed = await self._confirmed_parts(file_path, cloud_parts_path, parts)
+        if confirmed is None:
+            return False
+
+        pending = [part for part in parts if part["name"] not in confirmed]
+        streams = asyncio.Semaphore(self.upload_streams)
+        meter = _ProgressMeter("upload", progress) if progress else None
+        done = sum(part["size"] for part in parts if part["name"] in confirmed)
+        # Сколько передано по частям, которые загружаются сейчас
+        in_flight: Dict[str, int] = {}
+
+        def on_part_progress(name: str, part_done: int):
+            in_flight[name] = part_done
+            meter.update(done=done + sum(in_flight.values()), total=size)
+
+        async def upload(part: dict) -> Optional[dict]:
+            nonlocal done
+            async with streams:
+                result = await self._upload_part(file_path, cloud_parts_path, part,
+                                                 on_part_progress if meter else None)
+            in_flight.pop(part["name"], None)
+            if result:
+                done += part["size"]
+                if meter:
+                    meter.update(done=done + sum(in_flight.values()), total=size)
+            return result
+
+        results = await asyncio.gather(*(upload(part) for part in pending))
+        confirmed.update((part["name"], result) for part, result in zip(pending, results) if result)
+        stats["parts"] = [
+            {"name": part["name"], "size": part["size"],
+             "sha256": confirmed.get(part["name"], {}).get("sha256")}
+            for part in parts
+        ]
+        stats["resumed_parts"] = len(parts) - len(pending)
+        stats["uploaded"] = sum(part["size"] for part, result in zip(pending, results) if result)
+        if not all(results):
+            logger.error("Upload of %s incomplete: %d of %d parts failed",
+                         cloud_parts_path, results.count(None), len(parts))
+            return False
+        stats["verified"] = ("sha256" if all(item["verified"] == "sha256"
+                                             for item in confirmed.values()) else "size")
+        return True
+
+    async def _confirmed_parts(self, file_path: str, cloud_parts_path: str,
+                               parts: List[dict]) -> Optional[Dict[str, dict]]:
+        """Части, которые уже есть в облаке и совпадают с файлом: имя -> sha256, verified.
+
+        Лишние файлы каталога (например, от загрузки с другим размером части)
+        удаляются. None - каталог в облаке недоступен.
+        """
+        path = shlex.quote(cloud_parts_path)
+        results = await self.pool.run_steps([
+            Step("mkdir", f'rclone mkdir {path}'),
+            Step("list", f'rclone lsjson --files-only {path}', check=False),
+            Step("hash", f'rclone hashsum sha256 {path}', check=False),
+        ])
+        if "list" not in results:
+            logger.error("Error creating cloud folder %s: %s", cloud_parts_path, results["mkdir"].stderr)
+            return None
+        listing = json.loads(results["list"].stdout or "[]") if results["list"].ok else []
+        sizes = {item["Name"]: item["Size"] for item in listing}
+        hashes = {}
+        for line in results["hash"].stdout.splitlines() if results["hash"].ok else []:
+            fields = line.split(None, 1)
+            if len(fields) == 2:
+                hashes[fields[1].strip()] = fields[0].lower()
+
+        present = [part for part in parts if sizes.get(part["name"]) == part["size"]]
+        names = {part["name"] for part in parts}
+        steps = [
+            Step(f"delete {name}",
+                 f'rclone deletefile {shlex.quote(cloud_parts_path + "/" + name)}', check=False)
+            for name in sizes if name not in names
+        ]
+        # SHA-256 частей нужен манифесту, даже если облако хеши не хранит;
+        # при их наличии он сверяется с облаком
+        steps.extend(
+            Step(part["name"], f"{self._part_reader(file_path, part)} | sha256sum", check=False)
+            for part in present
+        )
+        if steps:
+            results = await self.pool.run_steps(steps)
+        confirmed = {}
+        for part in present:
+            result = results.get(part["name"])
+            local_hash = result.stdout.split()[:1] if result and result.ok else []
+            if not local_hash:
+                continue
+            if not hashes:
+                # Облако не хранит SHA-256 - доверяем размеру
+                confirmed[part["name"]] = {"sha256": local_hash[0], "verified": "size"}
+            elif local_hash[0] == hashes.get(part["name"]):
+                confirmed[part["name"]] = {"sha256": local_hash[0], "verified": "sha256"}
+        if present:
+            logger.info("Resuming upload of %s: %d of %d parts already in cloud",
+                        cloud_parts_path, len(confirmed), len(parts))
+        return confirmed
+
+    async def _upload_part(self, file_path: str, cloud_parts_path: str, part: dict,
+                           on_progress: Callable[[str, int], None] = None) -> Optional[dict]:
+        """Загружает одну часть с повторами; возвращает её sha256 и способ проверки"""
+        part_path = f"{cloud_parts_path}/{part['name']}"
+        # С известным размером rclone загружает поток сразу, без временного файла
+        rcat = (f"rclone rcat {shlex.quote(part_path)} --size {part['size']}"
+                f"{self._rclone_limit_args()}")
+        if on_progress:
+            rcat += self._rclone_stats_args()
+        fifo = shlex.quote(f"{file_path}.{part['name']}.sha256")
+        # Часть читается один раз: tee отдаёт её rclone и через канал - sha256sum,
+        # как при загрузке файла целиком (_copy_to_cloud)
+        command = (
+            "set -o pipefail; "
+            f"rm -f {fifo}; mkfifo {fifo} || exit 1; exec 3<> {fifo}; "
+            f"( {self.throttle.wrap('sha256sum')} | sed 's/^/SHA256 /' ) < {fifo} 3>&- & "
+            f"{self._part_reader(file_path, part)} 3>&- | {self.throttle.wrap(f'tee {fifo}')} 3>&- "
+            f"| {self.throttle.wrap(rcat)} 3>&-; rc=$?; "
+            f"exec 3>&-; wait; rm -f {fifo}; exit $rc"
+        )
+
+        for attempt in range(self.upload_retries + 1):
+            if attempt:
+                await asyncio.sleep(min(2 ** attempt, 60))
+            part_stats = {"size": part["size"], "sha256": None}
+
+            def on_line(line: str):
+                if line.startswith("SHA256 "):
+                    part_stats["sha256"] = line.split()[1]
+                    return
+                match = _RCLONE_STREAM_RE.search(line) if on_progress else None
+                if match:
+                    on_progress(part["name"], _parse_size(match.group(1), match.group(2)))
+
+            try:
+                result = await self.pool.run_streaming(f"bash -c {shlex.quote(command)}", on_line)
+                if result.exit_status == 0 and await self._verify_upload(part_path, part_stats):
+                    return part_stats
+                error = f"exit status {result.exit_status}"
+            except Exception as e:
+                # Обрыв SSH: пул переподключится при следующей попытке
+                error = str(e)
+            logger.warning("Upload of %s failed (attempt %d of %d): %s",
+                           part_path, attempt + 1, self.upload_retries + 1, error)
+        return None
+
+class ServerGroup:
+    """Все серверы 1С бота: параллельный опрос и выбор сервера по хосту"""
+
+    def __init__(self, managers: List[SSHManager], timeout: float = 10):
+        self.managers = managers
+        self.timeout = timeout
+        self._by_host = {manager.pool.host: manager for manager in managers}
+        # Кнопки с хостом действуют только для этого набора серверов: после
+        # перезагрузки настроек (новый ServerGroup) старые кнопки не разбираются
+        self._generation = secrets.token_hex(3)
+
+    @property
+    def hosts(self) -> List[str]:
+        return [manager.pool.host for manager in self.managers]
+
+    @property
+    def default_host(self) -> str:
+        return self.managers[0].pool.host
+
+    def manager(self, host: str = None) -> SSHManager:
+        return self._by_host[host or self.default_host]
+
+    def host_key(self, host: str) -> str:
+        """Ключ хоста для кнопок: номер хоста и метка набора серверов
+        (в callback_data помещается и длинное имя базы)"""
+        return f"{self.hosts.index(host)}.{self._generation}"
+
+    def host_by_key(self, key: str) -> Optional[str]:
+        """Хост по ключу из кнопки; None - кнопка создана для другого набора серверов"""
+        index, _, generation = key.partition(".")
+        if (generation != self._generation or not index.isdigit()
+                or int(index) >= len(self.managers)):
+            return None
+        return self.hosts[int(index)]
+
+    async def _host_databases(self, manager: SSHManager) -> Optional[List[dict]]:
+        try:
+            # Обновление кэша на медленном хосте продолжится в фоне и пригодится в следующий раз
+            return await asyncio.wait_for(
+                asyncio.shield(manager.get_1c_databases()), self.timeout
+            )
+        except asyncio.TimeoutError:
+            logger.warning("Host %s did not answer in %ss", manager.pool.host, self.timeout)
+            return None
+
+    async def get_1c_databases(self) -> Tuple[List[dict], List[str]]:
+        """Возвращает базы со всех хостов и список хостов, которые не ответили.
+
+        Хост без баз ответил - в список не ответивших он не попадает.
+        """
+        results = await asyncio.gather(
+            *(self._host_databases(manager) for manager in self.managers)
+        )
+        databases, unavailable = [], []
+        for manager, host_databases in zip(self.managers, results):
+            if host_databases is None:
+                unavailable.append(manager.pool.host)
+            else:
+                databases.extend(host_databases)
+        return databases, unavailable
+
+    def invalidate_databases_cache(self):
+        for manager in self.managers:
+            manager.invalidate_databases_cache()
+
+    async def close(self):
+        await asyncio.gather(*(manager.pool.close() for manager in self.managers))
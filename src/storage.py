@@ -0,0 +1,125 @@
+import asyncio
+import json
+import time
+from typing import Callable, Dict, Optional, Union
+
+from aiogram.dispatcher.storage import BaseStorage
+
+from database import Database
+
+def _dumps(value) -> Optional[str]:
+    # Пустые значения не сохраняем, остальное - JSON без лишних пробелов
+    if not value:
+        return None
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":"))
+
+def _loads(value: Optional[str]) -> dict:
+    return json.loads(value) if value else {}
+
+class SQLiteStorage(BaseStorage):
+    """FSM-хранилище в таблице fsm базы бота.
+
+    Запись живёт ttl секунд с последнего изменения; истёкшие записи
+    не читаются и удаляются purge_expired().
+    """
+
+    def __init__(self, db: Database, ttl: int = 86400, purge_interval: int = 3600):
+        self.db = db
+        self.ttl = ttl
+        self.purge_interval = purge_interval
+        self._purged_at = 0.0
+        # Чтение-изменение-запись одной строки не должно перемешиваться
+        self._lock = asyncio.Lock()
+
+    async def close(self):
+        pass
+
+    async def wait_closed(self):
+        pass
+
+    async def purge_expired(self) -> int:
+        self._purged_at = time.monotonic()
+        return await self.db.delete_expired_fsm()
+
+    async def _load(self, chat, user):
+        chat, user = self.check_address(chat=chat, user=user)
+        record = await self.db.get_fsm(chat, user)
+        if record is None:
+            return chat, user, None, {}, {}
+        state, data, bucket = record
+        return chat, user, state, _loads(data), _loads(bucket)
+
+    async def _update(self, chat, user, change: Callable[[Optional[str], dict, dict], tuple]):
+        """Атомарно заменяет (state, data, bucket) записи результатом change"""
+        async with self._lock:
+            chat, user, *record = await self._load(chat, user)
+            state, data, bucket = change(*record)
+            await self.db.save_fsm(
+                chat, user, state, _dumps(data), _dumps(bucket),
+                time.time() + self.ttl
+            )
+        if time.monotonic() - self._purged_at >= self.purge_interval:
+            await self.purge_expired()
+
+    async def get_state(self, *, chat: Union[str, int, None] = None,
+                        user: Union[str, int, None] = None,
+                        default: Optional[str] = None) -> Optional[str]:
+        _, _, state, _, _ = await self._load(chat, user)
+        return state if state is not None else self.resolve_state(default)
+
+    async def get_data(self, *, chat: Union[str, int, None] = None,
+                       user: Union[str, int, None] = None,
+                       default: Optional[Dict] = None) -> Dict:
+        _, _, _, data, _ = await self._load(chat, user)
+        return data or dict(default or {})
+
+    async def set_state(self, *, chat: Union[str, int, None] = None,
+                        user: Union[str, int, None] = None,
+                        state: Optional[str] = None):
+        state = self.resolve_state(state)
+        await self._update(chat, user, lambda _, data, bucket: (state, data, bucket))
+
+    async def set_data(self, *, chat: Union[str, int, None] = None,
+                       user: Union[str, int, None] = None,
+                       data: Dict = None):
+        data = dict(data or {})
+        await self._update(chat, user, lambda state, _, bucket: (state, data, bucket))
+
+    async def update_data(self, *, chat: Union[str, int, None] = None,
+                          user: Union[str, int, None] = None,
+                          data: Dict = None, **kwargs):
+        def change(state, current, bucket):
+            current.update(data or {}, **kwargs)
+            return state, current, bucket
+        await self._update(chat, user, change)
+
+    async def reset_state(self, *, chat: Union[str, int, None] = None,
+                          user: Union[str, int, None] = None,
+                          with_data: Optional[bool] = True):
+        await self._update(
+            chat, user,
+            lambda _, data, bucket: (None, {} if with_data else data, bucket)
+        )
+
+    def has_bucket(self):
+        return True
+
+    async def get_bucket(self, *, chat: Union[str, int, None] = None,
+                         user: Union[str, int, None] = None,
+                         default: Optional[dict] = None) -> Dict:
+        _, _, _, _, bucket = await self._load(chat, user)
+        return bucket or dict(default or {})
+
+    async def set_bucket(self, *, chat: Union[str, int, None] = None,
+                         user: Union[str, int, None] = None,
+                         bucket: Dict = None):
+        bucket = dict(bucket or {})
+        await self._update(chat, user, lambda state, data, _: (state, data, bucket))
+
+    async def update_bucket(self, *, chat: Union[str, int, None] = None,
+                            user: Union[str, int, None] = None,
+                            bucket: Dict = None, **kwargs):
+        def change(state, data, current):
+            current.update(bucket or {}, **kwargs)
+            return state, data, current
+        await self._update(chat, user, change)
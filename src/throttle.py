@@ -0,0 +1,226 @@
+import asyncio
+import logging
+import shlex
+import time
+from contextlib import asynccontextmanager
+from typing import Awaitable, Callable, Optional
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Уровни: обычный приоритет, самый низкий приоритет, загрузка приостановлена
+NORMAL = "normal"
+THROTTLED = "throttled"
+PAUSED = "paused"
+LEVELS = (NORMAL, THROTTLED, PAUSED)
+
+# Во сколько раз должен быть превышен порог, чтобы приостановить загрузку
+PAUSE_FACTOR = 1.5
+# К обычному приоритету возвращаемся, только когда нагрузка ниже порогов с запасом
+RECOVER_FACTOR = 0.8
+
+# Время старта процесса (поле starttime /proc/<pid>/stat): отличает наш процесс
+# от чужого, получившего тот же pid
+_START_TIME = "$(sed 's/.*) //' /proc/{pid}/stat 2>/dev/null | cut -d' ' -f20)"
+
+class LoadThrottle:
+    """Приоритет процессов выгрузки и их притормаживание по нагрузке сервера 1С.
+
+    Тяжёлые команды запускаются через wrap(): под nice/ionice, с записью pid
+    в pid_dir. Пока идёт хотя бы одна выгрузка (track), раз в interval секунд
+    снимаются loadavg на ядро, iowait и число сеансов 1С. Выше порогов процессы
+    получают самый низкий приоритет, при превышении в PAUSE_FACTOR раз всё,
+    кроме ibcmd, приостанавливается SIGSTOP, но не дольше max_pause секунд.
+    Пока идёт потоковая выгрузка, приостановки нет: остановленные tee, zstd
+    или rclone остановили бы и пишущий в канал ibcmd.
+    """
+
+    def __init__(self, pool, sessions: Callable[[], Awaitable[Optional[int]]] = None,
+                 nice: int = 10, ionice_class: int = 2, ionice_level: int = 7,
+                 interval: int = 30, max_load: float = 1.5, max_iowait: float = 30,
+                 max_sessions: int = 0, max_pause: int = 600):
+        self.pool = pool
+        self.sessions = sessions
+        self.nice = nice
+        self.ionice_class = ionice_class
+        self.ionice_level = ionice_level
+        self.interval = interval
+        self.max_load = max_load
+        self.max_iowait = max_iowait
+        self.max_sessions = max_sessions
+        self.max_pause = max_pause
+        # Каталог pid-файлов на сервере, задаётся после подключения
+        self.pid_dir: Optional[str] = None
+        self.level = NORMAL
+        # Последний замер: load (на ядро), iowait (%), sessions
+        self.sample: dict = {}
+        self._cpu: Optional[tuple] = None
+        self._paused_since: Optional[float] = None
+        self._pause_blocked = False
+        self._users = 0
+        self._streaming = 0
+        self._task: Optional[asyncio.Task] = None
+
+    def _ionice(self, ionice_class: int, level: int) -> str:
+        if not ionice_class:
+            return ""
+        # У класса idle (3) нет уровней
+        return f"-c {ionice_class}" if ionice_class == 3 else f"-c {ionice_class} -n {level}"
+
+    def wrap(self, command: str, role: str = "upload") -> str:
+        """Команда с nice/ionice и записью pid; role "dump" никогда не приостанавливается"""
+        if self.pid_dir is None:
+            return command
+        ionice = self._ionice(self.ionice_class, self.ionice_level)
+        script = f'echo "$0 {_START_TIME.format(pid="$$")}" > "$1/$$"; shift; '
+        if ionice:
+            # ionice может не быть на сервере - тогда только nice
+            script += f'command -v ionice >/dev/null 2>&1 && exec nice -n {self.nice} ionice {ionice} "$@"; '
+        script += f'exec nice -n {self.nice} "$@"'
+        return f"sh -c {shlex.quote(script)} {role} {shlex.quote(self.pid_dir)} {command}"
+
+    def action_script(self, level: str, pid_dir: str) -> str:
+        """Скрипт, переводящий записанные процессы на уровень level.
+
+        pid_dir - готовое выражение shell. Записи завершившихся процессов удаляются.
+        Выводит число затронутых процессов.
+        """
+        restore_io = self._ionice(self.ionice_class, self.ionice_level)
+        lowest = 'renice -n 19 -p "$p" >/dev/null 2>&1; ionice -c 3 -p "$p" >/dev/null 2>&1; '
+        action = {
+            # Снизить nice обратно без root нельзя - ошибки renice не мешают продолжению
+            NORMAL: (f'renice -n {self.nice} -p "$p" >/dev/null 2>&1; '
+                     + (f'ionice {restore_io} -p "$p" >/dev/null 2>&1; ' if restore_io else '')
+                     + 'kill -CONT "$p"'),
+            THROTTLED: lowest + 'kill -CONT "$p"',
+            # Остановленный ibcmd дольше держал бы снимок базы - его не трогаем
+            PAUSED: lowest + 'if [ "$role" = dump ]; then kill -CONT "$p"; else kill -STOP "$p"; fi',
+        }[level]
+        return (
+            "n=0; "
+            f"for f in {pid_dir}/*; do "
+            '[ -f "$f" ] || continue; '
+            'p=${f##*/}; read role started < "$f"; '
+            f'if [ "{_START_TIME.format(pid="$p")}" != "$started" ]; then rm -f "$f"; continue; fi; '
+            f"{action}; n=$((n+1)); "
+            "done 2>/dev/null; echo $n"
+        )
+
+    @asynccontextmanager
+    async def track(self, streaming: bool = False):
+        """Отмечает идущую выгрузку: пока они есть, нагрузка сервера отслеживается.
+
+        streaming - выгрузка через канал: пока она идёт, уровень не выше THROTTLED.
+        """
+        self._users += 1
+        if streaming:
+            self._streaming += 1
+        if self._task is None and self.interval > 0:
+            self._task = asyncio.ensure_future(self._watch())
+        try:
+            if streaming and self.level == PAUSED:
+                self._change(THROTTLED, "streaming backup started")
+                try:
+                    await self._apply(THROTTLED)
+                except Exception as e:
+                    logger.warning("Failed to resume paused backups on %s: %s", self.pool.host, e)
+            yield
+        finally:
+            self._users -= 1
+            if streaming:
+                self._streaming -= 1
+            if self._users == 0:
+                await self._release()
+
+    async def _release(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        self._cpu = None
+        if self.level != NORMAL:
+            self._change(NORMAL, "backups finished")
+        try:
+            # Ничего не оставляем остановленным; заодно удаляются записи завершившихся процессов
+            await self._apply(NORMAL)
+        except Exception as e:
+            logger.warning("Failed to restore backup priority on %s: %s", self.pool.host, e)
+
+    async def _watch(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.check()
+            except Exception as e:
+                logger.warning("Load check on %s failed: %s", self.pool.host, e)
+
+    async def _sample(self) -> dict:
+        result = await self.pool.run('cat /proc/loadavg; nproc; head -n 1 /proc/stat')
+        lines = result.stdout.splitlines()
+        load = float(lines[0].split()[0]) / max(int(lines[1]), 1)
+        # iowait - доля времени ожидания диска между двумя замерами
+        cpu = tuple(int(value) for value in lines[2].split()[1:])
+        iowait = None
+        if self._cpu is not None and sum(cpu) > sum(self._cpu):
+            iowait = (cpu[4] - self._cpu[4]) * 100 / (sum(cpu) - sum(self._cpu))
+        self._cpu = cpu
+        sessions = await self.sessions() if self.sessions and self.max_sessions else None
+        return {"load": load, "iowait": iowait, "sessions": sessions}
+
+    def _decide(self, sample: dict) -> str:
+        ratios = [
+            value / limit
+            for value, limit in ((sample["load"], self.max_load),
+                                 (sample["iowait"], self.max_iowait),
+                                 (sample["sessions"], self.max_sessions))
+            if value is not None and limit
+        ]
+        worst = max(ratios, default=0)
+        now = time.monotonic()
+
+        # Приостановка потоковой выгрузки остановила бы и ibcmd
+        if worst >= PAUSE_FACTOR and not self._pause_blocked and not self._streaming:
+            if self._paused_since is None:
+                self._paused_since = now
+            if now - self._paused_since < self.max_pause:
+                return PAUSED
+            # Слишком долгая пауза оборвёт загрузку - продолжаем с низким приоритетом
+            self._pause_blocked = True
+        self._paused_since = None
+
+        if worst >= 1 or (worst >= RECOVER_FACTOR and self.level != NORMAL):
+            return THROTTLED
+        self._pause_blocked = False
+        return NORMAL
+
+    async def check(self):
+        """Снимает нагрузку и при необходимости меняет приоритет процессов"""
+        sample = await self._sample()
+        self.sample = sample
+        host = self.pool.host
+        metrics.set_value(metrics.SERVER_LOAD, sample["load"], host)
+        if sample["iowait"] is not None:
+            metrics.set_value(metrics.SERVER_IOWAIT, sample["iowait"], host)
+        if sample["sessions"] is not None:
+            metrics.set_value(metrics.RAC_SESSIONS, sample["sessions"], host)
+
+        level = self._decide(sample)
+        previous = self.level
+        if level != previous:
+            self._change(level, ", ".join(
+                f"{key}={value:.2f}" for key, value in sample.items() if value is not None
+            ))
+        # Пока уровень не обычный, повторяем действие: его должны получить и новые процессы
+        if level != NORMAL or previous != NORMAL:
+            await self._apply(level)
+
+    def _change(self, level: str, reason: str):
+        logger.info("Backup throttle on %s: %s -> %s (%s)", self.pool.host, self.level, level, reason)
+        self.level = level
+        metrics.set_value(metrics.THROTTLE_LEVEL, LEVELS.index(level), self.pool.host)
+        metrics.inc(metrics.THROTTLE_CHANGES, self.pool.host, level)
+
+    async def _apply(self, level: str):
+        if self.pid_dir is None:
+            return
+        await self.pool.run(self.action_script(level, shlex.quote(self.pid_dir)))
@@ -0,0 +1,71 @@
+import asyncio
+import hmac
+import logging
+import secrets
+
+from aiohttp import web
+from aiogram import Bot, Dispatcher, types
+
+from config import Webhook
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+def create_webhook_app(dp: Dispatcher, path: str, secret: str) -> web.Application:
+    """aiohttp-приложение, принимающее обновления от Telegram.
+
+    Не зависит от сети: в него можно слать POST с JSON обновления
+    (например, через aiohttp.test_utils.TestClient) без обращения к Telegram.
+    """
+
+    async def handle_update(request: web.Request) -> web.Response:
+        # Чужие запросы без нашего секрета не доходят до обработчиков
+        token = request.headers.get(SECRET_HEADER, "")
+        if not hmac.compare_digest(token, secret):
+            return web.Response(status=401)
+
+        try:
+            # Не JSON - ValueError, JSON не объект ([] или 1) - TypeError
+            update = types.Update(**await request.json())
+        except (ValueError, TypeError):
+            return web.Response(status=400)
+
+        Bot.set_current(dp.bot)
+        Dispatcher.set_current(dp)
+        try:
+            await dp.process_update(update)
+        except Exception:
+            # Ошибка обработки не должна заставлять Telegram повторять обновление
+            logger.exception("Failed to process update %s", update.update_id)
+        return web.Response()
+
+    app = web.Application()
+    app.router.add_post(path, handle_update)
+    return app
+
+async def run_webhook(dp: Dispatcher, webhook: Webhook, stop: asyncio.Event):
+    """Регистрирует webhook, принимает обновления до stop и снимает webhook"""
+    if not webhook.url:
+        raise ValueError("WEBHOOK_URL is required in webhook mode")
+
+    secret = webhook.secret or secrets.token_urlsafe(32)
+    runner = web.AppRunner(create_webhook_app(dp, webhook.path, secret))
+    await runner.setup()
+    site = web.TCPSite(runner, webhook.host, webhook.port)
+    await site.start()
+    logger.info("Webhook server listening on %s:%s%s", webhook.host, webhook.port, webhook.path)
+
+    try:
+        await dp.bot.set_webhook(
+            webhook.url.rstrip("/") + webhook.path,
+            secret_token=secret
+        )
+        await stop.wait()
+    finally:
+        # Снимаем webhook, чтобы следующий запуск мог работать и через polling
+        try:
+            await dp.bot.delete_webhook()
+        except Exception as e:
+            logger.warning("Failed to delete webhook: %s", e)
+        await runner.cleanup()
@@ -0,0 +1,224 @@
+"""Нагрузочный прогон: N пользователей одновременно проходят /backup до готовой ссылки.
+
+Бот собирается как в bot.main(): Database, SQLiteStorage, create_servers,
+BackupQueue, Sender, middleware и register_user_handlers. Вместо сервера 1С -
+Fake1CServer, вместо Telegram - FakeTelegramAPI, апдейты бот получает long polling.
+Каждый пользователь отправляет /backup, нажимает кнопку своей базы и ждёт
+итогового сообщения.
+
+Отчёт: p50/p99 времени обработчиков и всего сценария, открытые SSH-подключения
+и команды, вызовы SQLite по методам Database, вызовы Bot API.
+
+    python tests/bench_backup_flows.py --flows 20 --latency 0.05 --dump-size 1048576
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+from typing import Dict, List
+
+from aiogram import Bot, Dispatcher
+from aiogram.bot.api import TelegramAPIServer
+from aiogram.dispatcher.middlewares import BaseMiddleware
+from prometheus_client import REGISTRY
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+# Модули бота и поддельные серверы импортируются без пакета, как в тестах
+sys.path[:0] = [os.path.join(os.path.dirname(TESTS_DIR), "src"), TESTS_DIR]
+import metrics
+from bot import create_backup_queue, create_servers
+from config import SSH, Backup, Config, TgBot
+from context import AppContext
+from database import Database
+from fake_1c import Fake1CServer
+from fake_telegram import FakeTelegramAPI, callback_update, message_update
+from handlers import register_all_handlers
+from middlewares import register_all_middlewares
+from sender import Sender
+from storage import SQLiteStorage
+
+TOKEN = "123456:" + "A" * 35
+ADMIN_ID = 1
+FIRST_USER_ID = 1001
+# Итоговое сообщение выгрузки: успех, ошибка или отказ
+FINAL_PREFIXES = ("✅", "❌", "⚠️")
+
+class HandlerTimer(BaseMiddleware):
+    """Время обработки каждого апдейта, от первого middleware до последнего"""
+
+    def __init__(self):
+        super().__init__()
+        self.timings: Dict[str, List[float]] = {}
+
+    async def on_pre_process_update(self, update, data: dict):
+        data["_load_started"] = time.perf_counter()
+
+    async def on_post_process_update(self, update, results, data: dict):
+        kind = "/backup" if update.message else f"callback:{update.callback_query.data.split('_')[0]}"
+        self.timings.setdefault(kind, []).append(time.perf_counter() - data["_load_started"])
+
+def percentiles(timings: List[float]) -> dict:
+    timings = sorted(timings)
+    return {
+        "p50": timings[len(timings) // 2] * 1000,
+        "p99": timings[min(int(len(timings) * 0.99), len(timings) - 1)] * 1000,
+        "count": len(timings)
+    }
+
+def sqlite_calls() -> Dict[str, int]:
+    """Число вызовов методов Database с начала процесса (метрика sqlite_query_seconds)"""
+    return {
+        sample.labels["query"]: int(sample.value)
+        for family in REGISTRY.collect() if family.name == "backup_bot_sqlite_query_seconds"
+        for sample in family.samples if sample.name.endswith("_count")
+    }
+
+def make_config(args) -> Config:
+    return Config(
+        tg_bot=TgBot(token=TOKEN, admin_id=ADMIN_ID),
+        ssh=SSH(host="127.0.0.1", username="user", password="password",
+                db_server="localhost", db_user="postgres", db_pwd="postgres",
+                user="Admin", user_pwd="123", rclone_remote="yandex",
+                rclone_path="backups"),
+        backup=Backup(progress_interval=1, streaming=args.streaming,
+                      compression=args.compression, max_per_host=args.max_per_host)
+    )
+
+async def backup_flow(api: FakeTelegramAPI, user_id: int, index: int, timeout: float) -> dict:
+    """/backup, кнопка базы base<index>, итоговое сообщение; возвращает время и итог"""
+    started = time.perf_counter()
+    await api.push(message_update(user_id, "/backup"))
+    menu = await api.wait_for(
+        lambda call: call.method == "sendMessage" and call.chat_id == user_id
+        and "reply_markup" in call.params, timeout
+    )
+    buttons = [button["callback_data"]
+               for row in menu.result["reply_markup"]["inline_keyboard"] for button in row]
+    data = next(data for data in buttons if data.endswith(f"|base{index}"))
+    await api.push(callback_update(user_id, menu.result, data))
+    final = await api.wait_for(
+        lambda call: call.method in ("sendMessage", "editMessageText")
+        and call.chat_id == user_id and call.params.get("text", "").startswith(FINAL_PREFIXES),
+        timeout
+    )
+    return {"time": time.perf_counter() - started,
+            "ok": final.params["text"].startswith("✅")}
+
+async def run(args) -> dict:
+    if not metrics.enabled():
+        metrics.setup(active=lambda: 0, queued=lambda: 0)
+    with tempfile.TemporaryDirectory() as root:
+        server = await Fake1CServer(
+            root, latency=args.latency, ssh_latency=args.ssh_latency,
+            infobases=max(args.infobases, args.flows), dump_size=args.dump_size,
+            processes=args.processes
+        ).start()
+        api = await FakeTelegramAPI().start()
+
+        config = make_config(args)
+        db = Database(os.path.join(root, "bot.db"))
+        await db.create_tables()
+        users = range(FIRST_USER_ID, FIRST_USER_ID + args.flows)
+        for user_id in users:
+            await db.add_user(user_id, f"user{user_id}", f"User {user_id}")
+            await db.update_user_status(user_id, "approved")
+
+        bot = Bot(token=TOKEN, server=TelegramAPIServer.from_base(api.url))
+        dp = Dispatcher(bot, storage=SQLiteStorage(db, ttl=config.tg_bot.fsm_ttl))
+        ssh = create_servers(config, db)
+        for manager in ssh.managers:
+            manager.pool.port = server.port
+        backups = create_backup_queue(config, ssh, db)
+        sender = Sender(bot)
+        context = AppContext(config, ssh, backups, sender)
+        timer = HandlerTimer()
+        dp.middleware.setup(timer)
+        register_all_middlewares(dp, db, context)
+        register_all_handlers(dp)
+
+        sqlite_before = sqlite_calls()
+        polling = asyncio.create_task(dp.start_polling(timeout=1, relax=0))
+        started = time.perf_counter()
+        try:
+            flows = await asyncio.gather(*(
+                backup_flow(api, user_id, index, args.timeout)
+                for index, user_id in enumerate(users, 1)
+            ))
+        finally:
+            elapsed = time.perf_counter() - started
+            dp.stop_polling()
+            polling.cancel()
+            await asyncio.gather(polling, return_exceptions=True)
+            await backups.close()
+            await sender.close()
+            await ssh.close()
+            await dp.storage.close()
+            await dp.storage.wait_closed()
+            await db.close()
+            await (await bot.get_session()).close()
+            await api.close()
+            await server.close()
+
+        sqlite_after = sqlite_calls()
+        return {
+            "flows": args.flows,
+            "succeeded": sum(flow["ok"] for flow in flows),
+            "elapsed": elapsed,
+            "flow": percentiles([flow["time"] for flow in flows]),
+            "handlers": {kind: percentiles(timings) for kind, timings in timer.timings.items()},
+            "ssh connections": server.connections,
+            "ssh commands": server.commands,
+            "sqlite calls": {
+                query: count - sqlite_before.get(query, 0)
+                for query, count in sorted(sqlite_after.items())
+                if count > sqlite_before.get(query, 0)
+            },
+            "bot api calls": api.count(),
+            "cloud files": server.cloud_files(),
+        }
+
+def parse_args(argv: List[str] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--flows", type=int, default=20, help="одновременных сценариев /backup")
+    parser.add_argument("--latency", type=float, default=0.0,
+                        help="задержка каждого вызова ps/rac/ibcmd/rclone, с")
+    parser.add_argument("--ssh-latency", type=float, default=0.0,
+                        help="задержка каждой команды SSH, с")
+    parser.add_argument("--infobases", type=int, default=20, help="баз в выводе rac")
+    parser.add_argument("--dump-size", type=int, default=1024 * 1024,
+                        help="размер выгрузки ibcmd, байт")
+    parser.add_argument("--processes", type=int, default=200, help="строк в выводе ps aux")
+    parser.add_argument("--max-per-host", type=int, default=1,
+                        help="одновременных выгрузок на сервер (BACKUP_MAX_PER_HOST)")
+    parser.add_argument("--streaming", action="store_true", help="потоковая выгрузка")
+    parser.add_argument("--compression", choices=["zstd"], default=None)
+    parser.add_argument("--timeout", type=float, default=600, help="предел на сценарий, с")
+    parser.add_argument("--json", action="store_true", help="отчёт в JSON")
+    return parser.parse_args(argv)
+
+def print_report(report: dict):
+    print(f"flows: {report['succeeded']} of {report['flows']} succeeded "
+          f"in {report['elapsed']:.2f} s")
+    for name, value in [("flow", report["flow"])] + sorted(report["handlers"].items()):
+        print(f"  {name:24} p50 {value['p50']:9.1f} ms   p99 {value['p99']:9.1f} ms"
+              f"   n={value['count']}")
+    print(f"ssh connections opened: {report['ssh connections']}, "
+          f"commands: {report['ssh commands']}")
+    print(f"sqlite calls: {sum(report['sqlite calls'].values())}")
+    for query, count in report["sqlite calls"].items():
+        print(f"  {query:32} {count}")
+    print("bot api calls: " + ", ".join(
+        f"{method} {count}" for method, count in sorted(report["bot api calls"].items())))
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.WARNING)
+    args = parse_args()
+    report = asyncio.run(run(args))
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+    else:
+        print_report(report)
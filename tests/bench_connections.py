@@ -0,0 +1,92 @@
+"""Задержка одного вызова: подключение на каждый вызов против долгоживущего.
+
+SQLite: aiosqlite.connect на каждый запрос (как было в Database) против
+Database с одним подключением в WAL. SSH: asyncssh.connect на каждую команду
+против SSHPool.run на локальном FakeSSHServer.
+
+    python tests/bench_connections.py [число вызовов]
+"""
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+import aiosqlite
+import asyncssh
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+# Модули бота и поддельные серверы импортируются без пакета, как в тестах
+sys.path[:0] = [os.path.join(os.path.dirname(TESTS_DIR), "src"), TESTS_DIR]
+from database import Database
+from fake_ssh import FakeSSHServer
+from ssh_manager import SSHPool
+
+async def measure(call, count: int) -> dict:
+    timings = []
+    for _ in range(count):
+        started = time.perf_counter()
+        await call()
+        timings.append(time.perf_counter() - started)
+    timings.sort()
+    return {
+        "p50": statistics.median(timings) * 1000,
+        "p99": timings[min(int(len(timings) * 0.99), len(timings) - 1)] * 1000
+    }
+
+async def bench_sqlite(path: str, count: int) -> dict:
+    db = Database(path, user_cache_size=0)
+    await db.create_tables()
+    await db.add_user(1, "user", "User")
+
+    async def get_user_per_connection():
+        async with aiosqlite.connect(path) as conn:
+            async with conn.execute("SELECT * FROM users WHERE user_id = ?", (1,)) as cursor:
+                await cursor.fetchone()
+
+    async def update_per_connection():
+        async with aiosqlite.connect(path) as conn:
+            await conn.execute("UPDATE users SET status = ? WHERE user_id = ?", ("approved", 1))
+            await conn.commit()
+
+    results = {
+        "sqlite get_user, connection per call": await measure(get_user_per_connection, count),
+        "sqlite get_user, Database": await measure(lambda: db.get_user(1), count),
+        "sqlite update, connection per call": await measure(update_per_connection, count),
+        "sqlite update, Database": await measure(
+            lambda: db.update_user_status(1, "approved"), count),
+    }
+    await db.close()
+    return results
+
+async def bench_ssh(count: int) -> dict:
+    server = await FakeSSHServer().start()
+    pool = SSHPool("127.0.0.1", "user", "password", port=server.port)
+
+    async def run_per_connection():
+        async with asyncssh.connect("127.0.0.1", port=server.port, username="user",
+                                    password="password", known_hosts=None) as conn:
+            await conn.run("true")
+
+    results = {
+        "ssh command, connection per call": await measure(run_per_connection, count),
+        "ssh command, SSHPool": await measure(lambda: pool.run("true"), count),
+    }
+    results["ssh connections opened"] = server.connections
+    await pool.close()
+    await server.close()
+    return results
+
+async def main(count: int):
+    with tempfile.TemporaryDirectory() as directory:
+        results = await bench_sqlite(os.path.join(directory, "bot.db"), count)
+    results.update(await bench_ssh(count))
+    for name, value in results.items():
+        if isinstance(value, dict):
+            print(f"{name:40} p50 {value['p50']:8.3f} ms   p99 {value['p99']:8.3f} ms")
+        else:
+            print(f"{name:40} {value}")
+
+if __name__ == "__main__":
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 200))
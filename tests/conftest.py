@@ -0,0 +1,48 @@
+import asyncio
+import os
+import sys
+from types import SimpleNamespace
+
+import pytest
+
+# Модули бота импортируются без пакета, как при запуске python src/bot.py
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
+
+from database import Database
+from fake_1c import Fake1CServer
+from ssh_manager import SSHManager, SSHPool
+
+@pytest.fixture
+def make_stand(tmp_path):
+    """Фабрика стенда: фальшивый сервер 1С в tmp_path, база бота, SSHPool и SSHManager к серверу.
+
+    Стенд живёт на своём цикле событий - корутины теста выполняет stand.run.
+    Всё открытое закрывается после теста, даже упавшего, в обратном порядке.
+    """
+    loop = asyncio.new_event_loop()
+    opened = []
+
+    async def start(infobases: int, dump_size: int, manager_options: dict) -> SimpleNamespace:
+        root = str(tmp_path)
+        server = await Fake1CServer(root, infobases=infobases, dump_size=dump_size).start()
+        opened.append(server.close)
+        db = Database(os.path.join(root, "bot.db"))
+        opened.append(db.close)
+        await db.create_tables()
+        pool = SSHPool("127.0.0.1", "user", "password", port=server.port)
+        opened.append(pool.close)
+        manager = SSHManager(pool, "localhost", "postgres", "postgres", "Admin", "123",
+                             "yandex", "backups", store=db, **manager_options)
+        return SimpleNamespace(root=root, server=server, db=db, pool=pool, manager=manager,
+                               run=loop.run_until_complete)
+
+    def make(infobases: int = 20, dump_size: int = 1024 * 1024, **manager_options) -> SimpleNamespace:
+        return loop.run_until_complete(start(infobases, dump_size, manager_options))
+
+    yield make
+
+    try:
+        for close in reversed(opened):
+            loop.run_until_complete(close())
+    finally:
+        loop.close()
@@ -0,0 +1,191 @@
+"""Поддельный сервер 1С поверх FakeSSHServer: ps, rac, ibcmd и rclone.
+
+Утилиты - скрипты во временном каталоге root. Каталог платформы
+/opt/1cv8/x86_64 в командах подменяется на root/opt/1cv8/x86_64, облако rclone -
+каталог root/cloud, домашний каталог - root/home.
+"""
+import os
+import stat
+import sys
+from typing import Dict
+
+from fake_ssh import FakeSSHServer
+from ssh_manager import PLATFORM_ROOT
+
+VERSION = "8.3.24.1548"
+CLUSTER = "3f3b7a4e-1d2c-4b5a-9e8f-0a1b2c3d4e5f"
+
+PS = r'''#!/bin/bash
+sleep "$FAKE_1C_LATENCY"
+echo "USER         PID %CPU %MEM    VSZ   RSS TTY      STAT START   TIME COMMAND"
+echo "usr1cv8     1001  0.5  1.2 812345 123456 ?       Ssl  09:00   1:23 /opt/1cv8/x86_64/$FAKE_1C_VERSION/ragent -daemon -port 1540"
+for ((i = 0; i < FAKE_1C_PROCESSES; i++)); do
+    echo "usr1cv8     $((2000 + i))  0.1  0.5 512000 65536 ?       Sl   09:00   0:01 /opt/1cv8/x86_64/$FAKE_1C_VERSION/rphost -range 1560:1591"
+done
+'''
+
+RAC = r'''#!/bin/bash
+sleep "$FAKE_1C_LATENCY"
+case "$1" in
+    cluster)
+        printf 'cluster                       : %s\nhost                          : srv1c\nport                          : 1541\nname                          : "Локальный кластер"\n\n' "$FAKE_1C_CLUSTER";;
+    infobase)
+        for ((i = 1; i <= FAKE_1C_INFOBASES; i++)); do
+            printf 'infobase : %08x-0000-4000-8000-%012x\nname     : base%d\ndescr    : "Информационная база %d"\n\n' $i $i $i $i
+        done;;
+    session)
+        ;;
+    *)
+        echo "rac: unknown mode $1" >&2
+        exit 1;;
+esac
+'''
+
+# Последний аргумент - файл выгрузки (обычный или именованный канал);
+# базы missing нет в кластере
+IBCMD = r'''#!/bin/bash
+sleep "$FAKE_1C_LATENCY"
+for arg; do
+    case "$arg" in
+        --data=*) mkdir -p "${arg#--data=}";;
+        --db-name=missing) echo "Ошибка: информационная база missing не найдена" >&2; exit 1;;
+    esac
+done
+head -c "$FAKE_1C_DUMP_SIZE" /dev/urandom > "${@: -1}" || exit 1
+echo "Выгрузка информационной базы завершена"
+'''
+
+RCLONE = r'''#!{python}
+import hashlib, json, os, shutil, sys, time
+
+time.sleep(float(os.environ.get("FAKE_1C_LATENCY") or 0))
+CLOUD = os.environ["FAKE_1C_CLOUD"]
+WITH_VALUE = {{"--stats", "--stats-log-level", "--bwlimit", "--multi-thread-streams",
+              "--retries", "--size"}}
+
+args, options, items = sys.argv[1:], {{}}, []
+while args:
+    arg = args.pop(0)
+    if arg in WITH_VALUE:
+        options[arg] = args.pop(0)
+    elif arg.startswith("--"):
+        options[arg] = True
+    else:
+        items.append(arg)
+command, paths = items[0], items[1:]
+
+def local(path):
+    # remote:path/file -> CLOUD/path/file
+    return os.path.join(CLOUD, path.partition(":")[2].strip("/"))
+
+def fail(message, code=1):
+    print(f"ERROR : {{message}}", file=sys.stderr)
+    sys.exit(code)
+
+def entry(directory, name):
+    path = os.path.join(directory, name)
+    is_dir = os.path.isdir(path)
+    return {{"Path": name, "Name": name, "Size": -1 if is_dir else os.path.getsize(path),
+            "IsDir": is_dir, "ModTime": "2024-01-01T00:00:00Z"}}
+
+def digest(algorithm, path):
+    with open(path, "rb") as file:
+        return hashlib.new(algorithm, file.read()).hexdigest()
+
+if command == "mkdir":
+    os.makedirs(local(paths[0]), exist_ok=True)
+elif command == "lsjson":
+    path = local(paths[0])
+    if os.path.isfile(path):
+        print(json.dumps([entry(os.path.dirname(path), os.path.basename(path))]))
+    elif os.path.isdir(path):
+        entries = [entry(path, name) for name in sorted(os.listdir(path))]
+        if "--files-only" in options:
+            entries = [item for item in entries if not item["IsDir"]]
+        print(json.dumps(entries))
+    else:
+        fail("directory not found", 3)
+elif command == "hashsum":
+    algorithm, path = paths[0], local(paths[1])
+    if os.path.isfile(path):
+        print(f"{{digest(algorithm, path)}}  {{os.path.basename(path)}}")
+    elif os.path.isdir(path):
+        for name in sorted(os.listdir(path)):
+            if os.path.isfile(os.path.join(path, name)):
+                print(f"{{digest(algorithm, os.path.join(path, name))}}  {{name}}")
+    else:
+        fail("object not found", 3)
+elif command == "copy":
+    target = local(paths[1])
+    os.makedirs(target, exist_ok=True)
+    shutil.copyfile(paths[0], os.path.join(target, os.path.basename(paths[0])))
+elif command == "rcat":
+    path = local(paths[0])
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as file:
+        shutil.copyfileobj(sys.stdin.buffer, file)
+elif command == "cat":
+    if not os.path.isfile(local(paths[0])):
+        fail("object not found", 3)
+    with open(local(paths[0]), "rb") as file:
+        shutil.copyfileobj(file, sys.stdout.buffer)
+elif command == "link":
+    if not os.path.exists(local(paths[0])):
+        fail("object not found", 3)
+    print("https://disk.yandex.ru/d/" + hashlib.md5(paths[0].encode()).hexdigest()[:14])
+elif command == "deletefile":
+    if not os.path.isfile(local(paths[0])):
+        fail("object not found", 3)
+    os.remove(local(paths[0]))
+elif command == "purge":
+    shutil.rmtree(local(paths[0]), ignore_errors=True)
+else:
+    fail(f"unknown command {{command}}")
+'''
+
+class Fake1CServer(FakeSSHServer):
+    """Сервер 1С с настраиваемой задержкой утилит и объёмом их вывода.
+
+    latency - задержка каждого вызова ps, rac, ibcmd и rclone в секундах,
+    ssh_latency - задержка каждой команды SSH, infobases - число баз в выводе rac,
+    dump_size - размер выгрузки ibcmd в байтах, processes - число строк ps aux.
+    """
+
+    def __init__(self, root: str, latency: float = 0.0, ssh_latency: float = 0.0,
+                 infobases: int = 20, dump_size: int = 1024 * 1024, processes: int = 200):
+        self.root = root
+        self.cloud = os.path.join(root, "cloud")
+        bin_dir = os.path.join(root, "bin")
+        platform_dir = os.path.join(root, PLATFORM_ROOT.lstrip("/"), VERSION)
+        for directory in (self.cloud, bin_dir, platform_dir, os.path.join(root, "home")):
+            os.makedirs(directory, exist_ok=True)
+        _write_script(os.path.join(bin_dir, "ps"), PS)
+        _write_script(os.path.join(bin_dir, "rclone"), RCLONE.format(python=sys.executable))
+        _write_script(os.path.join(platform_dir, "rac"), RAC)
+        _write_script(os.path.join(platform_dir, "ibcmd"), IBCMD)
+        _write_script(os.path.join(platform_dir, "ragent"), "#!/bin/sh\n")
+
+        env: Dict[str, str] = {
+            "PATH": f"{bin_dir}:{os.environ['PATH']}",
+            "HOME": os.path.join(root, "home"),
+            "FAKE_1C_LATENCY": str(latency),
+            "FAKE_1C_VERSION": VERSION,
+            "FAKE_1C_CLUSTER": CLUSTER,
+            "FAKE_1C_INFOBASES": str(infobases),
+            "FAKE_1C_DUMP_SIZE": str(dump_size),
+            "FAKE_1C_PROCESSES": str(processes),
+            "FAKE_1C_CLOUD": self.cloud,
+        }
+        super().__init__(env, ssh_latency, {PLATFORM_ROOT: root + PLATFORM_ROOT})
+
+    def cloud_files(self):
+        """Файлы облака относительно его корня"""
+        return sorted(
+            os.path.relpath(os.path.join(directory, name), self.cloud)
+            for directory, _, names in os.walk(self.cloud) for name in names
+        )
+
+def _write_script(path: str, text: str):
+    with open(path, "w") as file:
+        file.write(text)
+    os.chmod(path, os.stat(path).st_mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
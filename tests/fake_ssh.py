@@ -0,0 +1,81 @@
+import asyncio
+import os
+from typing import Dict, Optional
+
+import asyncssh
+
+class _Server(asyncssh.SSHServer):
+    def __init__(self, fake: 'FakeSSHServer'):
+        self.fake = fake
+
+    def connection_made(self, conn):
+        self.fake.connections += 1
+
+    def begin_auth(self, username: str) -> bool:
+        return True
+
+    def password_auth_supported(self) -> bool:
+        return True
+
+    def validate_password(self, username: str, password: str) -> bool:
+        return True
+
+class FakeSSHServer:
+    """Локальный SSH-сервер: команды выполняет bash на этой машине.
+
+    env дополняет окружение команд (например, PATH с поддельными rac/ibcmd/rclone),
+    latency - задержка перед каждой командой в секундах, paths - подмена каталогов
+    в тексте команд (каталог на сервере -> локальный). Считает открытые
+    подключения и выполненные команды.
+    """
+
+    def __init__(self, env: Dict[str, str] = None, latency: float = 0.0,
+                 paths: Dict[str, str] = None):
+        self.env = dict(os.environ, **(env or {}))
+        self.latency = latency
+        self.paths = paths or {}
+        self.port: Optional[int] = None
+        self.connections = 0
+        self.commands = 0
+        self._acceptor = None
+
+    async def start(self) -> 'FakeSSHServer':
+        self._acceptor = await asyncssh.listen(
+            "127.0.0.1", 0,
+            server_host_keys=[asyncssh.generate_private_key("ssh-ed25519")],
+            server_factory=lambda: _Server(self),
+            process_factory=self._handle,
+            encoding=None
+        )
+        self.port = self._acceptor.sockets[0].getsockname()[1]
+        return self
+
+    async def _handle(self, process: asyncssh.SSHServerProcess):
+        self.commands += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        script = process.command or "true"
+        for remote, local in self.paths.items():
+            script = script.replace(remote, local)
+        command = await asyncio.create_subprocess_exec(
+            "bash", "-c", script, env=self.env,
+            stdin=asyncio.subprocess.DEVNULL, stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE
+        )
+
+        async def pump(source, target):
+            # Вывод передаётся по мере появления: на нём держится потоковый прогресс
+            while True:
+                chunk = await source.read(65536)
+                if not chunk:
+                    break
+                target.write(chunk)
+
+        await asyncio.gather(pump(command.stdout, process.stdout),
+                             pump(command.stderr, process.stderr))
+        process.exit(await command.wait())
+
+    async def close(self):
+        if self._acceptor is not None:
+            self._acceptor.close()
+            await self._acceptor.wait_closed()
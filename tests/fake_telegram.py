@@ -0,0 +1,149 @@
+"""Поддельный Bot API: отдаёт боту апдейты через getUpdates и запоминает его вызовы.
+
+Бот подключается к нему как к локальному серверу Bot API:
+Bot(token, server=TelegramAPIServer.from_base(api.url)).
+"""
+import asyncio
+import json
+import time
+from dataclasses import dataclass
+from typing import Callable, List, Optional
+
+from aiohttp import web
+
+BOT_USER = {"id": 123456, "is_bot": True, "first_name": "Backup", "username": "backup_bot"}
+
+@dataclass
+class ApiCall:
+    at: float
+    method: str
+    params: dict
+    result: object
+
+    @property
+    def chat_id(self) -> Optional[int]:
+        chat_id = self.params.get("chat_id")
+        return int(chat_id) if chat_id is not None else None
+
+class FakeTelegramAPI:
+    """Bot API на 127.0.0.1: push кладёт апдейт в очередь getUpdates,
+    calls - все остальные вызовы бота по порядку с временем (time.perf_counter)."""
+
+    def __init__(self):
+        self.url: Optional[str] = None
+        self.calls: List[ApiCall] = []
+        self._updates: List[dict] = []
+        self._update_id = 0
+        self._message_id = 0
+        self._changed = asyncio.Condition()
+        self._runner = None
+
+    async def start(self) -> 'FakeTelegramAPI':
+        app = web.Application()
+        app.router.add_post("/bot{token}/{method}", self._handle)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, "127.0.0.1", 0).start()
+        self.url = "http://%s:%s" % self._runner.addresses[0][:2]
+        return self
+
+    async def push(self, update: dict) -> dict:
+        """Добавляет апдейт (update_id назначается по порядку)"""
+        async with self._changed:
+            self._update_id += 1
+            update = dict(update, update_id=self._update_id)
+            self._updates.append(update)
+            self._changed.notify_all()
+        return update
+
+    async def wait_for(self, predicate: Callable[[ApiCall], bool],
+                       timeout: float = 60) -> ApiCall:
+        """Ждёт вызов бота, удовлетворяющий predicate (в том числе уже сделанный)"""
+        async with self._changed:
+            return await asyncio.wait_for(self._changed.wait_for(
+                lambda: next((call for call in self.calls if predicate(call)), None)
+            ), timeout)
+
+    def count(self) -> dict:
+        counts = {}
+        for call in self.calls:
+            counts[call.method] = counts.get(call.method, 0) + 1
+        return counts
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        params = dict(await request.post())
+        if method == "getUpdates":
+            result = await self._get_updates(params)
+        else:
+            result = self._result(method, params)
+            async with self._changed:
+                self.calls.append(ApiCall(time.perf_counter(), method, params, result))
+                self._changed.notify_all()
+        return web.json_response({"ok": True, "result": result})
+
+    async def _get_updates(self, params: dict) -> List[dict]:
+        offset = int(params.get("offset") or 0)
+        async with self._changed:
+            # Апдейты до offset бот уже получил
+            self._updates = [update for update in self._updates if update["update_id"] >= offset]
+            if not self._updates:
+                try:
+                    await asyncio.wait_for(self._changed.wait_for(lambda: self._updates),
+                                           float(params.get("timeout") or 0))
+                except asyncio.TimeoutError:
+                    pass
+            return list(self._updates)
+
+    def _result(self, method: str, params: dict):
+        if method == "getMe":
+            return BOT_USER
+        if method == "sendMessage":
+            self._message_id += 1
+            return self._message(self._message_id, params)
+        if method == "editMessageText":
+            return self._message(int(params["message_id"]), params)
+        return True
+
+    @staticmethod
+    def _message(message_id: int, params: dict) -> dict:
+        message = {
+            "message_id": message_id,
+            "date": int(time.time()),
+            "chat": {"id": int(params["chat_id"]), "type": "private"},
+            "from": BOT_USER,
+            "text": params.get("text", ""),
+        }
+        if params.get("reply_markup"):
+            message["reply_markup"] = json.loads(params["reply_markup"])
+        return message
+
+    async def close(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+def user(user_id: int) -> dict:
+    return {"id": user_id, "is_bot": False, "first_name": f"User {user_id}"}
+
+def message_update(user_id: int, text: str) -> dict:
+    """Апдейт с сообщением пользователя в личном чате"""
+    entities = ([{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+                if text.startswith("/") else [])
+    return {"message": {
+        "message_id": 1,
+        "date": int(time.time()),
+        "chat": {"id": user_id, "type": "private"},
+        "from": user(user_id),
+        "text": text,
+        "entities": entities,
+    }}
+
+def callback_update(user_id: int, message: dict, data: str) -> dict:
+    """Апдейт с нажатием кнопки под сообщением бота message"""
+    return {"callback_query": {
+        "id": f"{user_id}:{data}",
+        "from": user(user_id),
+        "chat_instance": str(user_id),
+        "message": message,
+        "data": data,
+    }}
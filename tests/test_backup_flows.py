@@ -0,0 +1,96 @@
+import asyncio
+import json
+import os
+import subprocess
+
+import aiosqlite
+import pytest
+
+from bench_backup_flows import parse_args, run
+from ssh_manager import StepResult, _is_not_found
+
+@pytest.mark.parametrize("options", [[], ["--streaming", "--compression", "zstd"]])
+def test_concurrent_backup_flows(options):
+    flows = 3
+    report = asyncio.run(run(parse_args(
+        ["--flows", str(flows), "--dump-size", "65536", "--max-per-host", "3", "--timeout", "60"]
+        + options
+    )))
+
+    assert report["succeeded"] == flows
+    assert report["handlers"]["/backup"]["count"] == flows
+    assert report["handlers"]["callback:backup"]["count"] == flows
+    # Все команды идут через одно подключение пула
+    assert report["ssh connections"] == 1
+    # Версия платформы определяется один раз и сохраняется
+    assert report["sqlite calls"]["save_platforms"] == 1
+    # По копии и манифесту на каждую базу
+    suffix = ".dt.zst" if options else ".dt"
+    for index in range(1, flows + 1):
+        files = [name for name in report["cloud files"]
+                 if name.startswith(f"backups/base{index}/")]
+        assert len(files) == 2
+        assert files[0].endswith(suffix) and files[1].endswith(suffix + ".manifest.json")
+
+def test_parted_upload_manifest(make_stand):
+    chunk = 16384
+    stand = make_stand(infobases=1, dump_size=chunk * 3 + 100, upload_chunk_size=chunk)
+
+    async def saved():
+        async with aiosqlite.connect(os.path.join(stand.root, "bot.db")) as conn:
+            async with conn.execute("SELECT sha256 FROM backup_files") as cursor:
+                return await cursor.fetchall()
+
+    stats = {}
+    link = stand.run(stand.manager.create_database_backup("base1", stats=stats))
+
+    assert link and len(stats["parts"]) == 4
+    cloud_db = os.path.join(stand.root, "cloud", "backups", "base1")
+    manifest_name = next(name for name in os.listdir(cloud_db) if name.endswith(".manifest.json"))
+    with open(os.path.join(cloud_db, manifest_name)) as file:
+        manifest = json.load(file)
+    # SHA-256 частей по порядку: sha256sum -c проверяет скачанные части перед склейкой
+    lines = manifest["sha256sums"].splitlines()
+    assert [line.rsplit("/", 1)[1] for line in lines] == ["00000", "00001", "00002", "00003"]
+    check = subprocess.run(["sha256sum", "-c", "--quiet", "-"], cwd=cloud_db,
+                           input=manifest["sha256sums"].encode())
+    assert check.returncode == 0
+    assert manifest["restore"].startswith(f"jq -r .sha256sums {manifest_name} | sha256sum -c")
+    assert stand.run(saved()) == [(",".join(part["sha256"] for part in manifest["parts"]),)]
+
+def test_local_file_kept_without_manifest(make_stand, tmp_path):
+    root = str(tmp_path)
+    dump = os.path.join(root, "home", "dump_1s_dt", "base1_20240101_030000.dt")
+    cloud_db = os.path.join(root, "cloud", "backups", "base1")
+    # Манифест не записать: на его месте каталог
+    os.makedirs(os.path.join(cloud_db, "base1_20240101_030000.dt.manifest.json"))
+    os.makedirs(os.path.dirname(dump))
+    with open(dump, "wb") as file:
+        file.write(b"dump" * 100)
+    stand = make_stand(infobases=1)
+
+    assert stand.run(stand.manager.upload_to_cloud(dump, "base1")) is None
+    # Без манифеста копию не восстановить - локальный файл остаётся
+    assert os.path.getsize(dump) == 400
+    assert os.path.getsize(os.path.join(cloud_db, "base1_20240101_030000.dt")) == 400
+
+def test_platform_redetected_only_for_missing_utility():
+    ibcmd = "/opt/1cv8/x86_64/8.3.24.1548/ibcmd"
+    assert _is_not_found(StepResult("dump", 127), ibcmd)
+    assert _is_not_found(StepResult("dump", 1, stderr=f"sh: 1: {ibcmd}: not found"), ibcmd)
+    # Нет базы, каталога --data или пути в облаке - новый путь к ibcmd не поможет
+    for stderr in ("Информационная база не найдена", "Infobase not found",
+                   "mkdir: cannot create directory '/home/u/data_x': No such file or directory",
+                   "ERROR : backups/buh: directory not found"):
+        assert not _is_not_found(StepResult("dump", 1, stderr=stderr), ibcmd)
+
+def test_dump_error_kept_with_progress(make_stand):
+    stand = make_stand(infobases=1, progress_interval=1)
+
+    stats = {}
+    link = stand.run(stand.manager.create_database_backup("missing", progress=lambda info: None,
+                                                          stats=stats))
+
+    assert link is None
+    # Вывод ibcmd не теряется при выводе хода выгрузки и показывается пользователю
+    assert stats["error"] == "Ошибка: информационная база missing не найдена"
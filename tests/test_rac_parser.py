@@ -0,0 +1,138 @@
+import os
+import time
+import timeit
+
+import pytest
+
+from rac_parser import parse_blocks, parse_clusters, parse_infobases
+
+FIXTURES = os.path.join(os.path.dirname(__file__), "fixtures")
+
+def fixture(name: str) -> str:
+    with open(os.path.join(FIXTURES, name), encoding="utf-8") as file:
+        return file.read()
+
+def legacy_parse(output: str) -> list:
+    """Прежний разбор из SSHManager.get_1c_databases - для сравнения в замере"""
+    databases = []
+    current_db = {}
+    for line in output.splitlines():
+        line = line.strip()
+        if not line:
+            if current_db:
+                databases.append(current_db)
+                current_db = {}
+            continue
+        if ':' in line:
+            key, value = line.split(':', 1)
+            key = key.strip().lower()
+            value = value.strip()
+            if 'name' in key:
+                current_db['name'] = value
+            elif 'descr' in key:
+                current_db['descr'] = value
+    if current_db:
+        databases.append(current_db)
+    return databases
+
+def generated_summary(count: int, quoted: bool = True) -> str:
+    return "".join(
+        f"infobase : {index:08x}-0000-4000-8000-000000000000\n"
+        f"name     : base_{index}\n"
+        + (f"descr    : \"База \"\"{index}\"\"\"\n\n" if quoted else f"descr    : База_{index}\n\n")
+        for index in range(count)
+    )
+
+def test_multiple_clusters():
+    clusters = list(parse_clusters(fixture("rac_cluster_list.txt")))
+    assert [cluster["cluster"] for cluster in clusters] == [
+        "3f3b7a4e-1d2c-4b5a-9e8f-0a1b2c3d4e5f",
+        "7c9d2e10-5a6b-4c7d-8e9f-102132435465",
+    ]
+    assert {key: clusters[0][key] for key in ("cluster", "host", "port", "name")} == {
+        "cluster": "3f3b7a4e-1d2c-4b5a-9e8f-0a1b2c3d4e5f", "host": "srv1c", "port": "1541",
+        "name": "Локальный кластер"
+    }
+    assert clusters[0]["load-balancing-mode"] == "performance"
+    assert clusters[1]["port"] == "1641"
+
+def test_empty_output():
+    assert list(parse_blocks(fixture("rac_empty.txt"))) == []
+    assert list(parse_infobases("")) == []
+    assert list(parse_clusters("\n\n")) == []
+
+def test_quoted_and_multiline_values():
+    infobases = list(parse_infobases(fixture("rac_infobase_summary.txt")))
+    assert [infobase["name"] for infobase in infobases] == [
+        "buh", "zup", "trade 2024", "ut", "descr"
+    ]
+    assert infobases[0]["descr"] == "Бухгалтерия предприятия"
+    assert infobases[0]["infobase"] == "8d1b2c3d-4e5f-4a6b-8c7d-9e0f1a2b3c4d"
+    assert infobases[1]["descr"] == ""
+    assert infobases[2]["descr"] == 'Торговля "Север": рабочая'
+    # Пустая строка внутри кавычек не разделяет блоки
+    assert infobases[3]["descr"] == "Управление торговлей\nкопия от 01.02.2024\n\nне использовать"
+    assert infobases[4]["descr"] == ""
+
+def test_keys_match_exactly():
+    infobase = next(parse_infobases(fixture("rac_infobase_info.txt")))
+    # db-name и security-profile-name содержат "name", но это не имя базы
+    assert infobase["name"] == "buh"
+    assert infobase["db-name"] == "buh_prod"
+    assert infobase["dbms"] == "PostgreSQL"
+    assert infobase["db-server"] == "pg.local"
+    assert infobase["db-user"] == "postgres"
+    assert infobase["locale"] == "ru_RU"
+    assert infobase["date-offset"] == "2000"
+    assert infobase["descr"] == "Бухгалтерия: основная база"
+    assert infobase["reserve-working-processes"] == "no"
+    assert infobase["denied-from"] == ""
+    # Прежний разбор по вхождению подстроки подменял имя базы
+    assert legacy_parse(fixture("rac_infobase_info.txt"))[0]["name"] == ""
+
+def test_unclosed_quote_at_end_of_output():
+    block = next(parse_blocks('name : buh\ndescr : "обрыв\nвывода'))
+    assert block == {"name": "buh", "descr": "обрыв\nвывода"}
+
+def test_blocks_are_parsed_lazily():
+    consumed = []
+
+    def lines():
+        for line in generated_summary(1000).splitlines(keepends=True):
+            consumed.append(line)
+            yield line
+
+    first = next(parse_infobases(lines()))
+    assert first["name"] == "base_0"
+    assert len(consumed) == 4
+
+def test_missing_description_is_absent():
+    infobase = next(parse_infobases("infobase : 1\nname : buh\n"))
+    # Подпись "Без описания" подставляет обработчик, пустую строку парсер не выдумывает
+    assert "descr" not in infobase
+
+def test_parser_not_slower_than_legacy():
+    # Старый цикл не снимает кавычки, поэтому сравниваем на выводе без них
+    output = generated_summary(5000, quoted=False)
+    timings = {parse_infobases: [], legacy_parse: []}
+    # Замеры чередуются, чтобы фоновая нагрузка досталась обоим поровну, и идут
+    # по процессорному времени - вытеснение процесса в них не попадает
+    for _ in range(30):
+        for parse in timings:
+            timings[parse].append(
+                timeit.timeit(lambda: list(parse(output)), number=3, timer=time.process_time)
+            )
+    assert min(timings[parse_infobases]) <= min(timings[legacy_parse])
+
+@pytest.mark.benchmark(group="rac infobase summary, 5000 bases")
+def test_benchmark_parser(benchmark):
+    output = generated_summary(5000)
+    infobases = benchmark(lambda: list(parse_infobases(output)))
+    assert len(infobases) == 5000
+    assert infobases[-1]["descr"] == 'База "4999"'
+
+@pytest.mark.benchmark(group="rac infobase summary, 5000 bases")
+def test_benchmark_legacy_parser(benchmark):
+    output = generated_summary(5000)
+    databases = benchmark(lambda: legacy_parse(output))
+    assert len(databases) == 5000
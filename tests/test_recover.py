@@ -0,0 +1,99 @@
+import json
+import os
+
+import aiosqlite
+
+from backup_queue import BackupQueue
+from ssh_manager import ServerGroup
+
+HOST = "127.0.0.1"
+USER_ID = 1001
+
+def write(path: str, data: bytes = b"dump"):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as file:
+        file.write(data)
+
+def test_recover_after_restart(make_stand, tmp_path):
+    root = str(tmp_path)
+    dump_dir = os.path.join(root, "home", "dump_1s_dt")
+    cloud = os.path.join(root, "cloud", "backups")
+
+    # Загрузка завершилась, а итог записать не успели: копия с манифестом в облаке
+    write(f"{cloud}/done/done_20240101_030000.dt", b"x" * 10)
+    write(f"{cloud}/done/done_20240101_030000.dt.manifest.json",
+          json.dumps({"size": 10, "sha256": "ab" * 32, "verified": "sha256"}).encode())
+    # Потоковая выгрузка оборвалась: каналы на сервере и недозагруженная копия
+    for suffix in ("", ".sha256", ".size"):
+        os.makedirs(dump_dir, exist_ok=True)
+        os.mkfifo(f"{dump_dir}/stream_20240101_030000.fifo{suffix}")
+    write(f"{cloud}/stream/stream_20240101_030000.dt")
+    # Временные каталоги ibcmd: прерванной выгрузки и идущей сейчас
+    write(f"{dump_dir}/data_stream_20240101_030000/1Cv8.1CD")
+    write(f"{dump_dir}/data_base1_20240101_040000/1Cv8.1CD")
+    write(f"{cloud}/stream/stream_20231231_030000.dt")
+    write(f"{cloud}/stream/stream_20231231_030000.dt.manifest.json", b"{}")
+    # Потоковая выгрузка загрузила копию с манифестом, но итог не записан
+    for suffix in ("", ".sha256", ".size"):
+        os.mkfifo(f"{dump_dir}/streamed_20240101_030000.fifo{suffix}")
+    write(f"{cloud}/streamed/streamed_20240101_030000.dt", b"y" * 12)
+    write(f"{cloud}/streamed/streamed_20240101_030000.dt.manifest.json",
+          json.dumps({"size": 12, "sha256": "cd" * 32, "verified": "sha256"}).encode())
+    # Сжатие закончилось (zstd удалил .dt), а этап загрузки не записан
+    write(f"{dump_dir}/zipped_20240101_030000.dt.zst")
+    # Загрузка файла оборвалась и локальный файл потерян: копия без манифеста
+    write(f"{cloud}/lost/lost_20240101_030000.dt")
+
+    stand = make_stand()
+
+    async def scenario():
+        db = stand.db
+        queue = BackupQueue(ServerGroup([stand.manager]), journal=db)
+        for job_id, db_name, status, file_name in [
+            ("1", "done", "uploading", "done_20240101_030000.dt"),
+            ("2", "stream", "dumping", "stream_20240101_030000.fifo"),
+            ("3", "lost", "uploading", "lost_20240101_030000.dt"),
+            ("4", "streamed", "dumping", "streamed_20240101_030000.fifo"),
+            ("5", "zipped", "compressing", "zipped_20240101_030000.dt"),
+        ]:
+            await db.save_backup_job(job_id, HOST, db_name, USER_ID, status,
+                                     file_path=f"{dump_dir}/{file_name}")
+        try:
+            return await queue.recover()
+        finally:
+            await queue.close()
+
+    resumed, failed, completed = stand.run(scenario())
+
+    assert [(job.db_name, job.resume_path) for job in resumed] == [
+        ("zipped", f"{dump_dir}/zipped_20240101_030000.dt.zst")
+    ]
+    assert [record["db_name"] for record in completed] == ["done", "streamed"]
+    assert all(record["result"].startswith("https://disk.yandex.ru/") for record in completed)
+    assert sorted(record["db_name"] for record in failed) == ["lost", "stream"]
+
+    # Каналы и недозагруженные копии удалены, подтверждённые копии на месте
+    assert sorted(os.listdir(dump_dir)) == [
+        ".throttle", "data_base1_20240101_040000", "zipped_20240101_030000.dt.zst"
+    ]
+    assert sorted(os.listdir(f"{cloud}/stream")) == [
+        "stream_20231231_030000.dt", "stream_20231231_030000.dt.manifest.json"
+    ]
+    assert os.listdir(f"{cloud}/lost") == []
+    assert len(os.listdir(f"{cloud}/done")) == 2
+
+    async def saved():
+        async with aiosqlite.connect(os.path.join(root, "bot.db")) as conn:
+            async with conn.execute(
+                "SELECT db_name, file_name, size, sha256 FROM backup_files ORDER BY db_name"
+            ) as cursor:
+                backup_files = await cursor.fetchall()
+            async with conn.execute("SELECT id, status FROM backup_jobs ORDER BY id") as cursor:
+                jobs = await cursor.fetchall()
+        return backup_files, jobs
+
+    backup_files, jobs = stand.run(saved())
+    assert backup_files == [("done", "done_20240101_030000.dt", 10, "ab" * 32),
+                            ("streamed", "streamed_20240101_030000.dt", 12, "cd" * 32)]
+    assert jobs == [("1", "done"), ("2", "failed"), ("3", "failed"), ("4", "done"),
+                    ("5", "compressing")]
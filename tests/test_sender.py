@@ -0,0 +1,208 @@
+import asyncio
+import time
+from types import SimpleNamespace
+
+import pytest
+from aiogram.utils.exceptions import RetryAfter
+
+from sender import Sender
+
+# Погрешность таймеров asyncio
+EPS = 0.02
+
+class FakeBot:
+    """Bot без сети: запоминает отправки с временем и по заказу отвечает 429"""
+
+    def __init__(self):
+        self.sent = []
+        self.attempts = []
+        # chat_id -> список Retry-After для ближайших попыток
+        self.flood = {}
+
+    async def send_message(self, chat_id, text, **kwargs):
+        now = time.monotonic()
+        self.attempts.append((now, chat_id, text))
+        if self.flood.get(chat_id):
+            raise RetryAfter(self.flood[chat_id].pop(0))
+        self.sent.append((now, chat_id, text))
+        return FakeMessage(self, chat_id, len(self.sent))
+
+class FakeMessage:
+    def __init__(self, bot: FakeBot, chat_id: int, message_id: int):
+        self.bot = bot
+        self.chat = SimpleNamespace(id=chat_id)
+        self.message_id = message_id
+        self.edits = []
+
+    async def edit_text(self, text, **kwargs):
+        self.edits.append((time.monotonic(), text))
+        return text
+
+def offsets(records, start):
+    return [at - start for at, *_ in records]
+
+def test_chat_limit_allows_burst_then_spaces_sends():
+    bot = FakeBot()
+    sender = Sender(bot, global_rate=1000, chat_rate=20, chat_burst=3)
+
+    async def scenario():
+        start = time.monotonic()
+        await asyncio.gather(*(sender.send_message(1, f"m{i}") for i in range(10)))
+        return start
+
+    start = asyncio.run(scenario())
+    assert [text for _, _, text in bot.sent] == [f"m{i}" for i in range(10)]
+    times = offsets(bot.sent, start)
+    # Первые три уходят сразу, дальше - не чаще раза в 1/20 с
+    assert times[2] < EPS
+    for i, at in enumerate(times):
+        assert at >= (i - 2) / 20 - EPS
+    assert times[-1] < 7 / 20 + 0.1
+
+def test_chats_do_not_wait_for_each_other():
+    bot = FakeBot()
+    sender = Sender(bot, global_rate=1000, chat_rate=1, chat_burst=1)
+
+    async def scenario():
+        start = time.monotonic()
+        await asyncio.gather(*(sender.send_message(chat, "hi") for chat in range(1, 21)))
+        return start
+
+    start = asyncio.run(scenario())
+    assert len(bot.sent) == 20
+    assert max(offsets(bot.sent, start)) < 0.1
+
+def test_global_limit_across_chats():
+    bot = FakeBot()
+    sender = Sender(bot, global_rate=40, chat_rate=100, chat_burst=100)
+
+    async def scenario():
+        start = time.monotonic()
+        await asyncio.gather(*(sender.send_message(chat, "hi") for chat in range(1, 61)))
+        return start
+
+    start = asyncio.run(scenario())
+    times = sorted(offsets(bot.sent, start))
+    assert len(times) == 60
+    # Всплеск до 40 сообщений, затем 40 в секунду
+    assert times[39] < 0.1
+    for i, at in enumerate(times):
+        assert at >= (i - 39) / 40 - EPS
+    # В любом окне в 1 с - не больше всплеска и ещё 40 сообщений в секунду
+    for i in range(len(times)):
+        assert sum(1 for at in times[i:] if at - times[i] < 1 - EPS) <= 80
+
+def test_group_limit():
+    bot = FakeBot()
+    sender = Sender(bot, global_rate=1000, group_rate=10)
+
+    async def scenario():
+        start = time.monotonic()
+        await asyncio.gather(*(sender.send_message(-100, f"m{i}") for i in range(4)))
+        return start
+
+    start = asyncio.run(scenario())
+    times = offsets(bot.sent, start)
+    # В группу всплески не допускаются
+    for i, at in enumerate(times):
+        assert at >= i / 10 - EPS
+
+def test_retry_after_delays_the_chat():
+    bot = FakeBot()
+    bot.flood[1] = [1]
+    sender = Sender(bot, global_rate=1000, chat_rate=100, chat_burst=5)
+
+    async def scenario():
+        start = time.monotonic()
+        first = asyncio.ensure_future(sender.send_message(1, "first"))
+        await asyncio.sleep(0.1)
+        # Пришло во время паузы: ждёт вместе с повтором, хотя токены чата есть
+        second = sender.send_message(1, "second")
+        other = sender.send_message(2, "other")
+        await asyncio.gather(first, second, other)
+        return start
+
+    start = asyncio.run(scenario())
+    sent = {text: at - start for at, _, text in bot.sent}
+    assert len(bot.attempts) == 4
+    assert sent["other"] < 0.2
+    assert sent["first"] >= 1 - EPS
+    assert sent["second"] >= 1 - EPS
+    assert sent["first"] < 1.3
+
+def test_retry_after_gives_up_after_max_retries():
+    bot = FakeBot()
+    bot.flood[1] = [0, 0, 0]
+    sender = Sender(bot, global_rate=1000, max_retries=2)
+
+    with pytest.raises(RetryAfter):
+        asyncio.run(sender.send_message(1, "lost"))
+    assert len(bot.attempts) == 3
+    assert bot.sent == []
+
+def test_pending_edits_coalesce_to_last_text():
+    bot = FakeBot()
+    sender = Sender(bot, global_rate=1000, chat_rate=10, chat_burst=1)
+
+    async def scenario():
+        message = await sender.send_message(1, "status")
+        results = []
+        for i in range(20):
+            results.append(asyncio.ensure_future(sender.edit_text(message, f"step {i}")))
+            await asyncio.sleep(0.01)
+        await asyncio.gather(*results)
+        return message, results
+
+    message, results = asyncio.run(scenario())
+    texts = [text for _, text in message.edits]
+    # 20 правок за 0.2 с при лимите 10 в секунду - 2-4 вызова, последний текст не теряется
+    assert 2 <= len(texts) <= 4
+    assert texts[-1] == "step 19"
+    assert texts == sorted(texts, key=lambda text: int(text.split()[1]))
+    # Каждый вызов получает результат той отправки, в которую попала его правка
+    assert {result.result() for result in results} == set(texts)
+
+def test_notifications_batched_per_chat():
+    bot = FakeBot()
+    sender = Sender(bot, global_rate=1000, batch_delay=0.05)
+
+    async def scenario():
+        for i in range(5):
+            sender.notify(1, f"n{i}")
+        sender.notify(2, "other")
+        await asyncio.sleep(0.2)
+        sender.notify(1, "late")
+        await sender.close()
+
+    asyncio.run(scenario())
+    sent = [(chat, text) for _, chat, text in bot.sent]
+    assert sent[:2] == [(1, "n0\n\nn1\n\nn2\n\nn3\n\nn4"), (2, "other")]
+    # close отправляет накопленное, не дожидаясь batch_delay
+    assert sent[2:] == [(1, "late")]
+
+def test_many_chats_under_load():
+    bot = FakeBot()
+    sender = Sender(bot, global_rate=50, chat_rate=20, chat_burst=2)
+    for chat in range(1, 11):
+        bot.flood[chat] = [0] if chat % 3 == 0 else []
+
+    async def scenario():
+        start = time.monotonic()
+        await asyncio.gather(*(
+            sender.send_message(chat, f"{chat}:{i}")
+            for i in range(10) for chat in range(1, 11)
+        ))
+        return start
+
+    start = asyncio.run(scenario())
+    assert len(bot.sent) == 100
+    assert len(bot.attempts) == 100 + 3
+    times = sorted(offsets(bot.sent, start))
+    for i, at in enumerate(times):
+        assert at >= (i - 49) / 50 - EPS
+    assert times[-1] < 50 / 50 + 0.2
+    for chat in range(1, 11):
+        chat_times = [at - start for at, sent_chat, _ in bot.sent if sent_chat == chat]
+        assert len(chat_times) == 10
+        for i, at in enumerate(chat_times):
+            assert at >= (i - 1) / 20 - EPS
@@ -0,0 +1,44 @@
+import asyncio
+from types import SimpleNamespace
+
+from handlers.user import _parse_backup_callback
+from ssh_manager import ServerGroup
+
+class FakeManager:
+    """Сервер 1С с готовым ответом на запрос списка баз (None - ошибка rac)"""
+
+    def __init__(self, host: str, databases):
+        self.pool = SimpleNamespace(host=host)
+        self.databases = databases
+
+    async def get_1c_databases(self):
+        return self.databases
+
+def test_empty_host_is_not_unavailable():
+    ssh = ServerGroup([
+        FakeManager("srv1", [{"name": "buh", "host": "srv1"}]),
+        FakeManager("srv2", []),
+        FakeManager("srv3", None),
+    ])
+
+    databases, unavailable = asyncio.run(ssh.get_1c_databases())
+
+    assert [db_info["name"] for db_info in databases] == ["buh"]
+    assert unavailable == ["srv3"]
+
+def test_backup_callback_outside_host_list():
+    ssh = ServerGroup([FakeManager("srv1", []), FakeManager("srv2", [])])
+
+    assert _parse_backup_callback(ssh, f"backup_{ssh.host_key('srv2')}|buh") == ("srv2", "buh")
+    # Кнопки, созданные до перезагрузки с другим списком серверов, и старый формат
+    for data in ("backup_5|buh", "backup_x|buh", "backup_1|buh", "backup_buh"):
+        assert _parse_backup_callback(ssh, data)[0] is None
+
+def test_backup_callback_after_reload():
+    old = ServerGroup([FakeManager("srv1", []), FakeManager("srv2", [])])
+    data = f"backup_{old.host_key('srv2')}|buh"
+    # Перезагрузка настроек: тот же набор хостов в другом порядке
+    new = ServerGroup([FakeManager("srv2", []), FakeManager("srv1", [])])
+
+    assert _parse_backup_callback(new, data)[0] is None
+    assert _parse_backup_callback(new, f"backup_{new.host_key('srv2')}|buh") == ("srv2", "buh")
@@ -0,0 +1,63 @@
+import asyncio
+from types import SimpleNamespace
+
+from throttle import NORMAL, PAUSED, THROTTLED, LoadThrottle
+
+class FakePool:
+    """Пул без SSH: запоминает команды"""
+
+    host = "srv1c"
+
+    def __init__(self):
+        self.commands = []
+
+    async def run(self, command: str):
+        self.commands.append(command)
+        return SimpleNamespace(stdout="0\n", stderr="", exit_status=0)
+
+def make_throttle() -> LoadThrottle:
+    throttle = LoadThrottle(FakePool(), interval=0, max_load=1.0, max_iowait=30)
+    throttle.pid_dir = "/home/usr1cv8/dump_1s_dt/.throttle"
+    return throttle
+
+def sample(load: float) -> dict:
+    return {"load": load, "iowait": None, "sessions": None}
+
+def test_levels_by_load():
+    throttle = make_throttle()
+    assert throttle._decide(sample(0.5)) == NORMAL
+    assert throttle._decide(sample(1.2)) == THROTTLED
+    assert throttle._decide(sample(2.0)) == PAUSED
+
+def test_streaming_backup_is_never_paused():
+    throttle = make_throttle()
+
+    async def scenario():
+        levels = []
+        async with throttle.track(streaming=True):
+            levels.append(throttle._decide(sample(2.0)))
+        # После потоковой выгрузки пауза снова возможна
+        async with throttle.track():
+            levels.append(throttle._decide(sample(2.0)))
+        return levels
+
+    assert asyncio.run(scenario()) == [THROTTLED, PAUSED]
+
+def test_streaming_backup_resumes_paused_uploads():
+    throttle = make_throttle()
+
+    async def scenario():
+        async with throttle.track():
+            throttle._change(PAUSED, "test")
+            throttle.pool.commands.clear()
+            async with throttle.track(streaming=True):
+                level = throttle.level
+                commands = list(throttle.pool.commands)
+        return level, commands
+
+    level, commands = asyncio.run(scenario())
+    assert level == THROTTLED
+    # Приостановленные процессы получают SIGCONT, SIGSTOP не посылается
+    assert len(commands) == 1
+    assert 'kill -CONT' in commands[0] and 'kill -STOP' not in commands[0]
+    assert throttle.level == NORMAL
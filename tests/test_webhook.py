@@ -0,0 +1,103 @@
+import asyncio
+import json
+import socket
+
+from aiogram import Bot, Dispatcher, types
+from aiohttp import ClientSession
+from aiohttp.test_utils import TestClient, TestServer
+
+from config import Webhook
+from webhook import SECRET_HEADER, create_webhook_app, run_webhook
+
+TOKEN = "123456:" + "A" * 35
+SECRET = "s3cret"
+
+UPDATE = {
+    "update_id": 1,
+    "message": {
+        "message_id": 10,
+        "date": 1700000000,
+        "chat": {"id": 42, "type": "private"},
+        "from": {"id": 42, "is_bot": False, "first_name": "Test"},
+        "text": "/start",
+    },
+}
+
+class FakeBot(Bot):
+    """Bot без сети: запоминает вызовы set_webhook и delete_webhook"""
+
+    def __init__(self):
+        super().__init__(TOKEN)
+        self.calls = []
+
+    async def set_webhook(self, url, **kwargs):
+        self.calls.append(("set_webhook", url, kwargs.get("secret_token")))
+        return True
+
+    async def delete_webhook(self, **kwargs):
+        self.calls.append(("delete_webhook",))
+        return True
+
+def make_dispatcher():
+    dp = Dispatcher(FakeBot())
+    received = []
+
+    async def on_message(message: types.Message):
+        received.append(message.text)
+
+    dp.register_message_handler(on_message)
+    return dp, received
+
+async def post(dp: Dispatcher, body, headers: dict) -> int:
+    """Поддельный клиент Telegram: POST обновления в приложение webhook"""
+    async with TestClient(TestServer(create_webhook_app(dp, "/webhook", SECRET))) as client:
+        data = body if isinstance(body, (str, bytes)) else json.dumps(body)
+        response = await client.post("/webhook", data=data, headers=headers)
+        return response.status
+
+def test_update_with_secret_is_processed():
+    dp, received = make_dispatcher()
+    status = asyncio.run(post(dp, UPDATE, {SECRET_HEADER: SECRET}))
+    assert status == 200
+    assert received == ["/start"]
+
+def test_wrong_or_missing_secret_is_rejected():
+    dp, received = make_dispatcher()
+    assert asyncio.run(post(dp, UPDATE, {SECRET_HEADER: "wrong"})) == 401
+    assert asyncio.run(post(dp, UPDATE, {})) == 401
+    assert received == []
+
+def test_malformed_body_is_rejected():
+    dp, received = make_dispatcher()
+    for body in ("{not json", "[]", "1", "null"):
+        assert asyncio.run(post(dp, body, {SECRET_HEADER: SECRET})) == 400, body
+    assert received == []
+
+def test_run_webhook_registers_and_removes_webhook():
+    dp, received = make_dispatcher()
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    config = Webhook(enabled=True, url="https://bot.example.com/", host="127.0.0.1",
+                     port=port, secret=SECRET)
+
+    async def scenario():
+        stop = asyncio.Event()
+        server = asyncio.ensure_future(run_webhook(dp, config, stop))
+        for _ in range(100):
+            if dp.bot.calls:
+                break
+            await asyncio.sleep(0.01)
+        async with ClientSession() as session:
+            async with session.post(f"http://127.0.0.1:{port}/webhook", json=UPDATE,
+                                    headers={SECRET_HEADER: SECRET}) as response:
+                assert response.status == 200
+        stop.set()
+        await server
+
+    asyncio.run(scenario())
+    assert dp.bot.calls == [
+        ("set_webhook", "https://bot.example.com/webhook", SECRET),
+        ("delete_webhook",),
+    ]
+    assert received == ["/start"]